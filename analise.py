@@ -0,0 +1,317 @@
+"""
+Análise da justiça do rodízio a partir do histórico de protocolos.
+
+Lê os protocolos do período com um cursor no servidor, em lotes, ordenados
+por consultor e data (índice idx_protocolos_consultor_created), e acumula
+em arrays NumPy só o que é por consultor ou por faixa de intervalo. A
+memória usada depende do número de consultores e do tamanho do lote, não
+do número de protocolos.
+
+Resultados:
+- por consultor: protocolos, intervalo médio e máximo entre atribuições e
+  protocolos por hora de escala;
+- por idioma, entre os consultores que o falam: média, variância e Gini
+  dos protocolos por consultor e dos protocolos por hora de escala;
+- distribuição dos intervalos entre atribuições, geral e por idioma, em
+  faixas logarítmicas.
+
+Protocolos não guardam o idioma do lead, então o recorte por idioma é o dos
+idiomas do consultor. O tempo online vem da escala de turnos (não há
+histórico de status); consultores sem turnos ficam sem horas.
+
+As estatísticas por idioma consideram só os consultores que participaram do
+rodízio no período: não removidos antes do início e com ao menos um
+protocolo, horas de escala ou, se ainda cadastrados, ativos na sequência.
+Os demais aparecem na tabela por consultor com na_populacao falso, em vez de
+entrarem como zeros na média e no Gini.
+"""
+import csv
+import os
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import text
+
+import estatisticas
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - pyarrow é opcional
+    pyarrow = None
+
+ANALISE_LOTE = int(os.getenv("ANALISE_LOTE", "50000"))
+
+# Faixas dos intervalos: [0, 1s) e 20 faixas por década de 1s a 10^8s (~3 anos);
+# os percentis são a borda superior da faixa, com erro de até 12%
+BORDAS_INTERVALO_S = np.concatenate(([0.0], np.logspace(0, 8, 161)))
+
+_SQL_PROTOCOLOS = text("""
+    SELECT consultor_id, CAST(EXTRACT(EPOCH FROM created_at) AS DOUBLE PRECISION) AS instante
+    FROM protocolos
+    WHERE consultor_id IS NOT NULL
+    AND created_at >= :desde AND created_at < :ate
+    ORDER BY consultor_id, created_at
+""")
+
+# Consultores removidos antes do período não participaram dele
+_SQL_CONSULTORES = text("""
+    SELECT id, nome, idiomas,
+           deleted_at IS NULL AND status_ativo AND status_ativo_sequencial AS na_sequencia
+    FROM consultores
+    WHERE deleted_at IS NULL OR deleted_at >= :desde
+    ORDER BY id
+""")
+
+_SQL_TURNOS = text("""
+    SELECT consultor_id, dia_semana, inicio, fim FROM turnos_consultor
+""")
+
+
+def _faixas(intervalos: np.ndarray) -> np.ndarray:
+    indices = np.searchsorted(BORDAS_INTERVALO_S, intervalos, side="right") - 1
+    return np.minimum(indices, BORDAS_INTERVALO_S.size - 2)
+
+
+class AcumuladorProtocolos:
+    """
+    Acumula lotes de (consultor_id, instante) ordenados por consultor e
+    instante. Os protocolos de um consultor podem continuar no lote seguinte.
+    """
+
+    def __init__(self, consultor_ids: np.ndarray, idiomas_por_consultor: List[List[str]]):
+        self.consultor_ids = consultor_ids
+        self.idiomas = sorted({i for lista in idiomas_por_consultor for i in lista})
+        n = consultor_ids.size
+        # Matriz consultor x idioma; a última linha é de consultores já apagados
+        self.fala = np.zeros((n + 1, len(self.idiomas)), dtype=bool)
+        for posicao, lista in enumerate(idiomas_por_consultor):
+            for idioma in lista:
+                self.fala[posicao, self.idiomas.index(idioma)] = True
+
+        self.protocolos = np.zeros(n + 1, dtype=np.int64)
+        self.soma_intervalos = np.zeros(n + 1)
+        self.max_intervalo = np.zeros(n + 1)
+        self.primeiro = np.full(n + 1, np.nan)
+        self.ultimo = np.full(n + 1, np.nan)
+        self.faixas = np.zeros(BORDAS_INTERVALO_S.size - 1, dtype=np.int64)
+        self.faixas_idioma = np.zeros((len(self.idiomas), BORDAS_INTERVALO_S.size - 1), dtype=np.int64)
+        self.total = 0
+        self._anterior: Optional[tuple] = None
+
+    def _posicoes(self, ids: np.ndarray) -> np.ndarray:
+        posicoes = np.searchsorted(self.consultor_ids, ids)
+        posicoes = np.minimum(posicoes, self.consultor_ids.size - 1) if self.consultor_ids.size else posicoes
+        encontrado = self.consultor_ids[posicoes] == ids if self.consultor_ids.size else np.zeros(ids.size, bool)
+        return np.where(encontrado, posicoes, self.consultor_ids.size)
+
+    def adicionar(self, ids: np.ndarray, instantes: np.ndarray) -> None:
+        if ids.size == 0:
+            return
+        self.total += ids.size
+
+        # Intervalo até o protocolo anterior do mesmo consultor, inclusive do lote anterior
+        intervalos = np.empty(ids.size)
+        intervalos[1:] = np.diff(instantes)
+        valido = np.empty(ids.size, dtype=bool)
+        valido[1:] = ids[1:] == ids[:-1]
+        if self._anterior is not None and self._anterior[0] == ids[0]:
+            valido[0] = True
+            intervalos[0] = instantes[0] - self._anterior[1]
+        else:
+            valido[0] = False
+        self._anterior = (ids[-1], instantes[-1])
+
+        inicios = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        posicoes = self._posicoes(ids[inicios])
+        por_consultor = np.diff(np.r_[inicios, ids.size])
+        # add.at/maximum.at porque consultores já apagados dividem a última posição
+        intervalos_validos = np.where(valido, intervalos, 0.0)
+        np.add.at(self.protocolos, posicoes, por_consultor)
+        np.add.at(self.soma_intervalos, posicoes, np.add.reduceat(intervalos_validos, inicios))
+        np.maximum.at(self.max_intervalo, posicoes, np.maximum.reduceat(intervalos_validos, inicios))
+        np.fmin.at(self.primeiro, posicoes, instantes[inicios])
+        np.fmax.at(self.ultimo, posicoes, instantes[np.r_[inicios[1:], ids.size] - 1])
+
+        faixas = _faixas(intervalos[valido])
+        self.faixas += np.bincount(faixas, minlength=self.faixas.size)
+        fala = self.fala[np.repeat(posicoes, por_consultor)[valido]]
+        for k in range(len(self.idiomas)):
+            self.faixas_idioma[k] += np.bincount(faixas[fala[:, k]], minlength=self.faixas.size)
+
+    def intervalos_por_consultor(self) -> np.ndarray:
+        quantidade = np.maximum(self.protocolos - 1, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(quantidade > 0, self.soma_intervalos / quantidade, np.nan)
+
+
+def _datas(instantes: np.ndarray) -> np.ndarray:
+    """
+    Converte segundos desde 1970 (UTC) em datetime64, com NaT para NaN.
+    """
+    datas = np.full(instantes.size, np.datetime64("NaT"), dtype="datetime64[us]")
+    existe = ~np.isnan(instantes)
+    datas[existe] = (instantes[existe] * 1e6).astype(np.int64).astype("datetime64[us]")
+    return datas
+
+
+def _tabela(linhas: List[dict], colunas: List[str]) -> Dict[str, np.ndarray]:
+    return {
+        coluna: np.array([l[coluna] for l in linhas], dtype=object if coluna == "idioma" else None)
+        for coluna in colunas
+    }
+
+
+def percentis_faixas(faixas: np.ndarray, qs=estatisticas.PERCENTIS_PADRAO) -> Dict[str, float]:
+    """
+    Percentis aproximados a partir das contagens por faixa.
+    """
+    total = faixas.sum()
+    if total == 0:
+        return {f"p{q:g}": float("nan") for q in qs}
+    acumulado = np.cumsum(faixas)
+    return {
+        f"p{q:g}": float(BORDAS_INTERVALO_S[np.searchsorted(acumulado, total * q / 100.0) + 1])
+        for q in qs
+    }
+
+
+def horas_escala(turnos, desde: date, ate: date) -> Dict[int, float]:
+    """
+    Horas de escala de cada consultor nos dias [desde, ate).
+    """
+    dias = np.arange(np.datetime64(desde), np.datetime64(ate), dtype="datetime64[D]")
+    # 1970-01-01 foi uma quinta-feira (dia_semana 4)
+    ocorrencias = np.bincount((dias.astype(np.int64) + 3) % 7 + 1, minlength=8)
+    horas: Dict[int, float] = {}
+    for consultor_id, dia_semana, inicio, fim in turnos:
+        duracao = (datetime.combine(date.min, fim) - datetime.combine(date.min, inicio)).total_seconds()
+        if duracao <= 0:
+            duracao += 86400
+        horas[consultor_id] = horas.get(consultor_id, 0.0) + ocorrencias[dia_semana] * duracao / 3600.0
+    return horas
+
+
+@dataclass
+class Analise:
+    desde: date
+    ate: date
+    protocolos: int
+    consultores: Dict[str, np.ndarray]
+    idiomas: Dict[str, np.ndarray]
+    intervalos: Dict[str, np.ndarray]
+    resumo_intervalos: Dict[str, float]
+
+
+def analisar(engine, desde: date, ate: date, fuso: str, lote: int = ANALISE_LOTE) -> Analise:
+    """
+    Executa a análise do período [desde, ate), com as datas no fuso `fuso`.
+    """
+    tz = ZoneInfo(fuso)
+    periodo = {
+        "desde": datetime.combine(desde, datetime.min.time(), tz),
+        "ate": datetime.combine(ate, datetime.min.time(), tz)
+    }
+    with engine.connect() as conn:
+        consultores = conn.execute(_SQL_CONSULTORES, {"desde": periodo["desde"]}).all()
+        turnos = conn.execute(_SQL_TURNOS).all()
+
+        consultor_ids = np.array([c.id for c in consultores], dtype=np.int64)
+        acumulador = AcumuladorProtocolos(consultor_ids, [list(c.idiomas or ()) for c in consultores])
+        # Cursor nomeado no servidor; partitions(lote) limita as linhas em memória
+        resultado = conn.execution_options(stream_results=True, max_row_buffer=lote).execute(_SQL_PROTOCOLOS, periodo)
+        for linhas in resultado.partitions(lote):
+            # Transpor com zip evita que o NumPy percorra cada Row como sequência
+            ids, instantes = zip(*linhas)
+            acumulador.adicionar(np.array(ids, dtype=np.int64), np.array(instantes, dtype=np.float64))
+
+    n = consultor_ids.size
+    horas = horas_escala(turnos, desde, ate)
+    horas_consultor = np.array([horas.get(int(i), np.nan) for i in consultor_ids])
+    protocolos = acumulador.protocolos[:n]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        por_hora = np.where(horas_consultor > 0, protocolos / horas_consultor, np.nan)
+    na_sequencia = np.array([bool(c.na_sequencia) for c in consultores], dtype=bool)
+    populacao = (protocolos > 0) | (horas_consultor > 0) | na_sequencia
+
+    tabela_consultores = {
+        "consultor_id": consultor_ids,
+        "nome": np.array([c.nome for c in consultores], dtype=object),
+        "idiomas": np.array(["+".join(c.idiomas or ()) for c in consultores], dtype=object),
+        "protocolos": protocolos,
+        "horas_escala": horas_consultor,
+        "protocolos_por_hora": por_hora,
+        "intervalo_medio_h": acumulador.intervalos_por_consultor()[:n] / 3600.0,
+        "intervalo_max_h": np.where(protocolos > 1, acumulador.max_intervalo[:n] / 3600.0, np.nan),
+        "primeiro": _datas(acumulador.primeiro[:n]),
+        "ultimo": _datas(acumulador.ultimo[:n]),
+        "na_populacao": populacao
+    }
+
+    colunas_idioma = ["idioma", "consultores", "protocolos", "media", "variancia", "gini",
+                      "consultores_com_escala", "gini_por_hora"]
+    colunas_idioma += [f"intervalo_p{q:g}_h" for q in estatisticas.PERCENTIS_PADRAO]
+    linhas_idioma = []
+    for k, idioma in enumerate(acumulador.idiomas):
+        fala = acumulador.fala[:n, k] & populacao
+        contagem = protocolos[fala].astype(np.float64)
+        taxa = por_hora[fala & ~np.isnan(por_hora)]
+        linhas_idioma.append({
+            "idioma": idioma,
+            "consultores": int(fala.sum()),
+            "protocolos": int(contagem.sum()),
+            "media": float(contagem.mean()) if contagem.size else float("nan"),
+            "variancia": float(contagem.var()) if contagem.size else float("nan"),
+            "gini": estatisticas.gini(contagem),
+            "consultores_com_escala": int(taxa.size),
+            "gini_por_hora": estatisticas.gini(taxa),
+            **{f"intervalo_{q}_h": v / 3600.0 for q, v in percentis_faixas(acumulador.faixas_idioma[k]).items()}
+        })
+
+    faixas = np.vstack([acumulador.faixas, acumulador.faixas_idioma])
+    grupos = ["total"] + acumulador.idiomas
+    grupo, faixa = np.nonzero(faixas)
+    tabela_intervalos = {
+        "idioma": np.array([grupos[g] for g in grupo], dtype=object),
+        "de_s": BORDAS_INTERVALO_S[faixa],
+        "ate_s": BORDAS_INTERVALO_S[faixa + 1],
+        "quantidade": faixas[grupo, faixa]
+    }
+
+    resumo_intervalos = {
+        "quantidade": int(acumulador.faixas.sum()),
+        **{f"{q}_h": v / 3600.0 for q, v in percentis_faixas(acumulador.faixas).items()}
+    }
+    return Analise(desde, ate, acumulador.total, tabela_consultores, _tabela(linhas_idioma, colunas_idioma),
+                   tabela_intervalos, resumo_intervalos)
+
+
+def exportar(analise: Analise, diretorio: str, formato: str = "auto") -> List[str]:
+    """
+    Grava consultores, idiomas e intervalos em Parquet (com pyarrow) ou CSV.
+    """
+    if formato == "auto":
+        formato = "parquet" if pyarrow is not None else "csv"
+    if formato == "parquet" and pyarrow is None:
+        raise RuntimeError("Exportação em Parquet requer o pacote pyarrow")
+
+    os.makedirs(diretorio, exist_ok=True)
+    arquivos = []
+    for nome, tabela in (("consultores", analise.consultores), ("idiomas", analise.idiomas),
+                         ("intervalos", analise.intervalos)):
+        caminho = os.path.join(diretorio, f"{nome}.{formato}")
+        if formato == "parquet":
+            pyarrow.parquet.write_table(
+                pyarrow.table({coluna: list(v) if v.dtype == object else v for coluna, v in tabela.items()}),
+                caminho, compression="zstd"
+            )
+        else:
+            with open(caminho, "w", newline="", encoding="utf-8") as f:
+                escritor = csv.writer(f)
+                escritor.writerow(tabela.keys())
+                escritor.writerows(zip(*(v.tolist() for v in tabela.values())))
+        arquivos.append(caminho)
+    return arquivos
@@ -0,0 +1,360 @@
+"""
+Índice em memória da disponibilidade de consultores por idioma.
+
+As regras de elegibilidade e de ordem da fila são as mesmas da distribuição
+(`get_consultor_da_vez`): consultor ativo, ativo na sequência, online e com o
+idioma; o próximo é o de atendimento mais antigo, com o menor id no empate.
+
+Cada worker mantém o próprio índice. Um trigger em `consultores` envia com
+NOTIFY cada alteração que afeta a disponibilidade (escritas da API,
+distribuições, transições de turno, escritas fora da API), e todos os
+workers e réplicas a aplicam na ordem dos commits, por uma conexão com
+LISTEN fora do pool. Enquanto essa conexão está ativa, as escritas do
+próprio worker também chegam por ela, para que nenhuma seja aplicada fora
+de ordem.
+
+A recarga completa é só uma rede de segurança (DISPONIBILIDADE_RESYNC_S,
+padrão 300 s). Com DISPONIBILIDADE_LISTEN=false (ex.: PgBouncer em modo
+transaction, que não repassa notificações) o índice só vê as escritas do
+próprio worker e a recarga passa a ser o limite da defasagem (padrão 10 s).
+Cada alteração aplicada recebe uma versão, e a recarga não sobrescreve
+consultores alterados depois do início da sua leitura.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger("api")
+
+DISPONIBILIDADE_LISTEN = os.getenv("DISPONIBILIDADE_LISTEN", "true").lower() in ("1", "true", "yes")
+DISPONIBILIDADE_RESYNC_S = float(os.getenv("DISPONIBILIDADE_RESYNC_S") or ("300" if DISPONIBILIDADE_LISTEN else "10"))
+DISPONIBILIDADE_RECONEXAO_S = 5.0
+
+CANAL_NOTIFICACOES = "consultores_alterados"
+
+# Mesmo valor do COALESCE da query de distribuição
+NUNCA_ATENDIDO = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class EstadoConsultor:
+    id: int
+    nome: str
+    idiomas: Tuple[str, ...]
+    status_ativo: bool
+    status_ativo_sequencial: bool
+    status_online: bool
+    ultimo_atendimento: Optional[datetime]
+
+    @classmethod
+    def da_linha(cls, dados) -> "EstadoConsultor":
+        """
+        Monta o estado a partir de uma linha (ou dicionário) da tabela consultores.
+        """
+        return cls(
+            id=dados["id"],
+            nome=dados["nome"],
+            idiomas=tuple(dados["idiomas"] or ()),
+            status_ativo=bool(dados["status_ativo"]),
+            status_ativo_sequencial=bool(dados["status_ativo_sequencial"]),
+            status_online=bool(dados["status_online"]),
+            ultimo_atendimento=dados["ultimo_atendimento"]
+        )
+
+
+def elegivel(consultor: EstadoConsultor) -> bool:
+    """
+    Indica se o consultor pode receber atendimentos.
+    """
+    return consultor.status_ativo and consultor.status_ativo_sequencial and consultor.status_online
+
+
+def chave_fila(consultor: EstadoConsultor) -> Tuple[datetime, int]:
+    """
+    Posição do consultor na fila: atendimento mais antigo primeiro, depois menor id.
+    """
+    return (consultor.ultimo_atendimento or NUNCA_ATENDIDO, consultor.id)
+
+
+class IndiceDisponibilidade:
+    """
+    Mantém, por idioma, o conjunto de consultores elegíveis e um heap com a
+    ordem da fila. Entradas desatualizadas do heap são descartadas quando
+    chegam ao topo, então a consulta custa O(idiomas) amortizado.
+
+    Cada atualização ou remoção local incrementa a versão do índice e a
+    registra para o consultor; a recarga compara essas versões com a versão
+    lida antes da sua query.
+    """
+
+    def __init__(self):
+        self.carregado = False
+        # Verdadeiro enquanto as alterações chegam pelo LISTEN
+        self.ouvindo = False
+        self.atualizado_em: Optional[datetime] = None
+        self._consultores: Dict[int, EstadoConsultor] = {}
+        self._elegiveis: Dict[str, Set[int]] = {}
+        self._filas: Dict[str, List[Tuple[datetime, int]]] = {}
+        self._versao = 0
+        # Versão da última alteração local de cada consultor (inclusive remoções)
+        self._versoes: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def versao(self) -> int:
+        with self._lock:
+            return self._versao
+
+    def _marcar(self, consultor_id: int) -> None:
+        self._versao += 1
+        self._versoes[consultor_id] = self._versao
+        self.atualizado_em = datetime.now(timezone.utc)
+
+    def carregar(self, consultores: Iterable[EstadoConsultor], lido_na_versao: Optional[int] = None) -> None:
+        """
+        Substitui o conteúdo do índice pelos consultores lidos do banco.
+        Com `lido_na_versao` (a versão do índice antes da leitura), os
+        consultores alterados localmente depois disso mantêm o estado local,
+        que é mais novo que o lido.
+        """
+        novos = {c.id: c for c in consultores}
+        with self._lock:
+            if lido_na_versao is not None:
+                for consultor_id, versao in self._versoes.items():
+                    if versao <= lido_na_versao:
+                        continue
+                    local = self._consultores.get(consultor_id)
+                    if local is not None:
+                        novos[consultor_id] = local
+                    else:
+                        novos.pop(consultor_id, None)
+                self._versoes = {i: v for i, v in self._versoes.items() if v > lido_na_versao}
+            else:
+                self._versoes = {}
+            self._substituir(novos)
+
+    def _substituir(self, novos: Dict[int, EstadoConsultor]) -> None:
+        elegiveis: Dict[str, Set[int]] = {}
+        filas: Dict[str, List[Tuple[datetime, int]]] = {}
+        for consultor in novos.values():
+            for idioma in consultor.idiomas:
+                elegiveis.setdefault(idioma, set())
+                filas.setdefault(idioma, [])
+                if elegivel(consultor):
+                    elegiveis[idioma].add(consultor.id)
+                    filas[idioma].append(chave_fila(consultor))
+        for fila in filas.values():
+            heapq.heapify(fila)
+
+        self._consultores = novos
+        self._elegiveis = elegiveis
+        self._filas = filas
+        self.carregado = True
+        self.atualizado_em = datetime.now(timezone.utc)
+
+    def atualizar(self, consultor: EstadoConsultor) -> None:
+        with self._lock:
+            self._retirar(consultor.id)
+            self._consultores[consultor.id] = consultor
+            for idioma in consultor.idiomas:
+                elegiveis = self._elegiveis.setdefault(idioma, set())
+                fila = self._filas.setdefault(idioma, [])
+                if elegivel(consultor):
+                    elegiveis.add(consultor.id)
+                    heapq.heappush(fila, chave_fila(consultor))
+                    # Compacta filas com muitas entradas desatualizadas
+                    if len(fila) > 2 * len(elegiveis) + 64:
+                        self._filas[idioma] = [
+                            chave_fila(self._consultores[i]) for i in elegiveis
+                        ]
+                        heapq.heapify(self._filas[idioma])
+            self._marcar(consultor.id)
+
+    def registrar_atendimento(self, consultor_id: int, quando: datetime) -> None:
+        """
+        Move o consultor para o fim da fila após uma distribuição.
+        """
+        with self._lock:
+            atual = self._consultores.get(consultor_id)
+        if atual is not None:
+            self.atualizar(replace(atual, ultimo_atendimento=quando))
+
+    def remover(self, consultor_id: int) -> None:
+        with self._lock:
+            self._retirar(consultor_id)
+            self._consultores.pop(consultor_id, None)
+            self._marcar(consultor_id)
+
+    def _retirar(self, consultor_id: int) -> None:
+        # As entradas antigas do heap ficam e são descartadas no topo
+        anterior = self._consultores.get(consultor_id)
+        if anterior is not None:
+            for idioma in anterior.idiomas:
+                self._elegiveis.get(idioma, set()).discard(consultor_id)
+
+    def _proximo(self, idioma: str) -> Optional[EstadoConsultor]:
+        fila = self._filas.get(idioma, [])
+        elegiveis = self._elegiveis.get(idioma, set())
+        while fila:
+            chave, consultor_id = fila[0]
+            consultor = self._consultores.get(consultor_id)
+            if consultor_id in elegiveis and consultor is not None and chave_fila(consultor) == (chave, consultor_id):
+                return consultor
+            heapq.heappop(fila)
+        return None
+
+    def snapshot(self, idioma: Optional[str] = None) -> List[dict]:
+        """
+        Retorna, por idioma, a quantidade de elegíveis e o próximo da fila.
+        """
+        with self._lock:
+            idiomas = [idioma] if idioma is not None else sorted(self._elegiveis)
+            return [
+                {
+                    "idioma": i,
+                    "elegiveis": len(self._elegiveis.get(i, ())),
+                    "proximo": self._proximo(i)
+                }
+                for i in idiomas
+            ]
+
+
+indice = IndiceDisponibilidade()
+
+_SQL_CARREGAR = text("""
+    SELECT id, nome, idiomas, status_ativo, status_ativo_sequencial, status_online, ultimo_atendimento
+    FROM consultores
+    WHERE deleted_at IS NULL
+""")
+
+
+def recarregar() -> None:
+    """
+    Recarrega o índice com uma única query, sem desfazer alterações locais
+    aplicadas enquanto ela rodava.
+    """
+    # Importado aqui porque database conecta ao banco na importação e as
+    # regras deste módulo também são usadas fora da aplicação
+    from database import SessionLocal
+
+    versao = indice.versao()
+    db = SessionLocal()
+    try:
+        rows = db.execute(_SQL_CARREGAR).mappings().all()
+    finally:
+        db.close()
+    indice.carregar((EstadoConsultor.da_linha(row) for row in rows), lido_na_versao=versao)
+
+
+def aplicar_notificacao(payload: str) -> None:
+    """
+    Aplica ao índice a linha enviada pelo trigger notificar_consultor_alterado.
+    """
+    dados = json.loads(payload)
+    if dados["removido"]:
+        indice.remover(dados["id"])
+        return
+    if dados["ultimo_atendimento"] is not None:
+        dados["ultimo_atendimento"] = datetime.fromisoformat(dados["ultimo_atendimento"])
+    indice.atualizar(EstadoConsultor.da_linha(dados))
+
+
+def _conectar():
+    from database import conectar_direto
+
+    conn = conectar_direto()
+    with conn.cursor() as cursor:
+        cursor.execute(f"LISTEN {CANAL_NOTIFICACOES}")
+    return conn
+
+
+async def _ouvir(conn, parar: asyncio.Event) -> None:
+    """
+    Aplica as notificações até `parar` ou até a conexão cair, recarregando o
+    índice a cada DISPONIBILIDADE_RESYNC_S segundos.
+    """
+    loop = asyncio.get_running_loop()
+    pronto = asyncio.Event()
+    loop.add_reader(conn.fileno(), pronto.set)
+    try:
+        proxima_recarga = loop.time() + DISPONIBILIDADE_RESYNC_S
+        while not parar.is_set():
+            espera = proxima_recarga - loop.time()
+            if espera <= 0:
+                await asyncio.to_thread(recarregar)
+                proxima_recarga = loop.time() + DISPONIBILIDADE_RESYNC_S
+                continue
+            try:
+                # Acorda ao menos a cada segundo para observar `parar`
+                await asyncio.wait_for(pronto.wait(), timeout=min(espera, 1.0))
+            except asyncio.TimeoutError:
+                continue
+            pronto.clear()
+            conn.poll()
+            while conn.notifies:
+                aplicar_notificacao(conn.notifies.pop(0).payload)
+    finally:
+        loop.remove_reader(conn.fileno())
+
+
+async def _aguardar(parar: asyncio.Event, segundos: float) -> None:
+    try:
+        await asyncio.wait_for(parar.wait(), timeout=segundos)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _sincronizar(parar: asyncio.Event) -> None:
+    while not parar.is_set():
+        conn = None
+        try:
+            conn = await asyncio.to_thread(_conectar)
+            # A carga completa vem depois do LISTEN, então nenhuma escrita
+            # confirmada entre as duas fica de fora do índice
+            await asyncio.to_thread(recarregar)
+            indice.ouvindo = True
+            await _ouvir(conn, parar)
+        except Exception as e:
+            logger.error(f"DISPONIBILIDADE | erro na sincronização do índice: {str(e)}")
+        finally:
+            indice.ouvindo = False
+            if conn is not None:
+                conn.close()
+        await _aguardar(parar, DISPONIBILIDADE_RECONEXAO_S)
+
+
+async def _ressincronizar(parar: asyncio.Event) -> None:
+    while not parar.is_set():
+        try:
+            await asyncio.to_thread(recarregar)
+        except Exception as e:
+            logger.error(f"DISPONIBILIDADE | erro ao recarregar índice: {str(e)}")
+        await _aguardar(parar, DISPONIBILIDADE_RESYNC_S)
+
+
+_parar: Optional[asyncio.Event] = None
+_tarefa: Optional[asyncio.Task] = None
+
+
+def iniciar() -> None:
+    """
+    Carrega o índice e agenda, no event loop, o LISTEN das alterações (ou só
+    as recargas periódicas, com DISPONIBILIDADE_LISTEN=false).
+    """
+    global _parar, _tarefa
+    _parar = asyncio.Event()
+    sincronizar = _sincronizar if DISPONIBILIDADE_LISTEN else _ressincronizar
+    _tarefa = asyncio.create_task(sincronizar(_parar))
+
+
+async def parar() -> None:
+    if _tarefa:
+        _parar.set()
+        await _tarefa
@@ -0,0 +1,110 @@
+"""
+Cache em memória do mapeamento Pipedrive -> consultor.
+
+O mapeamento muda pouco e é consultado a cada webhook do CRM. As escritas
+de consultor invalidam as entradas afetadas; o TTL limita a defasagem em
+relação a escritas feitas por outros workers.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+PIPEDRIVE_CACHE_TTL_S = float(os.getenv("PIPEDRIVE_CACHE_TTL_S", "60"))
+PIPEDRIVE_CACHE_MAX_SIZE = int(os.getenv("PIPEDRIVE_CACHE_MAX_SIZE", "50000"))
+
+
+class PipedriveCache:
+    """
+    Guarda, por id_pipedrive, os dados do consultor (ou None quando não existe).
+
+    Cada invalidação incrementa a geração do cache e registra a geração em
+    que aquele consultor e aquele id_pipedrive foram invalidados. Em
+    `guardar`, só os valores invalidados depois do início da carga são
+    descartados, evitando que uma leitura concorrente reponha um valor já
+    invalidado sem perder o restante do lote. Assim a distribuição, que
+    invalida o consultor atribuído, não derruba as cargas dos demais.
+    """
+
+    def __init__(self, ttl: float, tamanho_maximo: int):
+        self.ttl = ttl
+        self.tamanho_maximo = tamanho_maximo
+        self.geracao = 0
+        self._entradas: Dict[int, Tuple[float, Optional[dict]]] = {}
+        self._por_consultor: Dict[int, int] = {}
+        self._invalidado_pipedrive: Dict[int, int] = {}
+        self._invalidado_consultor: Dict[int, int] = {}
+        # Cargas iniciadas antes desta geração são descartadas por inteiro
+        self._descartar_ate = 0
+        self._lock = threading.Lock()
+
+    def obter(self, ids: Iterable[int]) -> Tuple[Dict[int, Optional[dict]], List[int]]:
+        """
+        Retorna os valores em cache e a lista de ids que precisam ser carregados.
+        """
+        agora = time.monotonic()
+        encontrados = {}
+        faltantes = []
+        for id_pipedrive in ids:
+            entrada = self._entradas.get(id_pipedrive)
+            if entrada is not None and entrada[0] > agora:
+                encontrados[id_pipedrive] = entrada[1]
+            else:
+                faltantes.append(id_pipedrive)
+        return encontrados, faltantes
+
+    def guardar(self, valores: Dict[int, Optional[dict]], geracao: int) -> None:
+        """
+        Guarda os valores carregados, se nenhuma invalidação ocorreu desde `geracao`.
+        """
+        expira_em = time.monotonic() + self.ttl
+        with self._lock:
+            if geracao < self._descartar_ate:
+                return
+            if len(self._entradas) + len(valores) > self.tamanho_maximo:
+                self._entradas.clear()
+                self._por_consultor.clear()
+            for id_pipedrive, consultor in valores.items():
+                if self._invalidado_pipedrive.get(id_pipedrive, -1) >= geracao:
+                    continue
+                if consultor is not None and self._invalidado_consultor.get(consultor["id"], -1) >= geracao:
+                    continue
+                self._entradas[id_pipedrive] = (expira_em, consultor)
+                if consultor is not None:
+                    self._por_consultor[consultor["id"]] = id_pipedrive
+
+    def invalidar(self, consultor_id: Optional[int] = None, id_pipedrive: Optional[int] = None) -> None:
+        """
+        Remove as entradas do consultor e/ou do id_pipedrive informados.
+        """
+        with self._lock:
+            geracao = self.geracao
+            self.geracao += 1
+            if len(self._invalidado_consultor) + len(self._invalidado_pipedrive) > self.tamanho_maximo:
+                # Esquece as marcas antigas; as cargas em andamento são descartadas
+                self._invalidado_consultor.clear()
+                self._invalidado_pipedrive.clear()
+                self._descartar_ate = self.geracao
+            if consultor_id is not None:
+                self._invalidado_consultor[consultor_id] = geracao
+                anterior = self._por_consultor.pop(consultor_id, None)
+                if anterior is not None:
+                    self._entradas.pop(anterior, None)
+            if id_pipedrive is not None:
+                self._invalidado_pipedrive[id_pipedrive] = geracao
+                self._entradas.pop(id_pipedrive, None)
+
+    def limpar(self) -> None:
+        """
+        Remove todas as entradas.
+        """
+        with self._lock:
+            self.geracao += 1
+            self._descartar_ate = self.geracao
+            self._entradas.clear()
+            self._por_consultor.clear()
+            self._invalidado_consultor.clear()
+            self._invalidado_pipedrive.clear()
+
+
+pipedrive_cache = PipedriveCache(PIPEDRIVE_CACHE_TTL_S, PIPEDRIVE_CACHE_MAX_SIZE)
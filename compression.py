@@ -0,0 +1,144 @@
+"""
+Compressão negociada das respostas (brotli ou gzip).
+
+Middleware ASGI que comprime o corpo quando o cliente aceita a codificação
+(Accept-Encoding) e a resposta passa de COMPRESSION_MIN_SIZE bytes. Respostas
+pequenas não compensam o custo de CPU e seguem sem compressão. Toda resposta
+que passa pela negociação leva Vary: Accept-Encoding, comprimida ou não. O brotli é
+usado quando o pacote está instalado e o cliente o prefere.
+"""
+import gzip
+import os
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli é opcional
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+# Qualidades altas do brotli são lentas demais para respostas dinâmicas
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+TIPOS_COMPRESSIVEIS = ("application/json", "text/")
+
+
+def escolher_codificacao(accept_encoding: str) -> Optional[str]:
+    """
+    Escolhe a codificação suportada com maior peso (q) no Accept-Encoding.
+    Em caso de empate, o brotli tem preferência.
+    """
+    suportadas = ["br", "gzip"] if brotli is not None else ["gzip"]
+    pesos = {}
+    for item in accept_encoding.split(","):
+        partes = item.strip().split(";")
+        nome = partes[0].strip().lower()
+        q = 1.0
+        for parametro in partes[1:]:
+            chave, _, valor = parametro.strip().partition("=")
+            if chave == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        pesos[nome] = q
+
+    melhor, melhor_q = None, 0.0
+    for codificacao in suportadas:
+        q = pesos.get(codificacao, pesos.get("*", 0.0))
+        if q > melhor_q:
+            melhor, melhor_q = codificacao, q
+    return melhor
+
+
+def comprimir(corpo: bytes, codificacao: str) -> bytes:
+    if codificacao == "br":
+        return brotli.compress(corpo, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(corpo, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+
+def _com_vary(headers):
+    """
+    Headers com Accept-Encoding acrescentado ao Vary (sem duplicar).
+    """
+    outros = [(k, v) for k, v in headers if k.lower() != b"vary"]
+    vary = [v for k, v in headers if k.lower() == b"vary"]
+    valores = {p.strip().lower() for v in vary for p in v.split(b",")}
+    if b"accept-encoding" not in valores and b"*" not in valores:
+        vary.append(b"Accept-Encoding")
+    if vary:
+        outros.append((b"vary", b", ".join(vary)))
+    return outros
+
+
+class CompressionMiddleware:
+    """
+    Acumula o corpo da resposta e o comprime de uma vez ao final.
+    As respostas da API são JSON de tamanho limitado, já montadas em memória.
+    """
+
+    def __init__(self, app, minimo: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimo = minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        codificacao = escolher_codificacao(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if codificacao is None:
+            # Sem compressão possível, mas a resposta ainda depende do
+            # Accept-Encoding: caches não podem servi-la a quem aceita gzip/br
+            async def enviar_sem_compressao(message):
+                if message["type"] == "http.response.start":
+                    message = {**message, "headers": _com_vary(message["headers"])}
+                await send(message)
+
+            await self.app(scope, receive, enviar_sem_compressao)
+            return
+
+        inicio = None
+        partes = []
+
+        async def enviar(message):
+            nonlocal inicio
+            if message["type"] == "http.response.start":
+                inicio = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            partes.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            corpo = b"".join(partes)
+            response_headers = [
+                (k, v) for k, v in _com_vary(inicio["headers"]) if k.lower() != b"content-length"
+            ]
+
+            if self._deve_comprimir(inicio["headers"], corpo):
+                corpo = comprimir(corpo, codificacao)
+                response_headers.append((b"content-encoding", codificacao.encode()))
+            response_headers.append((b"content-length", str(len(corpo)).encode()))
+
+            await send({**inicio, "headers": response_headers})
+            await send({"type": "http.response.body", "body": corpo})
+
+        await self.app(scope, receive, enviar)
+
+    def _deve_comprimir(self, headers, corpo: bytes) -> bool:
+        if len(corpo) < self.minimo:
+            return False
+        tipo = b""
+        for chave, valor in headers:
+            chave = chave.lower()
+            if chave == b"content-encoding":
+                return False
+            if chave == b"content-type":
+                tipo = valor
+        return tipo.decode("latin-1").startswith(TIPOS_COMPRESSIVEIS)
@@ -1,7 +1,8 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+from typing import Iterable, Optional
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
@@ -46,11 +47,62 @@ def ensure_database():
 # Tenta criar o banco se não existir
 ensure_database()
 
+# Driver do PostgreSQL: psycopg2 (padrão) ou psycopg (psycopg 3).
+# Com o psycopg 3, cada conexão prepara no servidor os comandos executados
+# DB_PREPARE_THRESHOLD vezes (o CTE da distribuição deixa de ser analisado e
+# planejado a cada chamada) e, com DB_PIPELINE, os timeouts da transação são
+# enviados na mesma ida ao banco que o primeiro comando.
+DB_DRIVER = os.getenv("DB_DRIVER", "psycopg2").lower()
+if DB_DRIVER not in ("psycopg2", "psycopg"):
+    raise ValueError(f"DB_DRIVER inválido: {DB_DRIVER} (use psycopg2 ou psycopg)")
+
+# "none" desativa os prepared statements (ex.: PgBouncer antigo em modo transaction)
+_prepare_threshold = os.getenv("DB_PREPARE_THRESHOLD", "5").lower()
+DB_PREPARE_THRESHOLD = None if _prepare_threshold in ("", "none") else int(_prepare_threshold)
+DB_PIPELINE = DB_DRIVER == "psycopg" and os.getenv("DB_PIPELINE", "true").lower() in ("1", "true", "yes")
+
+if DB_PIPELINE:
+    from psycopg import Pipeline
+    # O modo pipeline requer libpq 14 ou superior
+    DB_PIPELINE = Pipeline.is_supported()
+
 # String de conexão
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+if DB_DRIVER == "psycopg":
+    DATABASE_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    DB_CONNECT_ARGS = {"prepare_threshold": DB_PREPARE_THRESHOLD}
+else:
+    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    DB_CONNECT_ARGS = {}
+
+# Orçamento de conexões com o PostgreSQL.
+# DB_CONNECTION_BUDGET é o total de conexões que esta instância pode abrir;
+# ele é dividido entre os workers (WEB_CONCURRENCY) para que a soma de todos
+# os pools fique abaixo do max_connections do servidor.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_CONNECTION_BUDGET = os.getenv("DB_CONNECTION_BUDGET")
+
+# Conexões de cada worker abertas fora do pool: o LISTEN do índice de
+# disponibilidade (availability.py) e o EXPLAIN das queries lentas
+# (slow_queries.py)
+DB_CONEXOES_FORA_DO_POOL = 2
+
+if DB_CONNECTION_BUDGET:
+    DB_POOL_SIZE = max(1, int(DB_CONNECTION_BUDGET) // WEB_CONCURRENCY - DB_CONEXOES_FORA_DO_POOL)
+    DB_MAX_OVERFLOW = 0
+else:
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
 
 # Cria engine do SQLAlchemy
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    connect_args=DB_CONNECT_ARGS
+)
 
 # Cria sessão
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -58,6 +110,52 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Base para modelos
 Base = declarative_base()
 
+# Timeouts por classe de rota, em milissegundos (0 mantém o padrão do servidor).
+# Aplicados com SET LOCAL no início de cada transação da sessão.
+DB_TIMEOUTS = {
+    "dispatch": (
+        int(os.getenv("DB_DISPATCH_STATEMENT_TIMEOUT_MS", "2000")),
+        int(os.getenv("DB_DISPATCH_LOCK_TIMEOUT_MS", "500"))
+    ),
+    "read": (
+        int(os.getenv("DB_READ_STATEMENT_TIMEOUT_MS", "0")),
+        int(os.getenv("DB_READ_LOCK_TIMEOUT_MS", "0"))
+    ),
+    "write": (
+        int(os.getenv("DB_WRITE_STATEMENT_TIMEOUT_MS", "0")),
+        int(os.getenv("DB_WRITE_LOCK_TIMEOUT_MS", "0"))
+    )
+}
+
+# Chave em connection.info com o comando de timeouts ainda não enviado
+_TIMEOUTS_PENDENTES = "timeouts_pendentes"
+
+def _sql_timeouts(statement_timeout: int, lock_timeout: int, extras: Iterable[str] = ()) -> str:
+    """
+    Monta um único comando que aplica os timeouts (e outras chamadas
+    set_config, como as do auto_explain) à transação atual.
+    """
+    configuracoes = list(extras)
+    if statement_timeout:
+        configuracoes.append(f"set_config('statement_timeout', '{statement_timeout}ms', true)")
+    if lock_timeout:
+        configuracoes.append(f"set_config('lock_timeout', '{lock_timeout}ms', true)")
+    return "SELECT " + ", ".join(configuracoes) if configuracoes else ""
+
+def conectar_direto():
+    """
+    Abre uma conexão psycopg2 em autocommit fora do pool, para usos de longa
+    duração que não devem ocupar uma conexão das requisições.
+    """
+    conn = psycopg2.connect(
+        host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, dbname=DB_NAME,
+        application_name="gestao-consultores",
+        # Detecta conexões mortas sem tráfego (ex.: LISTEN parado)
+        keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+    )
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    return conn
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -65,3 +163,68 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_db_for(classe: str):
+    """
+    Retorna uma dependency de sessão com os timeouts da classe de rota.
+    """
+    from slow_queries import configuracoes_auto_explain
+
+    # O plano real da distribuição vem do auto_explain (ver slow_queries.py)
+    extras = configuracoes_auto_explain() if classe == "dispatch" else []
+    sql_timeouts = _sql_timeouts(*DB_TIMEOUTS[classe], extras=extras)
+
+    def aplicar_timeouts(session, transaction, connection):
+        if DB_PIPELINE:
+            # Enviado junto com o primeiro comando da transação
+            connection.info[_TIMEOUTS_PENDENTES] = sql_timeouts
+        else:
+            connection.exec_driver_sql(sql_timeouts)
+
+    def get_db_classe():
+        db = SessionLocal()
+        if sql_timeouts:
+            event.listen(db, "after_begin", aplicar_timeouts)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    return get_db_classe
+
+def _retirar_timeouts_pendentes(context) -> Optional[str]:
+    try:
+        info = context.root_connection.info
+    except NotImplementedError:
+        # Conexão usada na inicialização do dialeto, fora do pool
+        return None
+    return info.pop(_TIMEOUTS_PENDENTES, None)
+
+if DB_PIPELINE:
+    @event.listens_for(engine, "do_execute")
+    def _executar_em_pipeline(cursor, statement, parameters, context):
+        """
+        Envia o BEGIN, os timeouts pendentes e o comando em uma única ida ao
+        banco. Ao sair do pipeline os resultados já estão no cursor.
+        """
+        pendente = _retirar_timeouts_pendentes(context)
+        if pendente is None:
+            return False
+        conexao = cursor.connection
+        with conexao.pipeline():
+            conexao.execute(pendente)
+            cursor.execute(statement, parameters)
+        return True
+
+    @event.listens_for(engine, "do_executemany")
+    @event.listens_for(engine, "do_execute_no_params")
+    def _aplicar_timeouts_pendentes(cursor, statement, *args):
+        pendente = _retirar_timeouts_pendentes(args[-1])
+        if pendente is not None:
+            cursor.connection.execute(pendente)
+        return False
+
+    @event.listens_for(engine, "checkin")
+    def _descartar_timeouts_pendentes(dbapi_connection, connection_record):
+        # Transação encerrada sem nenhum comando
+        connection_record.info.pop(_TIMEOUTS_PENDENTES, None)
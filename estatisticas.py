@@ -0,0 +1,52 @@
+"""
+Estatísticas de distribuição usadas pelas ferramentas de análise.
+
+Funções puras sobre arrays NumPy, sem acesso ao banco.
+"""
+from typing import Dict, Sequence
+
+import numpy as np
+
+PERCENTIS_PADRAO = (50, 95, 99)
+
+
+def gini(valores) -> float:
+    """
+    Coeficiente de Gini de valores não negativos: 0 é uma divisão perfeitamente
+    igual e valores próximos de 1 indicam concentração em poucos consultores.
+    """
+    x = np.sort(np.asarray(valores, dtype=np.float64))
+    n = x.size
+    total = x.sum()
+    if n == 0 or total <= 0:
+        return 0.0
+    pesos = np.arange(1, n + 1, dtype=np.float64)
+    return float(2.0 * np.dot(pesos, x) / (n * total) - (n + 1) / n)
+
+
+def percentis(valores, qs: Sequence[float] = PERCENTIS_PADRAO) -> Dict[str, float]:
+    """
+    Percentis nomeados (p50, p95, ...); NaN quando não há valores.
+    """
+    x = np.asarray(valores, dtype=np.float64)
+    if x.size == 0:
+        return {f"p{q:g}": float("nan") for q in qs}
+    return {f"p{q:g}": float(v) for q, v in zip(qs, np.percentile(x, qs))}
+
+
+def resumo(valores, qs: Sequence[float] = PERCENTIS_PADRAO) -> Dict[str, float]:
+    """
+    Quantidade, média, desvio padrão, percentis, máximo e Gini dos valores.
+    """
+    x = np.asarray(valores, dtype=np.float64)
+    if x.size == 0:
+        return {"n": 0, "media": float("nan"), "desvio": float("nan"),
+                **percentis(x, qs), "max": float("nan"), "gini": 0.0}
+    return {
+        "n": int(x.size),
+        "media": float(x.mean()),
+        "desvio": float(x.std()),
+        **percentis(x, qs),
+        "max": float(x.max()),
+        "gini": gini(x)
+    }
@@ -0,0 +1,60 @@
+"""
+Configuração do Gunicorn para o modo de produção.
+
+Executa vários workers Uvicorn sob o Gunicorn, com a aplicação pré-carregada
+no processo master e o pool de conexões dividido entre os workers
+(ver DB_CONNECTION_BUDGET em database.py).
+"""
+import multiprocessing
+import os
+
+
+def _cpus_disponiveis() -> int:
+    """
+    Retorna o número de CPUs disponíveis para o container.
+    Considera a cota do cgroup (limits.cpus do Docker) quando existir.
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, periodo = f.read().split()
+        if quota != "max":
+            return max(1, int(int(quota) / int(periodo)))
+    except (OSError, ValueError):
+        pass
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+workers = int(os.getenv("WEB_CONCURRENCY", str(_cpus_disponiveis())))
+
+# database.py lê WEB_CONCURRENCY para dividir o orçamento de conexões,
+# então o valor efetivo precisa estar no ambiente antes do preload.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Tempo para os workers concluírem as requisições em andamento
+# (incluindo transações de distribuição) após receberem SIGTERM.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+accesslog = None
+errorlog = "-"
+loglevel = "warning"
+
+
+def post_fork(server, worker):
+    """
+    Descarta as conexões herdadas do master após o fork.
+    O preload abre conexões (create_all) que não podem ser compartilhadas
+    entre processos; cada worker abre as suas sob demanda.
+    """
+    from database import engine
+    engine.dispose(close=False)
+
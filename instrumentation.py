@@ -0,0 +1,102 @@
+"""
+Instrumentação de SQL por requisição.
+
+Conta os comandos enviados ao banco e o tempo gasto neles durante cada
+requisição, e permite declarar um orçamento de queries por endpoint.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Em modo de teste, exceder o orçamento de queries gera erro em vez de aviso
+QUERY_BUDGET_ENFORCE = os.getenv("QUERY_BUDGET_ENFORCE", "false").lower() in ("1", "true", "yes")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Endpoint executou mais queries do que o orçamento declarado.
+    """
+
+
+class EstatisticasSQL:
+    """
+    Acumula as estatísticas de SQL de uma requisição.
+    """
+    __slots__ = ("queries", "tempo_db")
+
+    def __init__(self):
+        self.queries = 0
+        self.tempo_db = 0.0
+
+
+_estatisticas: ContextVar[Optional[EstatisticasSQL]] = ContextVar("estatisticas_sql", default=None)
+
+
+def iniciar_requisicao() -> EstatisticasSQL:
+    """
+    Inicia a contagem para a requisição atual.
+    O objeto é mutável para que as queries executadas no threadpool
+    (dependências síncronas) sejam contabilizadas na mesma requisição.
+    """
+    estatisticas = EstatisticasSQL()
+    _estatisticas.set(estatisticas)
+    return estatisticas
+
+
+def _antes_de_executar(conn, cursor, statement, parameters, context, executemany):
+    context._inicio_execucao = time.perf_counter()
+
+
+def _depois_de_executar(conn, cursor, statement, parameters, context, executemany):
+    estatisticas = _estatisticas.get()
+    if estatisticas is None:
+        return
+    estatisticas.queries += 1
+    estatisticas.tempo_db += time.perf_counter() - context._inicio_execucao
+
+
+def instalar(engine: Engine) -> None:
+    """
+    Registra os eventos de contagem no engine.
+    """
+    event.listen(engine, "before_cursor_execute", _antes_de_executar)
+    event.listen(engine, "after_cursor_execute", _depois_de_executar)
+
+
+def query_budget(max_queries: int):
+    """
+    Declara o número máximo de queries que um endpoint pode executar.
+    """
+    def decorator(func):
+        func.__query_budget__ = max_queries
+        return func
+    return decorator
+
+
+def verificar_orcamento(endpoint, path: str, estatisticas: EstatisticasSQL) -> Optional[str]:
+    """
+    Verifica se a requisição respeitou o orçamento do endpoint.
+    Retorna a mensagem de violação, ou levanta QueryBudgetExceeded em modo de teste.
+    """
+    orcamento = getattr(endpoint, "__query_budget__", None)
+    if orcamento is None or estatisticas.queries <= orcamento:
+        return None
+
+    mensagem = f"{path} executou {estatisticas.queries} queries (orçamento: {orcamento})"
+    if QUERY_BUDGET_ENFORCE:
+        raise QueryBudgetExceeded(mensagem)
+    return mensagem
+
+
+def server_timing(estatisticas: EstatisticasSQL, tempo_total: float) -> str:
+    """
+    Monta o valor do header Server-Timing.
+    """
+    return (
+        f'db;dur={estatisticas.tempo_db * 1000:.2f};desc="{estatisticas.queries} queries", '
+        f"app;dur={tempo_total * 1000:.2f}"
+    )
@@ -2,11 +2,16 @@ from fastapi import FastAPI, Depends, HTTPException, Query, Security, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
 import json
 from sqlalchemy.orm import Session
 from typing import List, Optional
-import models, schemas
-from database import get_db, engine, Base
+import models, schemas, instrumentation, resilience, outbox, availability, shifts, purge
+from slow_queries import recorder as slow_query_recorder
+from database import get_db_for, engine, Base
+from compression import CompressionMiddleware
+from rate_limit import RateLimitMiddleware, RATE_LIMIT_ENABLED
+from instrumentation import query_budget
 from fastapi.security import APIKeyHeader
 import os
 from dotenv import load_dotenv
@@ -45,23 +50,78 @@ api_key_header = APIKeyHeader(name="api-key", description="API Key para autentic
 
 Base.metadata.create_all(bind=engine)
 
+instrumentation.instalar(engine)
+slow_query_recorder.instalar(engine)
+
+# Sessões com os timeouts de cada classe de rota
+get_db_dispatch = get_db_for("dispatch")
+get_db_read = get_db_for("read")
+get_db_write = get_db_for("write")
+
 app = FastAPI(
     title="Sistema de Gestão de Consultores V6",
     version="6.0.0"
 )
 
+@app.on_event("startup")
+async def iniciar_outbox():
+    outbox.iniciar()
+
+@app.on_event("startup")
+async def iniciar_disponibilidade():
+    availability.iniciar()
+
+@app.on_event("startup")
+async def iniciar_turnos():
+    shifts.iniciar()
+
+@app.on_event("startup")
+async def iniciar_purge():
+    purge.iniciar()
+
+@app.on_event("shutdown")
+async def parar_outbox():
+    await outbox.parar()
+
+@app.on_event("shutdown")
+async def parar_disponibilidade():
+    await availability.parar()
+
+@app.on_event("shutdown")
+async def parar_turnos():
+    await shifts.parar()
+
+@app.on_event("shutdown")
+async def parar_purge():
+    await purge.parar()
+
+@app.on_event("shutdown")
+def fechar_conexoes():
+    """
+    Fecha o pool de conexões ao encerrar o worker.
+    O Uvicorn só dispara este evento depois de concluir as requisições em
+    andamento, então as transações de distribuição já terminaram aqui.
+    """
+    engine.dispose()
+
+# Middleware mais interno: rejeita o excesso antes de qualquer dependência abrir sessão
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, api_key=API_KEY)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Proximo-Cursor"],
 )
 
 # Middleware para logging de requisições
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()
+    estatisticas_sql = instrumentation.iniciar_requisicao()
     
     # Gera ID único para a requisição
     request_id = f"{int(time.time() * 1000):x}"
@@ -85,28 +145,34 @@ async def log_requests(request: Request, call_next):
         response_body = [chunk async for chunk in response.body_iterator]
         
         # Recria o objeto de resposta com o body capturado
+        headers = dict(response.headers)
+        headers["Server-Timing"] = instrumentation.server_timing(estatisticas_sql, process_time)
         response = Response(
             content=b"".join(response_body),
             status_code=response.status_code,
-            headers=dict(response.headers),
+            headers=headers,
             media_type=response.media_type
         )
         
         # Log da resposta
+        response_log = {
+            "id": request_id,
+            "status": response.status_code,
+            "time": f"{process_time:.4f}s",
+            "queries": estatisticas_sql.queries,
+            "db_time": f"{estatisticas_sql.tempo_db:.3f}s"
+        }
         try:
-            body_json = json.loads(response.body)
-            response_log = {
-                "id": request_id,
-                "status": response.status_code,
-                "time": f"{process_time:.2f}s",
-                "data": body_json
-            }
+            response_log["data"] = json.loads(response.body)
         except:
-            response_log = {
-                "id": request_id,
-                "status": response.status_code,
-                "time": f"{process_time:.2f}s"
-            }
+            pass
+        
+        # Verifica o orçamento de queries do endpoint
+        violacao = instrumentation.verificar_orcamento(
+            request.scope.get("endpoint"), request.url.path, estatisticas_sql
+        )
+        if violacao:
+            response_log["query_budget"] = violacao
         
         logger.info(f"RES {request_id} | {json.dumps(response_log, separators=(',', ':'))}")
         return response
@@ -122,6 +188,9 @@ async def log_requests(request: Request, call_next):
         logger.error(f"ERR {request_id} | {json.dumps(error_log, separators=(',', ':'))}")
         raise
 
+# Registrado por último para ficar mais externo: comprime o corpo já registrado no log
+app.add_middleware(CompressionMiddleware)
+
 security_scheme = {
     "type": "apiKey",
     "in": "header",
@@ -152,25 +221,69 @@ async def verify_api_key(api_key: str = Security(api_key_header)):
     summary="Obter próximo consultor para atendimento",
     description="Retorna o próximo consultor disponível baseado em idioma, status e tempo de espera"
 )
+@query_budget(2)
 async def obter_consultor_da_vez(
     idioma: str = Query(..., example="pt"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_dispatch),
+    _: bool = Depends(verify_api_key)
+):
+    # Falha rápido com 503 se o banco está instável ou há distribuições demais em andamento
+    resilience.db_breaker.verificar()
+    with resilience.dispatch_limiter.admitir():
+        return await run_in_threadpool(models.get_consultor_da_vez, db, idioma)
+
+@app.get(
+    "/disponibilidade",
+    response_model=schemas.DisponibilidadeResponse,
+    tags=["Distribuição"],
+    summary="Disponibilidade por idioma",
+    description="Retorna, por idioma, quantos consultores podem receber atendimento agora e quem é o próximo da fila, sem consultar o banco"
+)
+@query_budget(0)
+async def obter_disponibilidade(
+    idioma: Optional[str] = Query(None, example="pt"),
     _: bool = Depends(verify_api_key)
 ):
-    return models.get_consultor_da_vez(db, idioma)
+    indice = availability.indice
+    if not indice.carregado:
+        raise resilience.servico_indisponivel("Índice de disponibilidade ainda não carregado", 1)
+    return schemas.DisponibilidadeResponse(
+        atualizado_em=indice.atualizado_em,
+        idiomas=indice.snapshot(idioma)
+    )
 
 @app.get(
     "/consultores", 
     response_model=List[schemas.ConsultorResponse],
     tags=["Consultores"],
     summary="Listar consultores",
-    description="Retorna a lista de todos os consultores cadastrados"
+    description="Retorna os consultores cadastrados, com filtros opcionais. Com `limit`, pagina por id: "
+                "o cabeçalho `X-Proximo-Cursor` traz o `cursor` da próxima página. "
+                "Com `fields`, retorna apenas as colunas pedidas"
 )
+@query_budget(1)
 async def listar_consultores(
-    db: Session = Depends(get_db),
+    response: Response,
+    fields: Optional[str] = Query(None, description="Campos a retornar, separados por vírgula (ex: id,nome,status_online)"),
+    idioma: Optional[str] = Query(None, description="Apenas consultores que atendem o idioma"),
+    status_ativo: Optional[bool] = Query(None),
+    status_online: Optional[bool] = Query(None),
+    busca: Optional[str] = Query(None, min_length=3, description="Texto procurado no nome ou no email"),
+    cursor: Optional[int] = Query(None, ge=0, description="Id a partir do qual a página começa (valor de X-Proximo-Cursor)"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Tamanho da página"),
+    db: Session = Depends(get_db_read),
     _: bool = Depends(verify_api_key)
 ):
-    return models.get_consultores(db)
+    consultores, proximo_cursor = models.get_consultores(
+        db, campos=fields, idioma=idioma, status_ativo=status_ativo, status_online=status_online,
+        busca=busca, cursor=cursor, limite=limit
+    )
+    headers = {"X-Proximo-Cursor": str(proximo_cursor)} if proximo_cursor is not None else {}
+    if fields:
+        # Seleção parcial não passa pela validação do response_model
+        return JSONResponse(jsonable_encoder(consultores), headers=headers)
+    response.headers.update(headers)
+    return consultores
 
 @app.post(
     "/consultor",
@@ -179,13 +292,51 @@ async def listar_consultores(
     summary="Criar consultor",
     description="Cadastra um novo consultor no sistema"
 )
+@query_budget(1)
 async def criar_consultor(
     consultor: schemas.ConsultorCreate,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_write),
     _: bool = Depends(verify_api_key)
 ):
     return models.criar_consultor(db, consultor)
 
+@app.get(
+    "/consultor/pipedrive/{id_pipedrive}",
+    response_model=schemas.ConsultorResponse,
+    tags=["Consultores"],
+    summary="Obter consultor pelo Pipedrive",
+    description="Retorna o consultor associado a um ID de usuário do Pipedrive"
+)
+@query_budget(1)
+async def obter_consultor_por_pipedrive(
+    id_pipedrive: int,
+    db: Session = Depends(get_db_read),
+    _: bool = Depends(verify_api_key)
+):
+    consultor = models.get_consultores_por_pipedrive(db, [id_pipedrive])[id_pipedrive]
+    if not consultor:
+        raise HTTPException(status_code=404, detail="Consultor não encontrado")
+    return consultor
+
+@app.post(
+    "/consultores/pipedrive/resolve",
+    response_model=schemas.PipedriveResolveResponse,
+    tags=["Consultores"],
+    summary="Resolver IDs do Pipedrive",
+    description="Mapeia vários IDs de usuário do Pipedrive para consultores em uma única consulta"
+)
+@query_budget(1)
+async def resolver_ids_pipedrive(
+    requisicao: schemas.PipedriveResolveRequest,
+    db: Session = Depends(get_db_read),
+    _: bool = Depends(verify_api_key)
+):
+    mapeamento = models.get_consultores_por_pipedrive(db, list(dict.fromkeys(requisicao.ids)))
+    return schemas.PipedriveResolveResponse(
+        consultores={k: v for k, v in mapeamento.items() if v is not None},
+        nao_encontrados=[k for k, v in mapeamento.items() if v is None]
+    )
+
 @app.get(
     "/consultor/{consultor_id}", 
     response_model=schemas.ConsultorResponse,
@@ -193,9 +344,10 @@ async def criar_consultor(
     summary="Obter consultor",
     description="Retorna os dados de um consultor específico"
 )
+@query_budget(1)
 async def obter_consultor(
     consultor_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_read),
     _: bool = Depends(verify_api_key)
 ):
     consultor = models.get_consultor(db, consultor_id)
@@ -210,10 +362,11 @@ async def obter_consultor(
     summary="Atualizar consultor",
     description="Atualiza os dados de um consultor existente"
 )
+@query_budget(1)
 async def atualizar_consultor(
     consultor_id: int,
     consultor: schemas.ConsultorUpdate,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_write),
     _: bool = Depends(verify_api_key)
 ):
     return models.atualizar_consultor(db, consultor_id, consultor)
@@ -222,11 +375,12 @@ async def atualizar_consultor(
     "/consultor/{consultor_id}",
     tags=["Consultores"],
     summary="Remover consultor",
-    description="Remove um consultor do sistema"
+    description="Remove um consultor do sistema. O consultor sai da distribuição e das listagens imediatamente; o histórico de protocolos é arquivado depois, em segundo plano"
 )
+@query_budget(1)
 async def deletar_consultor(
     consultor_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_write),
     _: bool = Depends(verify_api_key)
 ):
     return models.deletar_consultor(db, consultor_id)
@@ -236,31 +390,91 @@ async def deletar_consultor(
     response_model=schemas.ConsultorResponse,
     tags=["Status"],
     summary="Atualizar status",
-    description="Atualiza o status online/offline do consultor"
+    description="Atualiza o status online/offline do consultor. Com `ate`, o status vale até esse momento e as transições de turno são ignoradas até lá"
 )
+@query_budget(1)
 async def atualizar_status_conexao(
     consultor_id: int,
     status: bool,
-    db: Session = Depends(get_db),
+    ate: Optional[datetime] = Query(None, description="Fim do status manual (ISO 8601 com fuso; sem fuso, UTC)"),
+    db: Session = Depends(get_db_write),
+    _: bool = Depends(verify_api_key)
+):
+    return models.atualizar_status_conexao(db, consultor_id, status, ate)
+
+@app.get(
+    "/consultor/{consultor_id}/turnos",
+    response_model=List[schemas.TurnoResponse],
+    tags=["Status"],
+    summary="Obter escala",
+    description="Retorna as janelas semanais de trabalho do consultor"
+)
+@query_budget(1)
+async def obter_turnos(
+    consultor_id: int,
+    db: Session = Depends(get_db_read),
     _: bool = Depends(verify_api_key)
 ):
-    return models.atualizar_status_conexao(db, consultor_id, status)
+    return models.get_turnos(db, consultor_id)
+
+@app.put(
+    "/consultor/{consultor_id}/turnos",
+    response_model=List[schemas.TurnoResponse],
+    tags=["Status"],
+    summary="Definir escala",
+    description="Substitui as janelas semanais de trabalho do consultor. O status online passa a ser alterado automaticamente nas fronteiras dos turnos"
+)
+@query_budget(1)
+async def definir_turnos(
+    consultor_id: int,
+    escala: schemas.TurnosUpdate,
+    db: Session = Depends(get_db_write),
+    _: bool = Depends(verify_api_key)
+):
+    return models.substituir_turnos(db, consultor_id, escala.turnos)
 
 @app.get(
     "/protocolos",
     response_model=List[schemas.ProtocoloResponse],
     tags=["Protocolos"],
     summary="Listar protocolos",
-    description="Retorna a lista de protocolos com paginação e filtro por consultor"
+    description="Retorna a lista de protocolos com paginação e filtros por consultor e faixa de números. Com `fields`, retorna apenas as colunas pedidas"
 )
+@query_budget(1)
 async def listar_protocolos(
     consultor_id: Optional[int] = Query(None),
     skip: int = Query(0),
     limit: int = Query(100),
-    db: Session = Depends(get_db),
+    fields: Optional[str] = Query(None, description="Campos a retornar, separados por vírgula (ex: id,numero)"),
+    numero_inicial: Optional[int] = Query(None, ge=1, description="Menor número de protocolo (ex: 120000)"),
+    numero_final: Optional[int] = Query(None, ge=1, description="Maior número de protocolo (ex: 130000)"),
+    db: Session = Depends(get_db_read),
     _: bool = Depends(verify_api_key)
 ):
-    return models.get_protocolos(db, consultor_id=consultor_id, skip=skip, limit=limit)
+    protocolos = models.get_protocolos(
+        db, consultor_id=consultor_id, skip=skip, limit=limit, campos=fields,
+        numero_inicial=numero_inicial, numero_final=numero_final
+    )
+    if fields:
+        return JSONResponse(jsonable_encoder(protocolos))
+    return protocolos
+
+@app.get(
+    "/protocolos/abertos",
+    response_model=List[schemas.ProtocoloResponse],
+    tags=["Protocolos"],
+    summary="Fila de protocolos abertos",
+    description="Retorna os protocolos abertos ou em andamento, do mais urgente para o menos urgente e, na mesma prioridade, do mais antigo para o mais novo"
+)
+@query_budget(1)
+async def listar_protocolos_abertos(
+    consultor_id: Optional[int] = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db_read),
+    _: bool = Depends(verify_api_key)
+):
+    return models.get_protocolos_abertos(db, consultor_id=consultor_id, skip=skip, limit=limit)
 
 @app.get(
     "/protocolo/{protocolo_id}",
@@ -269,9 +483,10 @@ async def listar_protocolos(
     summary="Obter protocolo",
     description="Retorna os dados de um protocolo específico"
 )
+@query_budget(1)
 async def obter_protocolo(
     protocolo_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_read),
     _: bool = Depends(verify_api_key)
 ):
     protocolo = models.get_protocolo(db, protocolo_id)
@@ -286,10 +501,11 @@ async def obter_protocolo(
     summary="Atualizar protocolo",
     description="Atualiza os dados de um protocolo existente"
 )
+@query_budget(1)
 async def atualizar_protocolo(
     protocolo_id: int,
     protocolo: schemas.ProtocoloUpdate,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_write),
     _: bool = Depends(verify_api_key)
 ):
     return models.atualizar_protocolo(db, protocolo_id, protocolo)
@@ -301,13 +517,40 @@ async def atualizar_protocolo(
     summary="Gerar protocolo",
     description="Gera um novo número de protocolo sequencial"
 )
+@query_budget(1)
 async def gerar_novo_protocolo(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_write),
     _: bool = Depends(verify_api_key)
 ):
     protocolo = models.gerar_novo_protocolo(db)
     return schemas.NovoProtocoloResponse(numero_protocolo=protocolo.numero)
 
+@app.get(
+    "/admin/slow-queries",
+    response_model=List[schemas.SlowQueryResponse],
+    tags=["Administração"],
+    summary="Listar queries lentas",
+    description="Retorna as queries mais recentes que excederam o limite configurado, com o plano de execução quando amostrado"
+)
+@query_budget(0)
+async def listar_slow_queries(
+    _: bool = Depends(verify_api_key)
+):
+    return slow_query_recorder.listar()
+
+@app.delete(
+    "/admin/slow-queries",
+    tags=["Administração"],
+    summary="Limpar queries lentas",
+    description="Esvazia o buffer de queries lentas"
+)
+@query_budget(0)
+async def limpar_slow_queries(
+    _: bool = Depends(verify_api_key)
+):
+    slow_query_recorder.limpar()
+    return {"detail": "Buffer de queries lentas esvaziado"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
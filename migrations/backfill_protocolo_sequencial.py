@@ -0,0 +1,211 @@
+"""
+Preenche protocolos.sequencial a partir da coluna legada `numero` sem
+bloquear a tabela.
+
+Etapas (todas idempotentes, pode ser executado mais de uma vez):
+1. Copia o número de `numero` ('#00123' -> 123) em lotes pequenos, cada um
+   em sua própria transação. Protocolos novos já chegam com as duas colunas
+   preenchidas pelo trigger criado em setup_database.py.
+2. Com --finalizar, depois que nenhuma instância antiga estiver em execução:
+   cria o índice único de `sequencial` com CREATE INDEX CONCURRENTLY, torna a
+   coluna NOT NULL usando uma CHECK NOT VALID validada à parte (o ALTER não
+   precisa varrer a tabela com lock exclusivo), remove o trigger e, por fim,
+   a coluna `numero` e seus índices.
+
+Uso:
+    python migrations/backfill_protocolo_sequencial.py [--lote 5000] [--pausa 0.1]
+    python migrations/backfill_protocolo_sequencial.py --finalizar
+
+A etapa 1 roda no start.sh, antes de a aplicação subir, então a versão que
+lê apenas `sequencial` nunca encontra linhas sem o número. Depois de concluída
+ela fica marcada no comentário da coluna `sequencial` e as execuções seguintes
+só consultam o catálogo. Bancos criados já sem `numero` só recebem o índice
+único.
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+DB_USER = os.getenv("POSTGRES_USERNAME")
+DB_PASS = os.getenv("POSTGRES_PASSWORD")
+DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
+DB_PORT = os.getenv("POSTGRES_PORT", "5432")
+DB_NAME = os.getenv("POSTGRES_DATABASE")
+
+# Comentário de protocolos.sequencial gravado ao fim do preenchimento
+MARCADOR_CONCLUIDO = "backfill de numero concluído"
+
+
+def coluna_existe(conn, coluna: str) -> bool:
+    return conn.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'protocolos' AND column_name = :coluna
+    """), {"coluna": coluna}).first() is not None
+
+
+def preenchimento_concluido(conn) -> bool:
+    """
+    Indica, sem varrer a tabela, se não há nada a preencher: a coluna `numero`
+    já foi removida ou uma execução anterior concluiu o preenchimento (marcado
+    no comentário da coluna `sequencial`).
+    """
+    if not coluna_existe(conn, "numero"):
+        return True
+    return conn.execute(text("""
+        SELECT col_description(attrelid, attnum) FROM pg_attribute
+        WHERE attrelid = 'protocolos'::regclass AND attname = 'sequencial'
+    """)).scalar() == MARCADOR_CONCLUIDO
+
+
+def preencher(engine, lote: int, pausa: float) -> None:
+    """
+    Copia `numero` para `sequencial` em lotes, confirmando cada lote.
+
+    Os lotes avançam pela chave primária a partir do último id atualizado,
+    então cada lote lê só as linhas seguintes em vez de reler o início da
+    tabela. Ao terminar, marca a coluna `sequencial` para que as próximas
+    execuções (uma a cada deploy, pelo start.sh) não façam nada.
+    """
+    with engine.connect() as conn:
+        if preenchimento_concluido(conn):
+            print("Preenchimento de sequencial já concluído, nada a fazer.")
+            return
+
+    total = 0
+    ultimo_id = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(text("""
+                WITH lote AS (
+                    SELECT id FROM protocolos
+                    WHERE id > :ultimo_id AND sequencial IS NULL AND numero IS NOT NULL
+                    ORDER BY id
+                    LIMIT :lote
+                )
+                UPDATE protocolos p
+                SET sequencial = CAST(SUBSTRING(p.numero FROM 2) AS BIGINT)
+                FROM lote
+                WHERE p.id = lote.id
+                RETURNING p.id
+            """), {"ultimo_id": ultimo_id, "lote": lote}).scalars().all()
+        if not ids:
+            break
+        ultimo_id = max(ids)
+        total += len(ids)
+        print(f"  {total} protocolos preenchidos...")
+        if pausa:
+            time.sleep(pausa)
+
+    # Linhas novas chegam preenchidas pelo trigger; a verificação final (uma
+    # única varredura) garante que nenhuma ficou para trás antes de marcar
+    with engine.begin() as conn:
+        pendentes = conn.execute(text("""
+            SELECT COUNT(*) FROM protocolos WHERE sequencial IS NULL AND numero IS NOT NULL
+        """)).scalar()
+        if pendentes:
+            raise RuntimeError(f"{pendentes} protocolos continuam sem sequencial")
+        conn.execute(text(f"COMMENT ON COLUMN protocolos.sequencial IS '{MARCADOR_CONCLUIDO}'"))
+    print(f"Preenchimento concluído ({total} protocolos).")
+
+
+def criar_indice(conn) -> None:
+    """
+    Cria o índice único de `sequencial` sem bloquear escritas.
+    Um índice inválido deixado por uma execução interrompida é recriado.
+    """
+    invalido = conn.execute(text("""
+        SELECT 1 FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = 'uq_protocolos_sequencial' AND NOT i.indisvalid
+    """)).first()
+    if invalido:
+        print("Removendo índice inválido de uma execução anterior...")
+        conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS uq_protocolos_sequencial"))
+
+    print("Criando índice único de sequencial...")
+    conn.execute(text("""
+        CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_protocolos_sequencial
+        ON protocolos (sequencial)
+    """))
+
+
+def tornar_obrigatorio(conn) -> None:
+    """
+    Torna `sequencial` NOT NULL. A CHECK validada permite ao PostgreSQL
+    pular a varredura no SET NOT NULL, que então segura o lock por pouco tempo.
+    """
+    print("Validando sequencial NOT NULL...")
+    conn.execute(text("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint WHERE conname = 'ck_protocolos_sequencial_not_null'
+            ) THEN
+                ALTER TABLE protocolos
+                    ADD CONSTRAINT ck_protocolos_sequencial_not_null
+                    CHECK (sequencial IS NOT NULL) NOT VALID;
+            END IF;
+        END $$;
+    """))
+    conn.execute(text("ALTER TABLE protocolos VALIDATE CONSTRAINT ck_protocolos_sequencial_not_null"))
+    conn.execute(text("ALTER TABLE protocolos ALTER COLUMN sequencial SET NOT NULL"))
+    conn.execute(text("ALTER TABLE protocolos DROP CONSTRAINT ck_protocolos_sequencial_not_null"))
+
+
+def finalizar(conn) -> None:
+    """
+    Remove o trigger de sincronização, a coluna legada `numero` e seus índices.
+    """
+    if not coluna_existe(conn, "numero"):
+        print("Coluna numero já removida.")
+        return
+    print("Removendo coluna numero...")
+    conn.execute(text("DROP TRIGGER IF EXISTS trg_sincronizar_numero_protocolo ON protocolos"))
+    conn.execute(text("DROP FUNCTION IF EXISTS sincronizar_numero_protocolo()"))
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS idx_protocolos_numero"))
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_protocolos_numero"))
+    conn.execute(text("ALTER TABLE protocolos DROP CONSTRAINT IF EXISTS protocolos_numero_key"))
+    conn.execute(text("ALTER TABLE protocolos DROP COLUMN numero"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill de protocolos.sequencial")
+    parser.add_argument("--lote", type=int, default=5000, help="Linhas atualizadas por transação")
+    parser.add_argument("--pausa", type=float, default=0.1, help="Segundos de espera entre lotes")
+    parser.add_argument(
+        "--finalizar", action="store_true",
+        help="Cria o índice único, torna sequencial NOT NULL e remove a coluna numero"
+    )
+    args = parser.parse_args()
+
+    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    engine = create_engine(DATABASE_URL)
+
+    preencher(engine, args.lote, args.pausa)
+
+    # CREATE/DROP INDEX CONCURRENTLY não podem rodar dentro de uma transação
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SET lock_timeout = '5s'"))
+        if args.finalizar:
+            criar_indice(conn)
+            tornar_obrigatorio(conn)
+            finalizar(conn)
+        elif not coluna_existe(conn, "numero"):
+            # Banco novo ou já finalizado: a coluna nasce NOT NULL, falta só o índice
+            criar_indice(conn)
+
+    print("Backfill de sequencial concluído com sucesso!")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(f"\nErro durante o backfill: {str(e)}")
+        raise
@@ -95,7 +95,7 @@ def run_migration():
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS controle_protocolo (
                 id SERIAL PRIMARY KEY,
-                ultimo_numero INTEGER DEFAULT 0,
+                ultimo_numero BIGINT DEFAULT 0,
                 updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
             );
         """))
@@ -105,8 +105,8 @@ def run_migration():
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS protocolos (
                 id SERIAL PRIMARY KEY,
-                numero VARCHAR(10) UNIQUE NOT NULL,
-                consultor_id INTEGER NOT NULL,
+                sequencial BIGINT NOT NULL,
+                consultor_id INTEGER,
                 created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
                 CONSTRAINT fk_consultor
                     FOREIGN KEY (consultor_id)
@@ -115,87 +115,247 @@ def run_migration():
             );
         """))
 
+        print("Migrando número do protocolo para BIGINT...")
+        # O número passa a ser guardado em `sequencial` (BIGINT); o formato #00001
+        # é gerado apenas na API. Bancos existentes ganham a coluna vazia e a
+        # coluna `numero` deixa de ser obrigatória. Enquanto `numero` existir, um
+        # trigger preenche uma coluna a partir da outra em cada INSERT, para que
+        # instâncias antigas (que gravam só `numero`) e novas (só `sequencial`)
+        # convivam durante o deploy. O preenchimento das linhas antigas, o índice
+        # único, o NOT NULL e a remoção de `numero` ficam em
+        # backfill_protocolo_sequencial.py.
+        conn.execute(text("""
+            ALTER TABLE controle_protocolo ALTER COLUMN ultimo_numero TYPE BIGINT;
+            ALTER TABLE protocolos ADD COLUMN IF NOT EXISTS sequencial BIGINT;
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'protocolos' AND column_name = 'numero'
+                ) THEN
+                    ALTER TABLE protocolos ALTER COLUMN numero DROP NOT NULL;
+
+                    CREATE OR REPLACE FUNCTION sincronizar_numero_protocolo() RETURNS TRIGGER AS $f$
+                    BEGIN
+                        IF NEW.sequencial IS NULL AND NEW.numero IS NOT NULL THEN
+                            NEW.sequencial := CAST(SUBSTRING(NEW.numero FROM 2) AS BIGINT);
+                        ELSIF NEW.numero IS NULL AND NEW.sequencial IS NOT NULL THEN
+                            NEW.numero := '#' || LPAD(
+                                CAST(NEW.sequencial AS TEXT),
+                                GREATEST(5, LENGTH(CAST(NEW.sequencial AS TEXT))),
+                                '0'
+                            );
+                        END IF;
+                        RETURN NEW;
+                    END
+                    $f$ LANGUAGE plpgsql;
+
+                    DROP TRIGGER IF EXISTS trg_sincronizar_numero_protocolo ON protocolos;
+                    CREATE TRIGGER trg_sincronizar_numero_protocolo
+                        BEFORE INSERT ON protocolos
+                        FOR EACH ROW EXECUTE FUNCTION sincronizar_numero_protocolo();
+                END IF;
+            END $$;
+        """))
+
         print("Criando índices...")
         # Cria índices
         conn.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_protocolos_numero ON protocolos (numero);
             CREATE INDEX IF NOT EXISTS idx_protocolos_consultor_id ON protocolos (consultor_id);
         """))
 
-        print("Criando função para gerar próximo número de protocolo...")
-        # Adiciona função para gerar próximo número de protocolo
+        print("Permitindo protocolos sem consultor...")
+        # Protocolos avulsos (GET /gerar-protocolo) não pertencem a nenhum
+        # consultor; remover o NOT NULL só altera o catálogo
+        conn.execute(text("""
+            ALTER TABLE protocolos ALTER COLUMN consultor_id DROP NOT NULL;
+        """))
+
+        print("Inicializando controle de protocolo...")
+        # Garante o registro único do contador, continuando da maior numeração existente
         conn.execute(text("""
-            CREATE OR REPLACE FUNCTION get_next_protocol_number()
-            RETURNS VARCHAR(10)
-            LANGUAGE plpgsql
-            AS $$
-            DECLARE
-                next_number INTEGER;
+            DO $$
             BEGIN
-                -- Atualiza e retorna o próximo número
-                UPDATE controle_protocolo
-                SET ultimo_numero = ultimo_numero + 1,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = 1
-                RETURNING ultimo_numero INTO next_number;
-                
-                -- Se não existir registro, cria um
-                IF NOT FOUND THEN
-                    INSERT INTO controle_protocolo (ultimo_numero, updated_at)
-                    VALUES (1, CURRENT_TIMESTAMP)
-                    RETURNING ultimo_numero INTO next_number;
+                IF EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'protocolos' AND column_name = 'numero'
+                ) THEN
+                    INSERT INTO controle_protocolo (id, ultimo_numero, updated_at)
+                    SELECT 1,
+                           COALESCE(GREATEST(MAX(sequencial), MAX(CAST(SUBSTRING(numero FROM 2) AS BIGINT))), 0),
+                           CURRENT_TIMESTAMP
+                    FROM protocolos
+                    ON CONFLICT (id) DO NOTHING;
+                ELSE
+                    INSERT INTO controle_protocolo (id, ultimo_numero, updated_at)
+                    SELECT 1, COALESCE(MAX(sequencial), 0), CURRENT_TIMESTAMP
+                    FROM protocolos
+                    ON CONFLICT (id) DO NOTHING;
                 END IF;
-                
-                -- Retorna o número formatado
-                RETURN '#' || LPAD(next_number::TEXT, 5, '0');
-            END;
-            $$;
+            END $$;
         """))
 
-        print("Criando função para criar protocolo automaticamente...")
-        # Adiciona função para criar protocolo automaticamente
+        print("Removendo trigger de protocolo automático...")
+        # Os protocolos são criados apenas pelo motor de protocolos em models.py;
+        # o trigger criava protocolos também em edições comuns de ultimo_atendimento
         conn.execute(text("""
-            CREATE OR REPLACE FUNCTION create_protocol_for_consultant(p_consultor_id INTEGER)
-            RETURNS VARCHAR(10)
-            LANGUAGE plpgsql
-            AS $$
-            DECLARE
-                v_numero VARCHAR(10);
-            BEGIN
-                -- Gera o próximo número de protocolo
-                v_numero := get_next_protocol_number();
-                
-                -- Insere o protocolo
-                INSERT INTO protocolos (numero, consultor_id)
-                VALUES (v_numero, p_consultor_id);
-                
-                RETURN v_numero;
-            END;
-            $$;
+            DROP TRIGGER IF EXISTS trg_create_protocol_on_consultant_selection ON consultores;
+            DROP FUNCTION IF EXISTS create_protocol_on_consultant_selection();
+            DROP FUNCTION IF EXISTS create_protocol_for_consultant(INTEGER);
+            DROP FUNCTION IF EXISTS get_next_protocol_number();
+        """))
+
+        print("Criando tabela de outbox...")
+        # Eventos para o CRM gravados na transação da distribuição
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS outbox_eventos (
+                id BIGSERIAL PRIMARY KEY,
+                tipo VARCHAR(100) NOT NULL,
+                payload JSONB NOT NULL,
+                criado_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                proxima_tentativa_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                entregue_em TIMESTAMP WITH TIME ZONE,
+                ultimo_erro TEXT
+            );
+            -- Eventos recusados pelo CRM ou sem sucesso após OUTBOX_MAX_TENTATIVAS
+            -- saem da fila (dead letter) e ficam para inspeção
+            ALTER TABLE outbox_eventos ADD COLUMN IF NOT EXISTS descartado_em TIMESTAMP WITH TIME ZONE;
+            DROP INDEX IF EXISTS idx_outbox_eventos_pendentes;
+            CREATE INDEX IF NOT EXISTS idx_outbox_eventos_fila
+                ON outbox_eventos (proxima_tentativa_em, id)
+                WHERE entregue_em IS NULL AND descartado_em IS NULL;
+        """))
+
+        print("Criando tabelas de turnos...")
+        # Escala semanal dos consultores e controle do escalonador de turnos
+        conn.execute(text("""
+            ALTER TABLE consultores ADD COLUMN IF NOT EXISTS status_override_ate TIMESTAMP WITH TIME ZONE;
+            CREATE INDEX IF NOT EXISTS idx_consultores_status_override_ate
+                ON consultores (status_override_ate)
+                WHERE status_override_ate IS NOT NULL;
+
+            CREATE TABLE IF NOT EXISTS turnos_consultor (
+                id SERIAL PRIMARY KEY,
+                consultor_id INTEGER NOT NULL REFERENCES consultores (id) ON DELETE CASCADE,
+                dia_semana SMALLINT NOT NULL CHECK (dia_semana BETWEEN 1 AND 7),
+                inicio TIME NOT NULL,
+                fim TIME NOT NULL,
+                CHECK (fim <> inicio)
+            );
+            CREATE INDEX IF NOT EXISTS idx_turnos_consultor_consultor_id ON turnos_consultor (consultor_id);
+
+            CREATE TABLE IF NOT EXISTS controle_turnos (
+                id INTEGER PRIMARY KEY,
+                processado_ate TIMESTAMP WITH TIME ZONE NOT NULL
+            );
+            INSERT INTO controle_turnos (id, processado_ate)
+            VALUES (1, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO NOTHING;
+        """))
+
+        print("Criando soft delete de consultores...")
+        # Consultores removidos ficam com deleted_at preenchido até o purge
+        # arquivar os protocolos em lotes e apagar a linha
+        conn.execute(text("""
+            ALTER TABLE consultores ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE;
+            CREATE INDEX IF NOT EXISTS idx_consultores_deleted_at
+                ON consultores (deleted_at)
+                WHERE deleted_at IS NOT NULL;
+
+            CREATE TABLE IF NOT EXISTS protocolos_arquivo (
+                id INTEGER PRIMARY KEY,
+                sequencial BIGINT NOT NULL,
+                consultor_id INTEGER NOT NULL,
+                created_at TIMESTAMP WITH TIME ZONE,
+                arquivado_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_protocolos_arquivo_consultor_id ON protocolos_arquivo (consultor_id);
         """))
 
-        print("Criando trigger para protocolo automático...")
-        # Adiciona trigger para criar protocolo quando consultor é selecionado
+        print("Adicionando ciclo de vida dos protocolos...")
+        # Colunas com DEFAULT constante não reescrevem a tabela. O histórico
+        # existente entra como 'fechado' (o ADD COLUMN preenche pelo default) e só
+        # os protocolos novos nascem 'aberto'; o índice parcial da fila é criado
+        # CONCURRENTLY mais abaixo
         conn.execute(text("""
-            CREATE OR REPLACE FUNCTION create_protocol_on_consultant_selection()
-            RETURNS TRIGGER
-            LANGUAGE plpgsql
-            AS $$
+            ALTER TABLE protocolos ADD COLUMN IF NOT EXISTS descricao TEXT;
+            ALTER TABLE protocolos ADD COLUMN IF NOT EXISTS prioridade VARCHAR(20) NOT NULL DEFAULT 'normal';
+            ALTER TABLE protocolos ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'fechado';
+            ALTER TABLE protocolos ALTER COLUMN status SET DEFAULT 'aberto';
+            ALTER TABLE protocolos_arquivo ADD COLUMN IF NOT EXISTS descricao TEXT;
+            ALTER TABLE protocolos_arquivo ADD COLUMN IF NOT EXISTS prioridade VARCHAR(20) NOT NULL DEFAULT 'normal';
+            ALTER TABLE protocolos_arquivo ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'fechado';
+
+            DO $$
             BEGIN
-                -- Cria protocolo para o consultor selecionado
-                PERFORM create_protocol_for_consultant(NEW.id);
-                RETURN NEW;
-            END;
+                IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ck_protocolos_prioridade') THEN
+                    ALTER TABLE protocolos ADD CONSTRAINT ck_protocolos_prioridade
+                        CHECK (prioridade IN ('urgente', 'alta', 'normal', 'baixa')) NOT VALID;
+                END IF;
+                IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ck_protocolos_status') THEN
+                    ALTER TABLE protocolos ADD CONSTRAINT ck_protocolos_status
+                        CHECK (status IN ('aberto', 'em_andamento', 'fechado', 'cancelado')) NOT VALID;
+                END IF;
+            END $$;
+
+            -- Ordem da fila: menor valor primeiro. IMMUTABLE para poder ser usada em índice.
+            CREATE OR REPLACE FUNCTION prioridade_rank(prioridade VARCHAR) RETURNS SMALLINT
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+                SELECT CAST(CASE prioridade
+                    WHEN 'urgente' THEN 0
+                    WHEN 'alta' THEN 1
+                    WHEN 'normal' THEN 2
+                    WHEN 'baixa' THEN 3
+                END AS SMALLINT)
             $$;
         """))
 
+        print("Criando notificação de alterações de consultores...")
+        # Cada alteração que afeta a disponibilidade é enviada com NOTIFY no
+        # commit; todos os workers e réplicas aplicam a linha ao seu índice em
+        # memória (availability.py), na ordem dos commits
         conn.execute(text("""
-            DROP TRIGGER IF EXISTS trg_create_protocol_on_consultant_selection ON consultores;
-            CREATE TRIGGER trg_create_protocol_on_consultant_selection
-            AFTER UPDATE OF ultimo_atendimento ON consultores
-            FOR EACH ROW
-            WHEN (OLD.ultimo_atendimento IS DISTINCT FROM NEW.ultimo_atendimento)
-            EXECUTE FUNCTION create_protocol_on_consultant_selection();
+            CREATE OR REPLACE FUNCTION notificar_consultor_alterado() RETURNS TRIGGER AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    PERFORM pg_notify('consultores_alterados', json_build_object(
+                        'id', OLD.id, 'removido', true
+                    )::text);
+                    RETURN OLD;
+                END IF;
+                PERFORM pg_notify('consultores_alterados', json_build_object(
+                    'id', NEW.id,
+                    'nome', NEW.nome,
+                    'idiomas', NEW.idiomas,
+                    'status_ativo', NEW.status_ativo,
+                    'status_ativo_sequencial', NEW.status_ativo_sequencial,
+                    'status_online', NEW.status_online,
+                    'ultimo_atendimento', NEW.ultimo_atendimento,
+                    'removido', NEW.deleted_at IS NOT NULL
+                )::text);
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS trg_notificar_consultor_inserido_removido ON consultores;
+            CREATE TRIGGER trg_notificar_consultor_inserido_removido
+                AFTER INSERT OR DELETE ON consultores
+                FOR EACH ROW EXECUTE FUNCTION notificar_consultor_alterado();
+
+            -- Edições de email, telefone e Pipedrive não mudam a disponibilidade
+            DROP TRIGGER IF EXISTS trg_notificar_consultor_atualizado ON consultores;
+            CREATE TRIGGER trg_notificar_consultor_atualizado
+                AFTER UPDATE ON consultores
+                FOR EACH ROW
+                WHEN (
+                    (OLD.nome, OLD.idiomas, OLD.status_ativo, OLD.status_ativo_sequencial,
+                     OLD.status_online, OLD.ultimo_atendimento, OLD.deleted_at)
+                    IS DISTINCT FROM
+                    (NEW.nome, NEW.idiomas, NEW.status_ativo, NEW.status_ativo_sequencial,
+                     NEW.status_online, NEW.ultimo_atendimento, NEW.deleted_at)
+                )
+                EXECUTE FUNCTION notificar_consultor_alterado();
         """))
 
         print("Criando tabela de api_keys...")
@@ -222,7 +382,51 @@ def run_migration():
 
         # Commit das alterações
         conn.commit()
-        print("Migração concluída com sucesso!")
+
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de uma transação
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        print("Criando índices de busca de consultores...")
+        # Trigram para a busca por trecho de nome/email e GIN para o filtro por idioma
+        try:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except Exception as e:
+            # A busca continua funcionando, mas sem índice
+            print(f"[AVISO] Extensão pg_trgm indisponível, índices de busca não criados: {str(e)}")
+        else:
+            conn.execute(text("""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_consultores_nome_trgm
+                ON consultores USING gin (nome gin_trgm_ops)
+            """))
+            conn.execute(text("""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_consultores_email_trgm
+                ON consultores USING gin (email gin_trgm_ops)
+            """))
+        conn.execute(text("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_consultores_idiomas
+            ON consultores USING gin (idiomas)
+        """))
+
+        print("Criando índice da fila de protocolos abertos...")
+        # Parcial: só os protocolos abertos entram, então o índice e a consulta
+        # da fila crescem com o trabalho em aberto e não com o histórico
+        conn.execute(text("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_protocolos_abertos
+            ON protocolos (prioridade_rank(prioridade), created_at, id)
+            WHERE status IN ('aberto', 'em_andamento')
+        """))
+        print("Criando índice do histórico de protocolos por consultor...")
+        # Entrega os protocolos já ordenados por consultor e data para a análise
+        # do rodízio (analise.py), sem ordenar o histórico inteiro
+        conn.execute(text("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_protocolos_consultor_created
+            ON protocolos (consultor_id, created_at)
+        """))
+        print("Validando restrições dos protocolos...")
+        # A validação não bloqueia escritas na tabela
+        conn.execute(text("ALTER TABLE protocolos VALIDATE CONSTRAINT ck_protocolos_prioridade"))
+        conn.execute(text("ALTER TABLE protocolos VALIDATE CONSTRAINT ck_protocolos_status"))
+
+    print("Migração concluída com sucesso!")
 
 if __name__ == "__main__":
     try:
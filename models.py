@@ -1,10 +1,19 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ARRAY, func, text, ForeignKey, inspect
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, Boolean, DateTime, Time, ARRAY, Index, func, text, ForeignKey, inspect
+from sqlalchemy import select, insert, update, exists, literal, any_, cast, or_, bindparam
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Session, relationship
 from database import Base, engine
 import schemas
+import resilience
+import outbox
+from cache import pipedrive_cache
+from availability import EstadoConsultor, indice as indice_disponibilidade
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from fastapi import HTTPException
+import logging
+
+logger = logging.getLogger("api")
 
 def check_table_exists(table_name: str) -> bool:
     """
@@ -32,7 +41,7 @@ class ControleProtocolo(Base):
     __tablename__ = "controle_protocolo"
 
     id = Column(Integer, primary_key=True)
-    ultimo_numero = Column(Integer, default=0)
+    ultimo_numero = Column(BigInteger, default=0)
     updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
 class Protocolo(Base):
@@ -40,11 +49,23 @@ class Protocolo(Base):
     Modelo para armazenar protocolos de atendimento.
     """
     __tablename__ = "protocolos"
+    __table_args__ = (
+        Index("uq_protocolos_sequencial", "sequencial", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    numero = Column(String, unique=True, index=True)  # Formato: #00001
+    sequencial = Column(BigInteger, nullable=False)  # Exibido como #00001
     consultor_id = Column(Integer, index=True)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    descricao = Column(String, nullable=True)
+    prioridade = Column(String(20), nullable=False, server_default="normal")
+    status = Column(String(20), nullable=False, server_default="aberto")
+    # O índice parcial da fila (idx_protocolos_abertos) usa a função prioridade_rank()
+    # e é criado apenas em migrations/setup_database.py
+
+    @property
+    def numero(self) -> str:
+        return schemas.formatar_numero_protocolo(self.sequencial)
 
     def to_dict(self):
         """
@@ -57,6 +78,7 @@ class Protocolo(Base):
                 result[key] = value.isoformat()
             else:
                 result[key] = value
+        result["numero"] = self.numero
         return result
 
     def __json__(self):
@@ -65,6 +87,22 @@ class Protocolo(Base):
         """
         return self.to_dict()
 
+class OutboxEvento(Base):
+    """
+    Modelo da outbox transacional de eventos para o CRM.
+    """
+    __tablename__ = "outbox_eventos"
+
+    id = Column(BigInteger, primary_key=True)
+    tipo = Column(String(100), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    criado_em = Column(DateTime(timezone=True), server_default=func.now())
+    tentativas = Column(Integer, nullable=False, server_default=text("0"))
+    proxima_tentativa_em = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    entregue_em = Column(DateTime(timezone=True), nullable=True)
+    descartado_em = Column(DateTime(timezone=True), nullable=True)
+    ultimo_erro = Column(String, nullable=True)
+
 class Consultor(Base):
     """
     Modelo de dados do Consultor.
@@ -81,6 +119,8 @@ class Consultor(Base):
     status_online = Column(Boolean, default=False)
     ultimo_atendimento = Column(DateTime(timezone=True), nullable=True)
     id_pipedrive = Column(Integer, nullable=True, index=True)
+    status_override_ate = Column(DateTime(timezone=True), nullable=True)  # Status manual vale até aqui
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # Removido; o purge apaga depois da carência
 
     def to_dict(self):
         """
@@ -101,62 +141,126 @@ class Consultor(Base):
         """
         return self.to_dict()
 
-def get_proximo_numero_protocolo(db: Session) -> str:
+class ProtocoloArquivado(Base):
     """
-    Gera o próximo número de protocolo.
+    Protocolos de consultores removidos, movidos pelo purge.
     """
-    controle = db.query(ControleProtocolo).first()
-    if not controle:
-        controle = ControleProtocolo(ultimo_numero=0)
-        db.add(controle)
-        db.commit()
-        db.refresh(controle)
-    
-    controle.ultimo_numero += 1
-    controle.updated_at = datetime.now(timezone.utc)
-    db.commit()
-    
-    return f"#{controle.ultimo_numero:05d}"  # Formato: #00001
+    __tablename__ = "protocolos_arquivo"
+
+    id = Column(Integer, primary_key=True)
+    sequencial = Column(BigInteger, nullable=False)
+    consultor_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True))
+    descricao = Column(String, nullable=True)
+    prioridade = Column(String(20), nullable=False)
+    status = Column(String(20), nullable=False)
+    arquivado_em = Column(DateTime(timezone=True), server_default=func.now())
+
+class TurnoConsultor(Base):
+    """
+    Janela semanal de trabalho de um consultor, no fuso TURNOS_TIMEZONE.
+    """
+    __tablename__ = "turnos_consultor"
+
+    id = Column(Integer, primary_key=True)
+    consultor_id = Column(Integer, ForeignKey("consultores.id", ondelete="CASCADE"), nullable=False, index=True)
+    dia_semana = Column(SmallInteger, nullable=False)  # 1 = segunda ... 7 = domingo
+    inicio = Column(Time, nullable=False)
+    fim = Column(Time, nullable=False)  # fim <= inicio: o turno termina no dia seguinte
+
+class ControleTurnos(Base):
+    """
+    Até onde as transições de turno já foram aplicadas.
+    """
+    __tablename__ = "controle_turnos"
 
-def gerar_novo_protocolo(db: Session) -> schemas.ProtocoloResponse:
+    id = Column(Integer, primary_key=True)
+    processado_ate = Column(DateTime(timezone=True), nullable=False)
+
+# Motor único de criação de protocolos.
+# CTEs que numeram e inserem um protocolo para o consultor da CTE `origem`,
+# usadas por todas as formas de criação (distribuição, criação direta e
+# geração avulsa). O contador só avança quando a origem tem uma linha,
+# então não há buracos na numeração quando nenhum consultor é encontrado.
+# A criação direta também grava descricao e prioridade, recebidas como
+# parâmetros :descricao e :prioridade.
+def _ctes_novo_protocolo(com_detalhes: bool = False) -> str:
+    colunas, valores = "", ""
+    if com_detalhes:
+        colunas, valores = ", descricao, prioridade", ", :descricao, :prioridade"
+    return f"""
+    numero_protocolo AS (
+        INSERT INTO controle_protocolo (id, ultimo_numero, updated_at)
+        SELECT 1, 1, NOW()
+        WHERE EXISTS (SELECT 1 FROM origem)
+        ON CONFLICT (id) DO UPDATE
+        SET ultimo_numero = controle_protocolo.ultimo_numero + 1,
+            updated_at = EXCLUDED.updated_at
+        RETURNING ultimo_numero
+    ),
+    protocolo_gerado AS (
+        INSERT INTO protocolos (sequencial, consultor_id, created_at{colunas})
+        SELECT np.ultimo_numero, o.id, NOW(){valores}
+        FROM origem o
+        CROSS JOIN numero_protocolo np
+        RETURNING id, sequencial, consultor_id, created_at, descricao, prioridade, status
+    )
+"""
+
+_CTES_NOVO_PROTOCOLO = _ctes_novo_protocolo()
+
+def _sql_novo_protocolo(origem: str, com_detalhes: bool = False) -> text:
+    """
+    Monta o comando que cria um protocolo para o consultor selecionado por `origem`.
+    """
+    return text(f"""
+        WITH origem AS (
+            {origem}
+        ),
+        {_ctes_novo_protocolo(com_detalhes)}
+        SELECT * FROM protocolo_gerado
+    """)
+
+_SQL_CRIAR_PROTOCOLO = _sql_novo_protocolo("""
+            SELECT id FROM consultores WHERE id = :consultor_id AND deleted_at IS NULL
+""", com_detalhes=True)
+
+# Protocolo avulso: só consome um número, sem consultor, para não ser
+# contado como atendimento de ninguém nas estatísticas e análises
+_SQL_GERAR_PROTOCOLO = _sql_novo_protocolo("""
+            SELECT CAST(NULL AS INTEGER) AS id
+""")
+
+def gerar_novo_protocolo(db: Session) -> Protocolo:
     """
-    Gera um novo número de protocolo sem associá-lo a um consultor.
+    Gera um novo número de protocolo sem consultor (consultor_id NULL).
     """
     try:
-        consultor = db.query(Consultor).filter(Consultor.status_ativo == True).first()
-        if not consultor:
-            raise HTTPException(status_code=400, detail="Não há consultores ativos no sistema")
-            
-        numero = get_proximo_numero_protocolo(db)
-        protocolo = Protocolo(
-            numero=numero,
-            consultor_id=consultor.id
-        )
-        db.add(protocolo)
+        row = db.execute(_SQL_GERAR_PROTOCOLO).first()
         db.commit()
-        db.refresh(protocolo)
-        return protocolo
-    except HTTPException:
-        db.rollback()
-        raise
+        return Protocolo(**row._mapping)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao gerar protocolo: {str(e)}")
 
-def criar_protocolo(db: Session, consultor_id: int) -> Protocolo:
+def criar_protocolo(db: Session, protocolo: schemas.ProtocoloCreate) -> Protocolo:
     """
-    Cria um novo protocolo de atendimento.
+    Cria um novo protocolo de atendimento com a descrição e a prioridade informadas.
     """
     try:
-        numero = get_proximo_numero_protocolo(db)
-        protocolo = Protocolo(
-            numero=numero,
-            consultor_id=consultor_id
-        )
-        db.add(protocolo)
+        row = db.execute(_SQL_CRIAR_PROTOCOLO, {
+            "consultor_id": protocolo.consultor_id,
+            "descricao": protocolo.descricao,
+            "prioridade": protocolo.prioridade
+        }).first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Consultor não encontrado")
+
         db.commit()
-        db.refresh(protocolo)
-        return protocolo
+        return Protocolo(**row._mapping)
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao criar protocolo: {str(e)}")
@@ -176,45 +280,183 @@ def verify_api_key(db: Session, api_key: str) -> bool:
         )
     return True
 
-def get_consultores(db: Session) -> List[Consultor]:
+def selecionar_colunas(modelo, campos: str, virtuais: Optional[dict] = None) -> list:
+    """
+    Converte o parâmetro `fields` (nomes separados por vírgula) nas colunas do modelo.
+    `virtuais` mapeia campos da API sem coluna própria para a expressão que os gera.
+    Nomes desconhecidos resultam em 400.
+    """
+    tabela = modelo.__table__
+    virtuais = virtuais or {}
+    nomes = list(dict.fromkeys(c.strip() for c in campos.split(",") if c.strip()))
+    if not nomes:
+        raise HTTPException(status_code=400, detail="Informe ao menos um campo em fields")
+    invalidos = [nome for nome in nomes if nome not in tabela.c and nome not in virtuais]
+    if invalidos:
+        disponiveis = list(tabela.c.keys()) + list(virtuais)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos inválidos: {', '.join(invalidos)}. Disponíveis: {', '.join(disponiveis)}"
+        )
+    return [virtuais[nome].label(nome) if nome in virtuais else tabela.c[nome] for nome in nomes]
+
+def _padrao_busca(texto: str) -> str:
     """
-    Retorna todos os consultores.
+    Padrão ILIKE que procura `texto` em qualquer posição, com % e _ literais.
     """
-    return db.query(Consultor).all()
+    escapado = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escapado}%"
+
+def get_consultores(db: Session, campos: Optional[str] = None, idioma: Optional[str] = None,
+                    status_ativo: Optional[bool] = None, status_online: Optional[bool] = None,
+                    busca: Optional[str] = None, cursor: Optional[int] = None,
+                    limite: Optional[int] = None) -> Tuple[List, Optional[int]]:
+    """
+    Retorna os consultores não removidos, com filtros opcionais.
+    `idioma` usa o índice GIN de idiomas e `busca` procura o texto em nome ou
+    email com ILIKE (índices trigram, quando o pg_trgm está instalado). Com
+    `cursor`/`limite`, pagina por id (keyset):
+    retorna também o cursor da próxima página, ou None na última.
+    Com `campos`, seleciona apenas essas colunas e retorna dicionários.
+    """
+    tabela = Consultor.__table__
+    if campos:
+        colunas = selecionar_colunas(Consultor, campos)
+        query = select(*colunas)
+        if limite is not None and "id" not in [c.name for c in colunas]:
+            # O cursor precisa do id mesmo quando ele não foi pedido
+            query = query.add_columns(tabela.c.id.label("_cursor"))
+    else:
+        query = select(Consultor)
+
+    query = query.where(tabela.c.deleted_at.is_(None))
+    if idioma is not None:
+        # idiomas é VARCHAR[]: o cast permite usar o índice GIN com @>
+        query = query.where(tabela.c.idiomas.op("@>")(cast([idioma], ARRAY(String))))
+    if status_ativo is not None:
+        query = query.where(tabela.c.status_ativo == status_ativo)
+    if status_online is not None:
+        query = query.where(tabela.c.status_online == status_online)
+    if busca:
+        padrao = _padrao_busca(busca)
+        query = query.where(or_(tabela.c.nome.ilike(padrao), tabela.c.email.ilike(padrao)))
+    if cursor is not None:
+        query = query.where(tabela.c.id > cursor)
+    if cursor is not None or limite is not None:
+        query = query.order_by(tabela.c.id)
+    if limite is not None:
+        query = query.limit(limite)
+
+    if not campos:
+        consultores = db.execute(query).scalars().all()
+        ids = [c.id for c in consultores]
+    else:
+        consultores = [dict(row._mapping) for row in db.execute(query)]
+        ids = [c.pop("_cursor", None) or c.get("id") for c in consultores]
+
+    proximo = ids[-1] if limite is not None and len(consultores) == limite else None
+    return consultores, proximo
 
 def get_consultor(db: Session, consultor_id: int) -> Optional[Consultor]:
     """
-    Retorna um consultor específico pelo ID.
+    Retorna um consultor específico pelo ID (None se não existir ou estiver removido).
     """
-    return db.query(Consultor).filter(Consultor.id == consultor_id).first()
+    return db.query(Consultor).filter(
+        Consultor.id == consultor_id,
+        Consultor.deleted_at.is_(None)
+    ).first()
+
+def get_consultores_por_pipedrive(db: Session, ids_pipedrive: List[int]) -> Dict[int, Optional[dict]]:
+    """
+    Mapeia ids do Pipedrive para os dados dos consultores (None quando não há).
+    Os ids ausentes do cache são carregados em uma única query; se mais de um
+    consultor tiver o mesmo id_pipedrive, vale o de menor id.
+    """
+    resultado, faltantes = pipedrive_cache.obter(ids_pipedrive)
+    if faltantes:
+        geracao = pipedrive_cache.geracao
+        tabela = Consultor.__table__
+        rows = db.execute(
+            select(tabela)
+            .where(tabela.c.id_pipedrive == any_(literal(faltantes, ARRAY(Integer))))
+            .where(tabela.c.deleted_at.is_(None))
+            .order_by(tabela.c.id_pipedrive, tabela.c.id)
+            .distinct(tabela.c.id_pipedrive)
+        ).all()
+
+        carregados = dict.fromkeys(faltantes)
+        for row in rows:
+            carregados[row.id_pipedrive] = dict(row._mapping)
+        pipedrive_cache.guardar(carregados, geracao)
+        resultado.update(carregados)
+    return resultado
+
+def _consultor_da_linha(row) -> Consultor:
+    """
+    Monta um Consultor desanexado da sessão a partir de uma linha RETURNING.
+    Como não está na sessão, o commit não o expira e a serialização não
+    dispara um novo SELECT.
+    """
+    return Consultor(**row._mapping)
+
+def _apos_escrita_consultor(consultor_id: int, id_pipedrive: Optional[int] = None,
+                            linha=None, removido: bool = False,
+                            atendido_em: Optional[datetime] = None) -> None:
+    """
+    Atualiza os dados em memória derivados do consultor após uma escrita confirmada:
+    invalida o cache do Pipedrive e, sem o LISTEN do índice de disponibilidade,
+    aplica a linha gravada (ou o novo atendimento) ao índice.
+    Chamado depois do commit e fora do tratamento de erros da escrita: uma falha
+    aqui só é registrada, sem transformar a escrita confirmada em erro.
+    """
+    try:
+        pipedrive_cache.invalidar(consultor_id=consultor_id, id_pipedrive=id_pipedrive)
+        if indice_disponibilidade.ouvindo:
+            # A alteração chega ao índice pela notificação do banco, na ordem dos commits
+            return
+        if removido:
+            indice_disponibilidade.remover(consultor_id)
+        elif linha is not None:
+            indice_disponibilidade.atualizar(EstadoConsultor.da_linha(linha._mapping))
+        if atendido_em is not None:
+            indice_disponibilidade.registrar_atendimento(consultor_id, atendido_em)
+    except Exception as e:
+        logger.error(f"CONSULTOR | erro ao atualizar dados em memória do consultor {consultor_id}: {str(e)}")
 
 def criar_consultor(db: Session, consultor: schemas.ConsultorCreate) -> Consultor:
     """
     Cria um novo consultor.
+    A verificação de email duplicado e a inserção são um único INSERT ... RETURNING.
     """
+    tabela = Consultor.__table__
     try:
+        agora = datetime.now(timezone.utc)
+        valores = {
+            "nome": consultor.nome,
+            "email": consultor.email,
+            "telefone": consultor.telefone,
+            "idiomas": consultor.idiomas,
+            "status_ativo": consultor.status_ativo,
+            "status_ativo_sequencial": consultor.status_ativo_sequencial,
+            "status_online": consultor.status_online,
+            "ultimo_atendimento": agora,
+            "id_pipedrive": consultor.id_pipedrive
+        }
+
         if consultor.email:
-            existente = db.query(Consultor).filter(Consultor.email == consultor.email).first()
-            if existente:
-                raise HTTPException(status_code=400, detail="Email já cadastrado")
+            # Só insere se não houver outro consultor (não removido) com o mesmo email
+            origem = select(
+                *[literal(valor, tabela.c[coluna].type).label(coluna) for coluna, valor in valores.items()]
+            ).where(~exists().where(tabela.c.email == consultor.email, tabela.c.deleted_at.is_(None)))
+            stmt = insert(tabela).from_select(list(valores), origem)
+        else:
+            stmt = insert(tabela).values(**valores)
 
-        agora = datetime.now(timezone.utc)
-        db_consultor = Consultor(
-            nome=consultor.nome,
-            email=consultor.email,
-            telefone=consultor.telefone,
-            idiomas=consultor.idiomas,
-            status_ativo=consultor.status_ativo,
-            status_ativo_sequencial=consultor.status_ativo_sequencial,
-            status_online=consultor.status_online,
-            ultimo_atendimento=agora,
-            id_pipedrive=consultor.id_pipedrive
-        )
+        row = db.execute(stmt.returning(*tabela.c)).first()
+        if row is None:
+            raise HTTPException(status_code=400, detail="Email já cadastrado")
 
-        db.add(db_consultor)
         db.commit()
-        db.refresh(db_consultor)
-        return db_consultor
     except HTTPException:
         db.rollback()
         raise
@@ -225,57 +467,367 @@ def criar_consultor(db: Session, consultor: schemas.ConsultorCreate) -> Consulto
             detail=f"Erro interno ao criar consultor: {str(e)}"
         )
 
+    _apos_escrita_consultor(row.id, row.id_pipedrive, linha=row)
+    return _consultor_da_linha(row)
+
 def atualizar_consultor(db: Session, consultor_id: int, consultor: schemas.ConsultorUpdate) -> Optional[Consultor]:
     """
-    Atualiza os dados de um consultor.
+    Atualiza os dados de um consultor com um único UPDATE ... RETURNING.
+    Alterar status_online descarta um override anterior, como no
+    PUT /consultor/{id}/connection sem `ate`.
     """
-    db_consultor = get_consultor(db, consultor_id)
-    if not db_consultor:
-        raise HTTPException(status_code=404, detail="Consultor não encontrado")
-    
     update_data = consultor.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_consultor, key, value)
-    
+    if "status_online" in update_data:
+        update_data["status_override_ate"] = None
+    if not update_data:
+        db_consultor = get_consultor(db, consultor_id)
+        if not db_consultor:
+            raise HTTPException(status_code=404, detail="Consultor não encontrado")
+        return db_consultor
+
+    tabela = Consultor.__table__
+    row = db.execute(
+        update(tabela)
+        .where(tabela.c.id == consultor_id, tabela.c.deleted_at.is_(None))
+        .values(**update_data)
+        .returning(*tabela.c)
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Consultor não encontrado")
+
     db.commit()
-    db.refresh(db_consultor)
-    return db_consultor
+    _apos_escrita_consultor(row.id, row.id_pipedrive, linha=row)
+    return _consultor_da_linha(row)
 
 def deletar_consultor(db: Session, consultor_id: int) -> dict:
     """
-    Remove um consultor do sistema.
+    Remove um consultor do sistema (soft delete) com um único UPDATE ... RETURNING.
+    O consultor sai da distribuição e das listagens na hora; os protocolos e a
+    linha são apagados depois, em lotes, pelo purge.
     """
-    db_consultor = get_consultor(db, consultor_id)
-    if not db_consultor:
+    tabela = Consultor.__table__
+    row = db.execute(
+        update(tabela)
+        .where(tabela.c.id == consultor_id, tabela.c.deleted_at.is_(None))
+        .values(deleted_at=func.now(), status_online=False, status_override_ate=None)
+        .returning(tabela.c.id, tabela.c.id_pipedrive)
+    ).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Consultor não encontrado")
-    
-    db.delete(db_consultor)
+
     db.commit()
+    _apos_escrita_consultor(row.id, row.id_pipedrive, removido=True)
     return {"detail": "Consultor removido com sucesso"}
 
-def atualizar_status_conexao(db: Session, consultor_id: int, online: bool) -> Optional[Consultor]:
+def atualizar_status_conexao(db: Session, consultor_id: int, online: bool,
+                             ate: Optional[datetime] = None) -> Optional[Consultor]:
+    """
+    Atualiza o status de conexão de um consultor com um único UPDATE ... RETURNING.
+    Com `ate`, o status vale até esse momento: as transições de turno são
+    ignoradas até lá e, ao vencer, o escalonador aplica o estado da escala.
+    Sem `ate`, um override anterior é descartado.
+    """
+    if ate is not None:
+        if ate.tzinfo is None:
+            ate = ate.replace(tzinfo=timezone.utc)
+        if ate <= datetime.now(timezone.utc):
+            raise HTTPException(status_code=400, detail="O parâmetro ate deve estar no futuro")
+
+    tabela = Consultor.__table__
+    row = db.execute(
+        update(tabela)
+        .where(tabela.c.id == consultor_id, tabela.c.deleted_at.is_(None))
+        .values(status_online=online, status_override_ate=ate)
+        .returning(*tabela.c)
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Consultor não encontrado")
+
+    db.commit()
+    _apos_escrita_consultor(row.id, row.id_pipedrive, linha=row)
+    return _consultor_da_linha(row)
+
+_SQL_SUBSTITUIR_TURNOS = text("""
+    WITH consultor AS (
+        SELECT id FROM consultores WHERE id = :consultor_id AND deleted_at IS NULL
+    ),
+    removidos AS (
+        DELETE FROM turnos_consultor
+        WHERE consultor_id IN (SELECT id FROM consultor)
+    ),
+    inseridos AS (
+        INSERT INTO turnos_consultor (consultor_id, dia_semana, inicio, fim)
+        SELECT c.id, t.dia_semana, t.inicio, t.fim
+        FROM consultor c
+        CROSS JOIN unnest(
+            CAST(:dias AS SMALLINT[]), CAST(:inicios AS TIME[]), CAST(:fins AS TIME[])
+        ) AS t(dia_semana, inicio, fim)
+        RETURNING id, dia_semana, inicio, fim
+    )
+    SELECT
+        (SELECT id FROM consultor) AS consultor_id,
+        (SELECT json_agg(i ORDER BY i.dia_semana, i.inicio) FROM inseridos i) AS turnos
+""")
+
+def substituir_turnos(db: Session, consultor_id: int, turnos: List[schemas.TurnoBase]) -> List[dict]:
     """
-    Atualiza o status de conexão de um consultor.
+    Substitui a escala semanal do consultor em um único comando.
     """
-    db_consultor = get_consultor(db, consultor_id)
-    if not db_consultor:
+    row = db.execute(_SQL_SUBSTITUIR_TURNOS, {
+        "consultor_id": consultor_id,
+        "dias": [t.dia_semana for t in turnos],
+        "inicios": [t.inicio for t in turnos],
+        "fins": [t.fim for t in turnos]
+    }).first()
+    if row.consultor_id is None:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Consultor não encontrado")
-    
-    db_consultor.status_online = online
+
     db.commit()
-    db.refresh(db_consultor)
-    return db_consultor
+    return row.turnos or []
 
-def get_consultor_da_vez(db: Session, idioma: str) -> schemas.ConsultorDaVezResponse:
+def get_turnos(db: Session, consultor_id: int) -> List[TurnoConsultor]:
     """
-    Retorna o próximo consultor disponível para atendimento e gera um protocolo.
-    Query otimizada que seleciona e atualiza o consultor em uma única transação.
+    Retorna a escala semanal do consultor.
+    """
+    rows = db.execute(
+        select(Consultor.id, TurnoConsultor)
+        .outerjoin(TurnoConsultor, TurnoConsultor.consultor_id == Consultor.id)
+        .where(Consultor.id == consultor_id, Consultor.deleted_at.is_(None))
+        .order_by(TurnoConsultor.dia_semana, TurnoConsultor.inicio)
+    ).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Consultor não encontrado")
+    return [row.TurnoConsultor for row in rows if row.TurnoConsultor is not None]
+
+# Aplica, em um único UPDATE, todas as transições de turno ocorridas desde a
+# última execução e os overrides de status vencidos. As fronteiras dos turnos
+# são comparadas em segundos desde segunda-feira 00:00 no fuso :fuso. O lock
+# em controle_turnos garante que só um worker processa cada intervalo; uma
+# parada longa processa no máximo a última semana.
+_SQL_APLICAR_TURNOS = text("""
+    WITH janela AS (
+        SELECT
+            GREATEST(processado_ate, NOW() - INTERVAL '7 days' + INTERVAL '1 second') AS desde,
+            NOW() AS ate
+        FROM controle_turnos
+        WHERE id = 1
+        FOR UPDATE SKIP LOCKED
+    ),
+    avanco AS (
+        UPDATE controle_turnos
+        SET processado_ate = j.ate
+        FROM janela j
+        WHERE controle_turnos.id = 1
+        RETURNING 1
+    ),
+    semana AS (
+        SELECT
+            EXTRACT(EPOCH FROM (j.desde AT TIME ZONE :fuso) - date_trunc('week', j.desde AT TIME ZONE :fuso)) AS s0,
+            EXTRACT(EPOCH FROM (j.ate AT TIME ZONE :fuso) - date_trunc('week', j.ate AT TIME ZONE :fuso)) AS s1
+        FROM janela j
+    ),
+    turnos AS (
+        SELECT
+            consultor_id,
+            (dia_semana - 1) * 86400 + EXTRACT(EPOCH FROM inicio) AS inicio_s,
+            CASE
+                WHEN fim > inicio THEN EXTRACT(EPOCH FROM fim - inicio)
+                ELSE 86400 - EXTRACT(EPOCH FROM inicio - fim)
+            END AS duracao_s
+        FROM turnos_consultor
+    ),
+    -- Última fronteira de cada consultor dentro de (desde, ate]; no empate entre
+    -- o fim de um turno e o início do seguinte, prevalece o início
+    bordas AS (
+        SELECT DISTINCT ON (b.consultor_id) b.consultor_id, b.online
+        FROM (
+            SELECT consultor_id, inicio_s AS s, true AS online FROM turnos
+            UNION ALL
+            SELECT consultor_id, MOD(inicio_s + duracao_s, 604800), false FROM turnos
+        ) b
+        CROSS JOIN semana w
+        WHERE MOD(b.s - w.s0 + 604800, 604800) > 0
+        AND MOD(b.s - w.s0 + 604800, 604800) <= MOD(w.s1 - w.s0 + 604800, 604800)
+        ORDER BY b.consultor_id, MOD(b.s - w.s0 + 604800, 604800) DESC, b.online DESC
+    ),
+    -- Estado da escala agora, para quem tem override vencendo
+    escala AS (
+        SELECT t.consultor_id, bool_or(MOD(w.s1 - t.inicio_s + 604800, 604800) < t.duracao_s) AS online
+        FROM turnos t
+        CROSS JOIN semana w
+        GROUP BY t.consultor_id
+    ),
+    alvo AS (
+        -- Override vencido: volta à escala ou, sem escala, ao status anterior
+        SELECT c.id, COALESCE(e.online, NOT c.status_online) AS online
+        FROM consultores c
+        CROSS JOIN janela j
+        LEFT JOIN escala e ON e.consultor_id = c.id
+        WHERE c.status_override_ate <= j.ate
+        AND c.deleted_at IS NULL
+        UNION ALL
+        SELECT b.consultor_id, b.online
+        FROM bordas b
+        JOIN consultores c ON c.id = b.consultor_id
+        WHERE c.status_override_ate IS NULL
+        AND c.deleted_at IS NULL
+    )
+    UPDATE consultores c
+    SET status_online = a.online,
+        status_override_ate = NULL
+    FROM alvo a
+    WHERE c.id = a.id
+    AND (c.status_online IS DISTINCT FROM a.online OR c.status_override_ate IS NOT NULL)
+    RETURNING c.*
+""")
+
+def inicializar_controle_turnos(db: Session) -> None:
+    """
+    Garante o registro do controle de turnos; transições anteriores à criação são ignoradas.
+    """
+    db.execute(text("""
+        INSERT INTO controle_turnos (id, processado_ate)
+        VALUES (1, NOW())
+        ON CONFLICT (id) DO NOTHING
+    """))
+    db.commit()
+
+def aplicar_transicoes_turnos(db: Session, fuso: str) -> int:
+    """
+    Aplica as transições de turno e os overrides vencidos.
+    Retorna a quantidade de consultores alterados.
+    """
+    rows = db.execute(_SQL_APLICAR_TURNOS, {"fuso": fuso}).all()
+    db.commit()
+    for row in rows:
+        _apos_escrita_consultor(row.id, row.id_pipedrive, linha=row)
+    return len(rows)
+
+# Purge de consultores removidos. Cada lote pega protocolos de um consultor
+# removido há mais de :carencia_horas (pelo índice de consultor_id, sem
+# ordenar o histórico inteiro) e os move para protocolos_arquivo ou apenas os
+# apaga. O advisory lock faz com que só um worker purgue por vez, para que o
+# ritmo configurado valha para a instância inteira.
+_CTE_LOTE_PURGE = """
+    trava AS (
+        SELECT pg_try_advisory_xact_lock(hashtext('purge_consultores')) AS obtida
+    ),
+    consultor AS (
+        SELECT c.id
+        FROM consultores c
+        WHERE c.deleted_at <= NOW() - CAST(:carencia_horas AS DOUBLE PRECISION) * INTERVAL '1 hour'
+        AND EXISTS (SELECT 1 FROM protocolos p WHERE p.consultor_id = c.id)
+        AND (SELECT obtida FROM trava)
+        ORDER BY c.deleted_at, c.id
+        LIMIT 1
+    ),
+    lote AS (
+        SELECT p.id
+        FROM protocolos p
+        WHERE p.consultor_id = (SELECT id FROM consultor)
+        LIMIT :lote
+        FOR UPDATE SKIP LOCKED
+    ),
+    removidos AS (
+        DELETE FROM protocolos p
+        USING lote l
+        WHERE p.id = l.id
+        RETURNING p.id, p.sequencial, p.consultor_id, p.created_at, p.descricao, p.prioridade, p.status
+    )
+"""
+
+def _sql_purgar_protocolos(arquivar: bool) -> text:
+    """
+    Monta o comando que remove (e, com `arquivar`, arquiva) um lote de protocolos.
+    """
+    if arquivar:
+        final = """
+        , arquivados AS (
+            INSERT INTO protocolos_arquivo (id, sequencial, consultor_id, created_at, descricao, prioridade, status)
+            SELECT id, sequencial, consultor_id, created_at, descricao, prioridade, status FROM removidos
+            RETURNING 1
+        )
+        SELECT COUNT(*) FROM arquivados
+        """
+    else:
+        final = "SELECT COUNT(*) FROM removidos"
+    return text(f"""
+        WITH {_CTE_LOTE_PURGE}
+        {final}
+    """)
+
+_SQL_PURGAR_PROTOCOLOS = {
+    True: _sql_purgar_protocolos(arquivar=True),
+    False: _sql_purgar_protocolos(arquivar=False)
+}
+
+# Consultores removidos cujo histórico já foi purgado. Protocolos gravados
+# por uma transação concorrente à remoção ainda caem no ON DELETE CASCADE,
+# que aqui apaga no máximo algumas linhas.
+_SQL_PURGAR_CONSULTORES = text("""
+    DELETE FROM consultores c
+    WHERE c.id IN (
+        SELECT id FROM consultores
+        WHERE deleted_at <= NOW() - CAST(:carencia_horas AS DOUBLE PRECISION) * INTERVAL '1 hour'
+        AND NOT EXISTS (SELECT 1 FROM protocolos p WHERE p.consultor_id = consultores.id)
+        ORDER BY deleted_at, id
+        LIMIT :lote
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING c.id
+""")
+
+def purgar_lote_protocolos(db: Session, lote: int, carencia_horas: float, arquivar: bool = True) -> int:
+    """
+    Purga um lote de protocolos de consultores removidos em uma transação curta.
+    Retorna a quantidade de protocolos purgados (0 quando não há mais nada
+    ou outro worker está purgando).
+    """
+    quantidade = db.execute(
+        _SQL_PURGAR_PROTOCOLOS[arquivar],
+        {"lote": lote, "carencia_horas": carencia_horas}
+    ).scalar()
+    db.commit()
+    return quantidade
+
+def purgar_consultores(db: Session, lote: int, carencia_horas: float) -> int:
     """
-    sql = text("""
-        -- Primeiro, desabilita o trigger
-        DROP TRIGGER IF EXISTS trg_create_protocol_on_consultant_selection ON consultores;
-        
-        -- Depois, seleciona e atualiza o consultor
+    Apaga as linhas de consultores removidos que não têm mais protocolos.
+    """
+    rows = db.execute(_SQL_PURGAR_CONSULTORES, {"lote": lote, "carencia_horas": carencia_horas}).all()
+    db.commit()
+    return len(rows)
+
+# Grava o evento de atribuição na outbox, na mesma transação da distribuição
+_CTE_EVENTO_OUTBOX = """
+    evento_outbox AS (
+        INSERT INTO outbox_eventos (tipo, payload)
+        SELECT
+            'consultor.atribuido',
+            json_build_object(
+                'consultor_id', ca.id,
+                'consultor_id_pipedrive', ca.id_pipedrive,
+                'consultor_nome', ca.nome,
+                'consultor_email', ca.email,
+                'idioma', CAST(:idioma AS TEXT),
+                'protocolo_id', pg.id,
+                'protocolo_sequencial', pg.sequencial,
+                'numero_protocolo', '#' || LPAD(CAST(pg.sequencial AS TEXT), GREATEST(5, LENGTH(CAST(pg.sequencial AS TEXT))), '0'),
+                'atribuido_em', ca.timestamp_atendimento
+            )
+        FROM origem ca
+        CROSS JOIN protocolo_gerado pg
+        RETURNING id
+    )
+"""
+
+def _sql_consultor_da_vez(com_outbox: bool) -> text:
+    """
+    Monta o comando que seleciona e atualiza o consultor e gera o protocolo
+    (e, com a outbox habilitada, grava o evento para o CRM).
+    """
+    return text(f"""
         WITH consultor_selecionado AS (
             SELECT 
                 c.id,
@@ -290,6 +842,7 @@ def get_consultor_da_vez(db: Session, idioma: str) -> schemas.ConsultorDaVezResp
             WHERE c.status_ativo = true
             AND c.status_ativo_sequencial = true
             AND c.status_online = true
+            AND c.deleted_at IS NULL
             AND :idioma = ANY(c.idiomas)
             ORDER BY 
                 COALESCE(c.ultimo_atendimento, '1970-01-01'::timestamptz) ASC,
@@ -297,7 +850,7 @@ def get_consultor_da_vez(db: Session, idioma: str) -> schemas.ConsultorDaVezResp
             LIMIT 1
             FOR UPDATE SKIP LOCKED
         ),
-        consultor_atualizado AS (
+        origem AS (
             UPDATE consultores c
             SET ultimo_atendimento = cs.timestamp_atendimento
             FROM consultor_selecionado cs
@@ -305,23 +858,8 @@ def get_consultor_da_vez(db: Session, idioma: str) -> schemas.ConsultorDaVezResp
             RETURNING 
                 cs.*
         ),
-        numero_protocolo AS (
-            UPDATE controle_protocolo
-            SET ultimo_numero = ultimo_numero + 1,
-                updated_at = NOW()
-            WHERE id = 1
-            RETURNING ultimo_numero
-        ),
-        protocolo_gerado AS (
-            INSERT INTO protocolos (numero, consultor_id, created_at)
-            SELECT 
-                '#' || LPAD(CAST(np.ultimo_numero AS TEXT), 5, '0'),
-                ca.id,
-                ca.timestamp_atendimento
-            FROM consultor_atualizado ca
-            CROSS JOIN numero_protocolo np
-            RETURNING numero
-        )
+        {_CTES_NOVO_PROTOCOLO}
+        {"," + _CTE_EVENTO_OUTBOX if com_outbox else ""}
         SELECT 
             json_build_object(
                 'consultor_id', ca.id,
@@ -332,36 +870,107 @@ def get_consultor_da_vez(db: Session, idioma: str) -> schemas.ConsultorDaVezResp
                 'consultor_status_online', ca.status_online,
                 'consultor_atendimento_iso', ca.timestamp_atendimento,
                 'consultor_id_pipedrive', ca.id_pipedrive,
-                'numero_protocolo', pg.numero
+                'protocolo_sequencial', pg.sequencial
             ) as result
-        FROM consultor_atualizado ca
+        FROM origem ca
         CROSS JOIN protocolo_gerado pg;
     """)
 
+_SQL_CONSULTOR_DA_VEZ = _sql_consultor_da_vez(com_outbox=outbox.OUTBOX_ENABLED)
+
+def get_consultor_da_vez(db: Session, idioma: str) -> schemas.ConsultorDaVezResponse:
+    """
+    Retorna o próximo consultor disponível para atendimento e gera um protocolo.
+    Query otimizada que seleciona e atualiza o consultor em uma única transação.
+    """
     try:
-        result = db.execute(sql, {"idioma": idioma}).fetchone()
+        try:
+            result = db.execute(_SQL_CONSULTOR_DA_VEZ, {"idioma": idioma}).fetchone()
+        except Exception as e:
+            if resilience.eh_falha_do_banco(e):
+                resilience.db_breaker.registrar_falha()
+            raise
+        resilience.db_breaker.registrar_sucesso()
         if not result:
             raise HTTPException(status_code=404, detail=f"Não há consultor disponível para o idioma {idioma}")
 
         data = result.result
         db.commit()
-        return schemas.ConsultorDaVezResponse(**data)
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
+        if resilience.eh_timeout(e):
+            raise resilience.servico_indisponivel(
+                "Tempo limite excedido ao selecionar consultor",
+                resilience.DISPATCH_RETRY_AFTER_S
+            )
         raise HTTPException(
             status_code=500,
             detail=f"Erro ao selecionar consultor: {str(e)}"
         )
 
-def get_protocolos(db: Session, consultor_id: Optional[int] = None, skip: int = 0, limit: int = 100) -> List[Protocolo]:
+    _apos_escrita_consultor(
+        data["consultor_id"], atendido_em=datetime.fromisoformat(data["consultor_atendimento_iso"])
+    )
+    data["numero_protocolo"] = schemas.formatar_numero_protocolo(data.pop("protocolo_sequencial"))
+    return schemas.ConsultorDaVezResponse(**data)
+
+def get_protocolos(db: Session, consultor_id: Optional[int] = None, skip: int = 0, limit: int = 100,
+                   campos: Optional[str] = None, numero_inicial: Optional[int] = None,
+                   numero_final: Optional[int] = None) -> List:
     """
     Retorna todos os protocolos com paginação.
     Se consultor_id for fornecido, filtra por consultor.
-    """
-    query = db.query(Protocolo)
+    Com numero_inicial/numero_final, filtra a faixa de números (varredura no
+    índice de `sequencial`) e ordena por número.
+    Com `campos`, seleciona apenas essas colunas e retorna dicionários.
+    """
+    if campos:
+        query = select(*selecionar_colunas(Protocolo, campos, {"numero": Protocolo.sequencial}))
+    else:
+        query = select(Protocolo)
+
     if consultor_id is not None:
-        query = query.filter(Protocolo.consultor_id == consultor_id)
-    return query.offset(skip).limit(limit).all()
+        query = query.where(Protocolo.consultor_id == consultor_id)
+    if numero_inicial is not None:
+        query = query.where(Protocolo.sequencial >= numero_inicial)
+    if numero_final is not None:
+        query = query.where(Protocolo.sequencial <= numero_final)
+    if numero_inicial is not None or numero_final is not None:
+        query = query.order_by(Protocolo.sequencial)
+    query = query.offset(skip).limit(limit)
+
+    if not campos:
+        return db.execute(query).scalars().all()
+
+    linhas = [dict(row._mapping) for row in db.execute(query)]
+    for linha in linhas:
+        if "numero" in linha:
+            linha["numero"] = schemas.formatar_numero_protocolo(linha["numero"])
+    return linhas
+
+def get_protocolos_abertos(db: Session, consultor_id: Optional[int] = None,
+                           skip: int = 0, limit: int = 100) -> List[Protocolo]:
+    """
+    Fila de protocolos abertos, do mais urgente para o menos urgente e, na
+    mesma prioridade, do mais antigo para o mais novo.
+    O filtro e a ordenação são os do índice parcial idx_protocolos_abertos,
+    então o custo depende só da quantidade de protocolos abertos.
+    """
+    query = (
+        select(Protocolo)
+        # Status como literais: com parâmetros, um plano genérico (prepared
+        # statement) não consegue provar o predicado do índice parcial
+        .where(Protocolo.status.in_(
+            bindparam("status_abertos", list(schemas.STATUS_PROTOCOLO_ABERTOS), expanding=True, literal_execute=True)
+        ))
+        .order_by(func.prioridade_rank(Protocolo.prioridade), Protocolo.created_at, Protocolo.id)
+    )
+    if consultor_id is not None:
+        query = query.where(Protocolo.consultor_id == consultor_id)
+    return db.execute(query.offset(skip).limit(limit)).scalars().all()
 
 def get_protocolo(db: Session, protocolo_id: int) -> Optional[Protocolo]:
     """
@@ -371,16 +980,24 @@ def get_protocolo(db: Session, protocolo_id: int) -> Optional[Protocolo]:
 
 def atualizar_protocolo(db: Session, protocolo_id: int, protocolo: schemas.ProtocoloUpdate) -> Optional[Protocolo]:
     """
-    Atualiza os dados de um protocolo.
+    Atualiza os dados de um protocolo com um único UPDATE ... RETURNING.
     """
-    db_protocolo = get_protocolo(db, protocolo_id)
-    if not db_protocolo:
-        raise HTTPException(status_code=404, detail="Protocolo não encontrado")
-    
+    tabela = Protocolo.__table__
     update_data = protocolo.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_protocolo, key, value)
-    
+    if not update_data:
+        db_protocolo = get_protocolo(db, protocolo_id)
+        if not db_protocolo:
+            raise HTTPException(status_code=404, detail="Protocolo não encontrado")
+        return db_protocolo
+
+    row = db.execute(
+        update(tabela)
+        .where(tabela.c.id == protocolo_id)
+        .values(**update_data)
+        .returning(*tabela.c)
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Protocolo não encontrado")
+
     db.commit()
-    db.refresh(db_protocolo)
-    return db_protocolo
+    return Protocolo(**row._mapping)
@@ -0,0 +1,295 @@
+"""
+Outbox transacional para a sincronização com o CRM.
+
+A distribuição grava um evento em `outbox_eventos` na mesma transação em que
+seleciona o consultor. Este worker drena a tabela em lotes e entrega os
+eventos ao endpoint HTTP configurado, com limite de concorrência, novas
+tentativas e backoff exponencial. Um evento só é marcado como entregue depois
+de uma resposta 2xx, então uma queda do CRM atrasa a entrega mas não perde
+eventos.
+
+Quando o CRM recusa um lote (4xx que não depende de tempo nem de credencial),
+os eventos são reenviados um a um: os aceitos são confirmados e só os
+recusados saem da fila, marcados com `descartado_em` (dead letter). O mesmo
+acontece com eventos que falham OUTBOX_MAX_TENTATIVAS vezes seguidas.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import List, Optional, Set
+
+import httpx
+from sqlalchemy import text
+
+from database import SessionLocal
+
+logger = logging.getLogger("api")
+
+CRM_WEBHOOK_URL = os.getenv("CRM_WEBHOOK_URL")
+CRM_WEBHOOK_TOKEN = os.getenv("CRM_WEBHOOK_TOKEN")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_MAX_CONCURRENCY = int(os.getenv("OUTBOX_MAX_CONCURRENCY", "4"))
+OUTBOX_POLL_INTERVAL_S = float(os.getenv("OUTBOX_POLL_INTERVAL_S", "1"))
+OUTBOX_LEASE_S = int(os.getenv("OUTBOX_LEASE_S", "60"))
+OUTBOX_BACKOFF_BASE_S = float(os.getenv("OUTBOX_BACKOFF_BASE_S", "2"))
+OUTBOX_BACKOFF_MAX_S = float(os.getenv("OUTBOX_BACKOFF_MAX_S", "300"))
+OUTBOX_HTTP_TIMEOUT_S = float(os.getenv("OUTBOX_HTTP_TIMEOUT_S", "10"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+# 0 mantém o evento na fila até ser entregue
+OUTBOX_MAX_TENTATIVAS = int(os.getenv("OUTBOX_MAX_TENTATIVAS", "50"))
+
+# Respostas 4xx que não indicam um problema do evento: credencial, timeout e
+# limite de taxa do CRM. Nelas o lote segue com backoff.
+_STATUS_TRANSITORIOS = {401, 403, 408, 429}
+
+# Os eventos só são gravados quando há um destino configurado
+OUTBOX_ENABLED = bool(CRM_WEBHOOK_URL)
+
+# Reserva um lote de eventos pendentes. A reserva adia a próxima tentativa
+# por OUTBOX_LEASE_S, então outros workers não pegam o mesmo lote e, se este
+# processo morrer no meio da entrega, o lote volta para a fila sozinho.
+_SQL_RESERVAR = text("""
+    UPDATE outbox_eventos
+    SET proxima_tentativa_em = NOW() + make_interval(secs => :lease)
+    WHERE id IN (
+        SELECT id FROM outbox_eventos
+        WHERE entregue_em IS NULL
+        AND descartado_em IS NULL
+        AND proxima_tentativa_em <= NOW()
+        ORDER BY proxima_tentativa_em, id
+        LIMIT :limite
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, tipo, payload, criado_em, tentativas
+""")
+
+_SQL_CONFIRMAR = text("""
+    UPDATE outbox_eventos
+    SET entregue_em = NOW(),
+        tentativas = tentativas + 1,
+        ultimo_erro = NULL
+    WHERE id = ANY(:ids)
+""")
+
+# O expoente é limitado para que power() não estoure com muitas tentativas;
+# 2^20 já passa de qualquer OUTBOX_BACKOFF_MAX_S razoável
+_SQL_ADIAR = text("""
+    UPDATE outbox_eventos
+    SET tentativas = tentativas + 1,
+        proxima_tentativa_em = NOW() + make_interval(
+            secs => LEAST(:backoff_max, :backoff_base * power(2, LEAST(tentativas, 20)))
+        ),
+        ultimo_erro = :erro,
+        descartado_em = CASE
+            WHEN :recusado OR (:max_tentativas > 0 AND tentativas + 1 >= :max_tentativas) THEN NOW()
+        END
+    WHERE id = ANY(:ids)
+    RETURNING id, descartado_em IS NOT NULL AS descartado
+""")
+
+_SQL_LIMPAR_ENTREGUES = text("""
+    DELETE FROM outbox_eventos
+    WHERE id IN (
+        SELECT id FROM outbox_eventos
+        WHERE entregue_em < NOW() - make_interval(days => :dias)
+        LIMIT 1000
+    )
+""")
+
+
+def chave_idempotencia(ids: List[int]) -> str:
+    """
+    Chave do lote: depende só do conjunto de eventos, não da ordem. Uma nova
+    tentativa que reagrupe os eventos (outro lote, reenvio um a um) gera outra
+    chave; a deduplicação por evento é a idempotency_key de cada um.
+    """
+    conteudo = ",".join(str(i) for i in sorted(ids))
+    return f"outbox-{hashlib.sha256(conteudo.encode()).hexdigest()[:32]}"
+
+
+def recusado(erro: Exception) -> bool:
+    """
+    Indica se o CRM recusou o conteúdo enviado (4xx que não se resolve
+    tentando de novo).
+    """
+    if not isinstance(erro, httpx.HTTPStatusError):
+        return False
+    status = erro.response.status_code
+    return 400 <= status < 500 and status not in _STATUS_TRANSITORIOS
+
+
+def _executar(sql, params: dict):
+    """
+    Executa um comando em uma sessão própria e confirma.
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(sql, params)
+        rows = result.all() if result.returns_rows else None
+        db.commit()
+        return rows
+    finally:
+        db.close()
+
+
+class OutboxWorker:
+    """
+    Drena a outbox em segundo plano no event loop da aplicação.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._semaforo = asyncio.Semaphore(OUTBOX_MAX_CONCURRENCY)
+        self._entregas: Set[asyncio.Task] = set()
+        self._tarefa: Optional[asyncio.Task] = None
+        self._parar = asyncio.Event()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def iniciar(self) -> None:
+        headers = {"Authorization": f"Bearer {CRM_WEBHOOK_TOKEN}"} if CRM_WEBHOOK_TOKEN else None
+        self._client = httpx.AsyncClient(
+            timeout=OUTBOX_HTTP_TIMEOUT_S,
+            headers=headers,
+            limits=httpx.Limits(max_connections=OUTBOX_MAX_CONCURRENCY)
+        )
+        self._tarefa = asyncio.create_task(self._executar())
+
+    async def parar(self, timeout: float = 10) -> None:
+        """
+        Para de reservar lotes e aguarda as entregas em andamento.
+        Lotes não concluídos voltam para a fila quando a reserva expira.
+        """
+        self._parar.set()
+        if self._tarefa:
+            await self._tarefa
+        if self._entregas:
+            await asyncio.wait(self._entregas, timeout=timeout)
+        if self._client:
+            await self._client.aclose()
+
+    async def _executar(self) -> None:
+        ciclos = 0
+        while not self._parar.is_set():
+            # Uma vaga de entrega precisa estar livre antes de reservar o lote
+            await self._semaforo.acquire()
+            if self._parar.is_set():
+                self._semaforo.release()
+                break
+
+            try:
+                lote = await asyncio.to_thread(
+                    _executar, _SQL_RESERVAR, {"lease": OUTBOX_LEASE_S, "limite": OUTBOX_BATCH_SIZE}
+                )
+            except Exception as e:
+                logger.error(f"OUTBOX | erro ao reservar eventos: {str(e)}")
+                lote = None
+
+            if lote:
+                tarefa = asyncio.create_task(self._entregar(sorted(lote, key=lambda e: e.id)))
+                self._entregas.add(tarefa)
+                tarefa.add_done_callback(self._entregas.discard)
+            else:
+                self._semaforo.release()
+
+            ciclos += 1
+            if ciclos % 3600 == 0:
+                try:
+                    await asyncio.to_thread(_executar, _SQL_LIMPAR_ENTREGUES, {"dias": OUTBOX_RETENTION_DAYS})
+                except Exception as e:
+                    logger.error(f"OUTBOX | erro ao limpar eventos entregues: {str(e)}")
+
+            # Lote cheio indica fila acumulada: busca o próximo sem esperar
+            if not lote or len(lote) < OUTBOX_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._parar.wait(), timeout=OUTBOX_POLL_INTERVAL_S)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _entregar(self, lote: List) -> None:
+        try:
+            erro = await self._enviar(lote)
+            if erro is None:
+                return
+            if len(lote) > 1 and recusado(erro):
+                # Um evento recusado não deve segurar os outros do lote
+                for evento in lote:
+                    erro_evento = await self._enviar([evento])
+                    if erro_evento is not None:
+                        await self._adiar([evento], erro_evento)
+            else:
+                await self._adiar(lote, erro)
+        finally:
+            self._semaforo.release()
+
+    async def _enviar(self, lote: List) -> Optional[Exception]:
+        """
+        Envia os eventos e confirma a entrega. Retorna o erro em caso de falha.
+        """
+        ids = [evento.id for evento in lote]
+        try:
+            corpo = {
+                "eventos": [
+                    {
+                        "id": evento.id,
+                        # Deduplicação por evento no CRM: estável entre tentativas e lotes
+                        "idempotency_key": f"outbox-{evento.id}",
+                        "tipo": evento.tipo,
+                        "criado_em": evento.criado_em.isoformat(),
+                        "dados": evento.payload
+                    }
+                    for evento in lote
+                ]
+            }
+            response = await self._client.post(
+                self.url,
+                json=corpo,
+                headers={"Idempotency-Key": chave_idempotencia(ids)}
+            )
+            response.raise_for_status()
+            await asyncio.to_thread(_executar, _SQL_CONFIRMAR, {"ids": ids})
+            return None
+        except Exception as e:
+            logger.error(f"OUTBOX | falha ao entregar {len(ids)} eventos: {str(e)}")
+            return e
+
+    async def _adiar(self, lote: List, erro: Exception) -> None:
+        """
+        Agenda a próxima tentativa com backoff ou, para um evento recusado ou
+        sem tentativas restantes, tira-o da fila.
+        """
+        try:
+            linhas = await asyncio.to_thread(_executar, _SQL_ADIAR, {
+                "ids": [evento.id for evento in lote],
+                "erro": str(erro)[:500],
+                "backoff_base": OUTBOX_BACKOFF_BASE_S,
+                "backoff_max": OUTBOX_BACKOFF_MAX_S,
+                # Só um evento isolado é recusado por conta própria
+                "recusado": len(lote) == 1 and recusado(erro),
+                "max_tentativas": OUTBOX_MAX_TENTATIVAS
+            })
+        except Exception as erro_banco:
+            # Sem o adiamento, o lote volta para a fila quando a reserva expirar
+            logger.error(f"OUTBOX | erro ao adiar eventos: {str(erro_banco)}")
+            return
+        descartados = [linha.id for linha in linhas if linha.descartado]
+        if descartados:
+            logger.error(f"OUTBOX | eventos descartados (dead letter): {descartados}")
+
+
+worker: Optional[OutboxWorker] = None
+
+
+def iniciar() -> None:
+    """
+    Inicia o worker da outbox, se houver um destino configurado.
+    """
+    global worker
+    if OUTBOX_ENABLED:
+        worker = OutboxWorker(CRM_WEBHOOK_URL)
+        worker.iniciar()
+
+
+async def parar() -> None:
+    if worker:
+        await worker.parar()
@@ -0,0 +1,97 @@
+"""
+Purge de consultores removidos.
+
+A remoção de um consultor é um soft delete (`deleted_at`): ele sai da
+distribuição e das listagens sem apagar o histórico na requisição. Depois
+de PURGE_CARENCIA_HORAS, este worker move os protocolos do consultor para
+protocolos_arquivo (ou só os apaga, com PURGE_ARQUIVAR=false) em lotes de
+PURGE_LOTE linhas, cada um em sua própria transação e com PURGE_PAUSA_S
+segundos entre lotes, e por fim apaga a linha do consultor. Assim nenhuma
+transação segura locks por muito tempo nem concorre com a distribuição.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import models
+from database import SessionLocal
+
+logger = logging.getLogger("api")
+
+PURGE_ENABLED = os.getenv("PURGE_ENABLED", "true").lower() in ("1", "true", "yes")
+PURGE_ARQUIVAR = os.getenv("PURGE_ARQUIVAR", "true").lower() in ("1", "true", "yes")
+PURGE_CARENCIA_HORAS = float(os.getenv("PURGE_CARENCIA_HORAS", "24"))
+PURGE_LOTE = int(os.getenv("PURGE_LOTE", "500"))
+PURGE_PAUSA_S = float(os.getenv("PURGE_PAUSA_S", "0.2"))
+PURGE_INTERVALO_S = float(os.getenv("PURGE_INTERVALO_S", "60"))
+
+
+def purgar_lote() -> int:
+    db = SessionLocal()
+    try:
+        return models.purgar_lote_protocolos(db, PURGE_LOTE, PURGE_CARENCIA_HORAS, PURGE_ARQUIVAR)
+    finally:
+        db.close()
+
+
+def purgar_consultores() -> int:
+    db = SessionLocal()
+    try:
+        return models.purgar_consultores(db, PURGE_LOTE, PURGE_CARENCIA_HORAS)
+    finally:
+        db.close()
+
+
+async def _aguardar(parar: asyncio.Event, segundos: float) -> bool:
+    """
+    Espera `segundos` ou até o encerramento; retorna True se deve parar.
+    """
+    try:
+        await asyncio.wait_for(parar.wait(), timeout=segundos)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def _executar(parar: asyncio.Event) -> None:
+    while not parar.is_set():
+        try:
+            total = 0
+            while not parar.is_set():
+                purgados = await asyncio.to_thread(purgar_lote)
+                if not purgados:
+                    break
+                total += purgados
+                if await _aguardar(parar, PURGE_PAUSA_S):
+                    break
+            if total:
+                logger.info(f"PURGE | {total} protocolos {'arquivados' if PURGE_ARQUIVAR else 'apagados'}")
+
+            if not parar.is_set():
+                removidos = await asyncio.to_thread(purgar_consultores)
+                if removidos:
+                    logger.info(f"PURGE | {removidos} consultores apagados")
+        except Exception as e:
+            logger.error(f"PURGE | erro ao purgar consultores removidos: {str(e)}")
+        await _aguardar(parar, PURGE_INTERVALO_S)
+
+
+_parar: Optional[asyncio.Event] = None
+_tarefa: Optional[asyncio.Task] = None
+
+
+def iniciar() -> None:
+    """
+    Inicia o purge, se habilitado.
+    """
+    global _parar, _tarefa
+    if PURGE_ENABLED:
+        _parar = asyncio.Event()
+        _tarefa = asyncio.create_task(_executar(_parar))
+
+
+async def parar() -> None:
+    if _tarefa:
+        _parar.set()
+        await _tarefa
@@ -0,0 +1,241 @@
+"""
+Limite de requisições por cliente (token bucket).
+
+A API key é única e compartilhada por todos os integradores, então ela não
+identifica quem está chamando: cada endereço de cliente tem um balde por
+classe de rota (distribuição, escrita e leitura), e um integrador que
+inunda a API não consome a cota dos demais. Atrás de proxy, o endereço vem
+do X-Forwarded-For, considerado só a partir de proxies listados em
+RATE_LIMIT_TRUSTED_PROXIES. Requisições sem chave ou com chave inválida usam
+um balde separado do mesmo endereço. O middleware roda antes do roteamento,
+então uma requisição rejeitada não abre sessão nem ocupa conexão do pool; a
+resposta é 429 com Retry-After.
+
+O backend padrão guarda os baldes na memória do worker e divide a taxa
+configurada por WEB_CONCURRENCY, para que o total da instância fique perto
+do limite. Com RATE_LIMIT_REDIS_URL os baldes ficam no Redis e são
+compartilhados entre workers e réplicas, ao custo de uma ida ao Redis por
+requisição.
+"""
+import hashlib
+import hmac
+import ipaddress
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger("api")
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+# Endereços ou redes (CIDR) dos proxies cujo X-Forwarded-For é confiável
+RATE_LIMIT_TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False)
+    for p in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "").split(",") if p.strip()
+]
+
+# (requisições por segundo, rajada) por classe de rota
+LIMITES: Dict[str, Tuple[float, float]] = {
+    "dispatch": (
+        float(os.getenv("RATE_LIMIT_DISPATCH_RPS", "20")),
+        float(os.getenv("RATE_LIMIT_DISPATCH_BURST", "40")),
+    ),
+    "escrita": (
+        float(os.getenv("RATE_LIMIT_ESCRITA_RPS", "10")),
+        float(os.getenv("RATE_LIMIT_ESCRITA_BURST", "20")),
+    ),
+    "leitura": (
+        float(os.getenv("RATE_LIMIT_LEITURA_RPS", "50")),
+        float(os.getenv("RATE_LIMIT_LEITURA_BURST", "100")),
+    ),
+}
+
+ROTA_DISPATCH = "/consultor/da-vez"
+
+
+def _confiavel(endereco: str, proxies) -> bool:
+    try:
+        ip = ipaddress.ip_address(endereco)
+    except ValueError:
+        return False
+    return any(ip in rede for rede in proxies)
+
+
+def endereco_cliente(scope, proxies=RATE_LIMIT_TRUSTED_PROXIES) -> str:
+    """
+    Endereço do cliente: o da conexão ou, se ela vem de um proxy confiável, o
+    primeiro endereço não confiável do X-Forwarded-For, lido da direita para
+    a esquerda (as entradas à esquerda podem ter sido forjadas pelo cliente).
+    """
+    cliente = scope.get("client")
+    endereco = cliente[0] if cliente else ""
+    if not _confiavel(endereco, proxies):
+        return endereco
+    encaminhados = []
+    for nome, valor in scope["headers"]:
+        if nome == b"x-forwarded-for":
+            encaminhados.extend(valor.decode("latin-1").split(","))
+    for item in reversed(encaminhados):
+        item = item.strip()
+        if not item:
+            continue
+        endereco = item
+        if not _confiavel(item, proxies):
+            break
+    return endereco
+
+
+def classificar(method: str, path: str) -> str:
+    if path == ROTA_DISPATCH:
+        return "dispatch"
+    if method in ("GET", "HEAD"):
+        return "leitura"
+    return "escrita"
+
+
+class MemoryBackend:
+    """
+    Baldes na memória do worker. Sem locks: o middleware roda no event loop
+    e não há await entre a leitura e a gravação do balde.
+
+    O mapa é mantido em ordem de uso; ao atingir max_chaves, o balde usado há
+    mais tempo é descartado.
+    """
+
+    def __init__(self, divisor: int = 1, max_chaves: int = RATE_LIMIT_MAX_KEYS):
+        self.divisor = max(1, divisor)
+        self.max_chaves = max_chaves
+        self._baldes: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+
+    async def consumir(self, chave: str, classe: str, taxa: float, rajada: float) -> float:
+        """
+        Consome um token e retorna 0, ou retorna os segundos até haver um token.
+        """
+        taxa = taxa / self.divisor
+        rajada = max(1.0, rajada / self.divisor)
+        agora = time.monotonic()
+
+        balde = self._baldes.get((chave, classe))
+        if balde is None:
+            while len(self._baldes) >= self.max_chaves:
+                self._baldes.popitem(last=False)
+            balde = self._baldes[(chave, classe)] = [rajada, agora]
+        else:
+            self._baldes.move_to_end((chave, classe))
+
+        tokens = min(rajada, balde[0] + (agora - balde[1]) * taxa)
+        balde[1] = agora
+        if tokens >= 1:
+            balde[0] = tokens - 1
+            return 0.0
+        balde[0] = tokens
+        return (1 - tokens) / taxa
+
+
+# Token bucket atômico no Redis, com o relógio do próprio Redis
+_SCRIPT_REDIS = """
+local tempo = redis.call('TIME')
+local agora = tonumber(tempo[1]) + tonumber(tempo[2]) / 1000000
+local taxa = tonumber(ARGV[1])
+local rajada = tonumber(ARGV[2])
+local dados = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(dados[1]) or rajada
+local ultimo = tonumber(dados[2]) or agora
+tokens = math.min(rajada, tokens + (agora - ultimo) * taxa)
+local espera = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    espera = (1 - tokens) / taxa
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', agora)
+redis.call('PEXPIRE', KEYS[1], math.ceil(rajada / taxa * 1000) + 1000)
+return tostring(espera)
+"""
+
+
+class RedisBackend:
+    """
+    Baldes compartilhados no Redis. Se o Redis falhar, a requisição é admitida.
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL configurada, mas o pacote redis não está instalado")
+
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(_SCRIPT_REDIS)
+
+    async def consumir(self, chave: str, classe: str, taxa: float, rajada: float) -> float:
+        # O identificador do cliente não é gravado em claro no Redis
+        digest = hashlib.sha256(chave.encode()).hexdigest()[:16]
+        try:
+            espera = await self._script(keys=[f"rate_limit:{digest}:{classe}"], args=[taxa, rajada])
+        except Exception as e:
+            logger.error(f"RATE_LIMIT | erro no Redis, requisição admitida: {str(e)}")
+            return 0.0
+        return float(espera)
+
+
+def criar_backend():
+    if RATE_LIMIT_REDIS_URL:
+        return RedisBackend(RATE_LIMIT_REDIS_URL)
+    return MemoryBackend(divisor=int(os.getenv("WEB_CONCURRENCY", "1")))
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI que aplica os limites antes do roteamento.
+    """
+
+    def __init__(self, app, api_key: Optional[str] = None, backend=None, proxies=None):
+        self.app = app
+        self.api_key = api_key
+        self.backend = backend or criar_backend()
+        self.proxies = RATE_LIMIT_TRUSTED_PROXIES if proxies is None else proxies
+
+    def _identificar(self, scope) -> str:
+        """
+        Chave do balde: o endereço do cliente, separando as requisições com a
+        API key válida das demais.
+        """
+        endereco = endereco_cliente(scope, self.proxies)
+        for nome, valor in scope["headers"]:
+            if nome == b"api-key":
+                if self.api_key and hmac.compare_digest(valor, self.api_key.encode("latin-1")):
+                    return f"cliente:{endereco}"
+                break
+        return f"anonimo:{endereco}"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        chave = self._identificar(scope)
+        classe = classificar(scope["method"], scope["path"])
+        taxa, rajada = LIMITES[classe]
+        if taxa <= 0:
+            # Taxa 0 desativa o limite da classe
+            await self.app(scope, receive, send)
+            return
+
+        espera = await self.backend.consumir(chave, classe, taxa, rajada)
+        if espera > 0:
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Limite de requisições excedido, tente novamente em instantes"},
+                headers={"Retry-After": str(max(1, math.ceil(espera)))}
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,154 @@
+"""
+Proteções contra banco de dados lento.
+
+- AdmissionLimiter: limita as transações de distribuição simultâneas e
+  rejeita o excesso com 503 em vez de enfileirar.
+- CircuitBreaker: para de enviar queries a um banco que continua
+  estourando os timeouts, até um período de espera passar.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+DISPATCH_MAX_CONCURRENT = int(os.getenv("DISPATCH_MAX_CONCURRENT", "8"))
+DISPATCH_RETRY_AFTER_S = int(os.getenv("DISPATCH_RETRY_AFTER_S", "1"))
+DB_BREAKER_FAILURE_THRESHOLD = int(os.getenv("DB_BREAKER_FAILURE_THRESHOLD", "5"))
+DB_BREAKER_WINDOW_S = int(os.getenv("DB_BREAKER_WINDOW_S", "10"))
+DB_BREAKER_RESET_S = int(os.getenv("DB_BREAKER_RESET_S", "30"))
+
+# query_canceled (statement_timeout) e lock_not_available (lock_timeout)
+PGCODES_TIMEOUT = {"57014", "55P03"}
+
+
+def servico_indisponivel(detail: str, retry_after: int) -> HTTPException:
+    """
+    Monta a resposta 503 com o header Retry-After.
+    """
+    return HTTPException(
+        status_code=503,
+        detail=detail,
+        headers={"Retry-After": str(max(1, retry_after))}
+    )
+
+
+def eh_timeout(exc: BaseException) -> bool:
+    """
+    Indica se a exceção (do SQLAlchemy ou do driver) é um timeout do PostgreSQL.
+    """
+    original = getattr(exc, "orig", exc)
+    pgcode = getattr(original, "pgcode", None) or getattr(original, "sqlstate", None)
+    return pgcode in PGCODES_TIMEOUT
+
+
+def eh_falha_do_banco(exc: BaseException) -> bool:
+    """
+    Indica se a exceção é um timeout ou uma queda de conexão com o banco.
+    """
+    return eh_timeout(exc) or bool(getattr(exc, "connection_invalidated", False))
+
+
+class AdmissionLimiter:
+    """
+    Semáforo não bloqueante: admite até `limite` execuções simultâneas.
+    """
+
+    def __init__(self, limite: int, retry_after: int):
+        self.retry_after = retry_after
+        self._semaforo = threading.BoundedSemaphore(limite)
+
+    @contextmanager
+    def admitir(self):
+        if not self._semaforo.acquire(blocking=False):
+            raise servico_indisponivel(
+                "Sistema sobrecarregado, tente novamente em instantes",
+                self.retry_after
+            )
+        try:
+            yield
+        finally:
+            self._semaforo.release()
+
+
+class CircuitBreaker:
+    """
+    Disjuntor de três estados (fechado, aberto, meio-aberto).
+
+    Abre após `limite_falhas` timeouts dentro de `janela` segundos. Depois de
+    `tempo_reset` segundos passa a meio-aberto e admite uma única requisição
+    de teste; as demais recebem 503 até ela fechar (sucesso) ou reabrir
+    (nova falha) o disjuntor. Uma sonda sem resultado em `tempo_reset`
+    segundos (erro antes de chegar ao banco, por exemplo) libera outra.
+
+    Só o comando da distribuição alimenta o disjuntor (get_consultor_da_vez),
+    que é a única rota protegida por ele: o preâmbulo de timeouts da sessão,
+    as outras rotas e os workers em segundo plano não fecham nem abrem o
+    disjuntor.
+    """
+
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio-aberto"
+
+    def __init__(self, limite_falhas: int, janela: int, tempo_reset: int):
+        self.limite_falhas = limite_falhas
+        self.janela = janela
+        self.tempo_reset = tempo_reset
+        self.estado = self.FECHADO
+        self._falhas = deque()
+        self._aberto_ate = 0.0
+        self._sonda_desde = 0.0
+        self._lock = threading.Lock()
+
+    def verificar(self) -> None:
+        """
+        Levanta 503 enquanto o disjuntor estiver aberto ou, no meio-aberto,
+        enquanto a requisição de teste estiver em andamento.
+        """
+        if self.estado == self.FECHADO:
+            return
+        agora = time.monotonic()
+        with self._lock:
+            if self.estado == self.ABERTO:
+                restante = self._aberto_ate - agora
+                if restante > 0:
+                    raise servico_indisponivel(
+                        "Banco de dados indisponível, tente novamente mais tarde",
+                        int(restante) + 1
+                    )
+                self.estado = self.MEIO_ABERTO
+            elif self.estado == self.MEIO_ABERTO:
+                if agora - self._sonda_desde < self.tempo_reset:
+                    raise servico_indisponivel(
+                        "Banco de dados em recuperação, tente novamente em instantes",
+                        DISPATCH_RETRY_AFTER_S
+                    )
+            else:
+                return
+            # Esta requisição é a sonda
+            self._sonda_desde = agora
+
+    def registrar_sucesso(self) -> None:
+        if self.estado != self.MEIO_ABERTO:
+            return
+        with self._lock:
+            self._falhas.clear()
+            self.estado = self.FECHADO
+
+    def registrar_falha(self) -> None:
+        agora = time.monotonic()
+        with self._lock:
+            self._falhas.append(agora)
+            while self._falhas and self._falhas[0] < agora - self.janela:
+                self._falhas.popleft()
+            if self.estado == self.MEIO_ABERTO or len(self._falhas) >= self.limite_falhas:
+                self.estado = self.ABERTO
+                self._aberto_ate = agora + self.tempo_reset
+                self._falhas.clear()
+
+
+dispatch_limiter = AdmissionLimiter(DISPATCH_MAX_CONCURRENT, DISPATCH_RETRY_AFTER_S)
+db_breaker = CircuitBreaker(DB_BREAKER_FAILURE_THRESHOLD, DB_BREAKER_WINDOW_S, DB_BREAKER_RESET_S)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import datetime
+from pydantic import BaseModel, Field, validator
+from typing import Any, Dict, List, Optional
+from datetime import datetime, time
 
 def validate_phone(v: Optional[str]) -> Optional[str]:
     if v is None:
@@ -14,6 +14,13 @@ def validate_phone(v: Optional[str]) -> Optional[str]:
         raise ValueError('Telefone deve ter entre 10 e 15 números após o código do país')
     return v
 
+def formatar_numero_protocolo(sequencial: int) -> str:
+    """
+    Formata o número do protocolo para exibição (#00001). Números acima de
+    99999 ganham dígitos em vez de serem truncados.
+    """
+    return f"#{sequencial:05d}"
+
 def validate_idioma(v: str) -> str:
     if len(v) < 2 or len(v) > 5:
         raise ValueError('Idioma deve ter entre 2 e 5 caracteres')
@@ -73,10 +80,56 @@ class ConsultorUpdate(BaseModel):
 class ConsultorResponse(ConsultorBase):
     id: int
     ultimo_atendimento: Optional[datetime] = None
+    status_override_ate: Optional[datetime] = None
 
     class Config:
         orm_mode = True
 
+class TurnoBase(BaseModel):
+    dia_semana: int = Field(..., ge=1, le=7, description="1 = segunda ... 7 = domingo")
+    inicio: time
+    fim: time
+
+    @validator("fim")
+    def fim_diferente_do_inicio(cls, v, values):
+        if "inicio" in values and v == values["inicio"]:
+            raise ValueError("Fim do turno deve ser diferente do início")
+        return v
+
+class TurnoResponse(TurnoBase):
+    id: int
+
+    class Config:
+        orm_mode = True
+
+class TurnosUpdate(BaseModel):
+    turnos: List[TurnoBase] = Field(..., max_items=100)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "turnos": [
+                    {"dia_semana": 1, "inicio": "08:00", "fim": "12:00"},
+                    {"dia_semana": 1, "inicio": "13:00", "fim": "17:00"},
+                    {"dia_semana": 5, "inicio": "22:00", "fim": "06:00"}
+                ]
+            }
+        }
+
+class PipedriveResolveRequest(BaseModel):
+    ids: List[int] = Field(..., min_items=1, max_items=1000)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "ids": [12345, 67890]
+            }
+        }
+
+class PipedriveResolveResponse(BaseModel):
+    consultores: Dict[int, ConsultorResponse]
+    nao_encontrados: List[int]
+
 class ConsultorDaVezResponse(BaseModel):
     consultor_id: int
     consultor_nome: str
@@ -88,6 +141,23 @@ class ConsultorDaVezResponse(BaseModel):
     consultor_id_pipedrive: Optional[int] = None
     numero_protocolo: str
 
+class ConsultorProximoResponse(BaseModel):
+    id: int
+    nome: str
+    ultimo_atendimento: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+class IdiomaDisponibilidadeResponse(BaseModel):
+    idioma: str
+    elegiveis: int
+    proximo: Optional[ConsultorProximoResponse] = None
+
+class DisponibilidadeResponse(BaseModel):
+    atualizado_em: Optional[datetime] = None
+    idiomas: List[IdiomaDisponibilidadeResponse]
+
 class ApiKeyBase(BaseModel):
     key: str
     description: str
@@ -103,33 +173,67 @@ class ApiKeyResponse(ApiKeyBase):
     class Config:
         orm_mode = True
 
+# Da mais para a menos urgente; a ordem é a mesma da função prioridade_rank() no banco
+PRIORIDADES_PROTOCOLO = ("urgente", "alta", "normal", "baixa")
+STATUS_PROTOCOLO = ("aberto", "em_andamento", "fechado", "cancelado")
+# Status que entram na fila de trabalho (índice parcial idx_protocolos_abertos)
+STATUS_PROTOCOLO_ABERTOS = ("aberto", "em_andamento")
+
+def validar_prioridade(v: Optional[str]) -> str:
+    if v not in PRIORIDADES_PROTOCOLO:
+        raise ValueError(f"Prioridade deve ser uma de: {', '.join(PRIORIDADES_PROTOCOLO)}")
+    return v
+
+def validar_status_protocolo(v: Optional[str]) -> str:
+    if v not in STATUS_PROTOCOLO:
+        raise ValueError(f"Status deve ser um de: {', '.join(STATUS_PROTOCOLO)}")
+    return v
+
 class ProtocoloBase(BaseModel):
     consultor_id: int
-    descricao: Optional[str] = None
+    descricao: Optional[str] = Field(None, max_length=2000)
     prioridade: str = "normal"
 
+    _validar_prioridade = validator("prioridade", allow_reuse=True)(validar_prioridade)
+
 class ProtocoloCreate(ProtocoloBase):
     pass
 
 class ProtocoloUpdate(BaseModel):
-    descricao: Optional[str] = None
+    descricao: Optional[str] = Field(None, max_length=2000)
     prioridade: Optional[str] = None
     status: Optional[str] = None
 
+    # pre=True: um null explícito também é rejeitado
+    _validar_prioridade = validator("prioridade", pre=True, allow_reuse=True)(validar_prioridade)
+    _validar_status = validator("status", pre=True, allow_reuse=True)(validar_status_protocolo)
+
 class ProtocoloResponse(BaseModel):
     id: int
     numero: str
-    consultor_id: int
+    sequencial: int
+    consultor_id: Optional[int] = None  # None nos protocolos avulsos (GET /gerar-protocolo)
     created_at: datetime
+    descricao: Optional[str] = None
+    prioridade: str
+    status: str
 
     class Config:
         orm_mode = True
 
 class ProtocoloComConsultorResponse(ProtocoloResponse):
-    consultor: ConsultorResponse
+    consultor: Optional[ConsultorResponse] = None
 
     class Config:
         orm_mode = True
 
 class NovoProtocoloResponse(BaseModel):
     numero_protocolo: str
+
+class SlowQueryResponse(BaseModel):
+    timestamp: datetime
+    duracao_ms: float
+    statement: str
+    parametros: Optional[Any] = None
+    erro: Optional[str] = None
+    explain: Optional[Any] = None
@@ -0,0 +1,77 @@
+"""
+Escalonador das transições de turno.
+
+Em intervalos de TURNOS_INTERVALO_S segundos aplica, em um único UPDATE,
+todas as entradas e saídas de turno ocorridas desde a execução anterior e
+os overrides de status vencidos (models.aplicar_transicoes_turnos). Com
+vários workers, só um processa cada intervalo; os demais encontram o
+controle bloqueado e não fazem nada.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import models
+from database import SessionLocal
+
+logger = logging.getLogger("api")
+
+TURNOS_ENABLED = os.getenv("TURNOS_ENABLED", "true").lower() in ("1", "true", "yes")
+TURNOS_TIMEZONE = os.getenv("TURNOS_TIMEZONE", "America/Sao_Paulo")
+TURNOS_INTERVALO_S = float(os.getenv("TURNOS_INTERVALO_S", "15"))
+
+
+def aplicar() -> int:
+    db = SessionLocal()
+    try:
+        return models.aplicar_transicoes_turnos(db, TURNOS_TIMEZONE)
+    finally:
+        db.close()
+
+
+def inicializar() -> None:
+    db = SessionLocal()
+    try:
+        models.inicializar_controle_turnos(db)
+    finally:
+        db.close()
+
+
+async def _executar(parar: asyncio.Event) -> None:
+    try:
+        await asyncio.to_thread(inicializar)
+    except Exception as e:
+        logger.error(f"TURNOS | erro ao inicializar controle: {str(e)}")
+
+    while not parar.is_set():
+        try:
+            alterados = await asyncio.to_thread(aplicar)
+            if alterados:
+                logger.info(f"TURNOS | status de {alterados} consultores atualizado")
+        except Exception as e:
+            logger.error(f"TURNOS | erro ao aplicar transições: {str(e)}")
+        try:
+            await asyncio.wait_for(parar.wait(), timeout=TURNOS_INTERVALO_S)
+        except asyncio.TimeoutError:
+            pass
+
+
+_parar: Optional[asyncio.Event] = None
+_tarefa: Optional[asyncio.Task] = None
+
+
+def iniciar() -> None:
+    """
+    Inicia o escalonador, se habilitado.
+    """
+    global _parar, _tarefa
+    if TURNOS_ENABLED:
+        _parar = asyncio.Event()
+        _tarefa = asyncio.create_task(_executar(_parar))
+
+
+async def parar() -> None:
+    if _tarefa:
+        _parar.set()
+        await _tarefa
@@ -0,0 +1,288 @@
+"""
+Registro de queries lentas.
+
+Guarda em um buffer circular as queries que passam do limite configurado,
+inclusive as interrompidas por erro (statement_timeout, por exemplo), e,
+para uma amostra delas, o plano de execução. Só SELECTs sem trava de linhas
+recebem EXPLAIN (ANALYZE, BUFFERS), em uma transação READ ONLY; os demais
+comandos (escritas, CTEs com WITH, SELECT ... FOR UPDATE) recebem apenas o
+plano estimado, sem serem executados.
+
+O plano real da distribuição, que não pode ser reexecutada, vem do
+auto_explain: com SLOW_QUERY_AUTO_EXPLAIN, as transações de distribuição o
+ativam com SET LOCAL e o plano de cada comando lento chega como NOTICE na
+própria conexão, sendo guardado no registro no lugar do EXPLAIN amostrado.
+"""
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.1"))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("SLOW_QUERY_BUFFER_SIZE", "100"))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "5000"))
+# Requer o módulo auto_explain carregado no servidor (session_preload_libraries)
+SLOW_QUERY_AUTO_EXPLAIN = os.getenv("SLOW_QUERY_AUTO_EXPLAIN", "false").lower() in ("1", "true", "yes")
+
+# Chave em connection.info com os avisos recebidos pelo psycopg 3
+_AVISOS = "slow_query_avisos"
+
+# Apenas comandos que o EXPLAIN aceita
+_COMANDOS_EXPLICAVEIS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+# Um WITH pode conter INSERT/UPDATE/DELETE (como a distribuição), então só o
+# SELECT simples é reexecutado pelo ANALYZE
+_SELECT = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+_TRAVA_LINHAS = re.compile(r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b", re.IGNORECASE)
+
+
+def configuracoes_auto_explain() -> List[str]:
+    """
+    Retorna as chamadas set_config que ativam o auto_explain na transação
+    atual, enviando o plano real dos comandos lentos como NOTICE ao cliente.
+    Sem o módulo carregado no servidor as configurações não têm efeito.
+    """
+    if not SLOW_QUERY_AUTO_EXPLAIN:
+        return []
+    configuracoes = {
+        "log_min_duration": str(int(SLOW_QUERY_THRESHOLD_MS)),
+        "log_analyze": "on",
+        "log_buffers": "on",
+        "log_format": "json",
+        "log_level": "notice"
+    }
+    return [f"set_config('auto_explain.{nome}', '{valor}', true)" for nome, valor in configuracoes.items()]
+
+
+def pode_analisar(statement: str) -> bool:
+    """
+    Indica se o comando pode ser reexecutado pelo EXPLAIN ANALYZE: um SELECT
+    que não trava linhas.
+    """
+    return bool(_SELECT.match(statement)) and not _TRAVA_LINHAS.search(statement)
+
+
+class SlowQueryRecorder:
+    """
+    Buffer circular de queries lentas com EXPLAIN amostrado.
+
+    O EXPLAIN roda em uma thread separada, depois que a transação original
+    terminou, em uma transação desfeita com ROLLBACK e em uma conexão própria,
+    fora do pool das requisições. O ANALYZE, que executa o comando de novo,
+    fica restrito a leituras (ver pode_analisar).
+    """
+
+    def __init__(self, limite_ms: float, taxa_explain: float, tamanho: int):
+        self.limite_ms = limite_ms
+        self.taxa_explain = taxa_explain
+        self._registros = deque(maxlen=tamanho)
+        self._lock = threading.Lock()
+        self._pendentes: "queue.Queue" = queue.Queue(maxsize=tamanho)
+        self._engine: Optional[Engine] = None
+        self._thread: Optional[threading.Thread] = None
+        self._conexao = None
+
+    def instalar(self, engine: Engine) -> None:
+        """
+        Registra os eventos de tempo e de erro no engine.
+        """
+        self._engine = engine
+        for nome, funcao in self._eventos():
+            event.listen(engine, nome, funcao)
+
+    def remover(self) -> None:
+        """
+        Remove os eventos registrados por instalar.
+        """
+        if self._engine is None:
+            return
+        for nome, funcao in self._eventos():
+            if event.contains(self._engine, nome, funcao):
+                event.remove(self._engine, nome, funcao)
+        self._engine = None
+
+    def _eventos(self) -> list:
+        return [
+            ("connect", self._ao_conectar),
+            ("before_cursor_execute", self._antes_de_executar),
+            ("after_cursor_execute", self._depois_de_executar),
+            ("handle_error", self._ao_falhar)
+        ]
+
+    def _ao_conectar(self, dbapi_connection, connection_record):
+        # O psycopg2 guarda os avisos em connection.notices; o psycopg 3 os
+        # entrega a um handler
+        if hasattr(dbapi_connection, "add_notice_handler"):
+            avisos = connection_record.info[_AVISOS] = deque(maxlen=50)
+            dbapi_connection.add_notice_handler(lambda diagnostico: avisos.append(diagnostico.message_primary))
+
+    def _antes_de_executar(self, conn, cursor, statement, parameters, context, executemany):
+        context._inicio_slow_query = time.perf_counter()
+
+    def _depois_de_executar(self, conn, cursor, statement, parameters, context, executemany):
+        duracao_ms = (time.perf_counter() - context._inicio_slow_query) * 1000
+        plano = _retirar_plano_auto_explain(conn) if SLOW_QUERY_AUTO_EXPLAIN else None
+        if duracao_ms >= self.limite_ms:
+            self._registrar(statement, parameters, executemany, duracao_ms, plano=plano)
+
+    def _ao_falhar(self, contexto):
+        inicio = getattr(contexto.execution_context, "_inicio_slow_query", None)
+        if inicio is None:
+            # Erro antes da execução (conexão, compilação)
+            return
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        if duracao_ms >= self.limite_ms:
+            self._registrar(
+                contexto.statement, contexto.parameters, contexto.execution_context.executemany,
+                duracao_ms, erro=str(contexto.original_exception).strip()
+            )
+
+    def _registrar(self, statement, parameters, executemany, duracao_ms, plano=None, erro=None):
+        registro = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "duracao_ms": round(duracao_ms, 2),
+            "statement": statement,
+            "parametros": None if executemany else _serializar(parameters),
+            "erro": erro,
+            "explain": plano
+        }
+        with self._lock:
+            self._registros.append(registro)
+
+        if (
+            plano is None
+            and not executemany
+            and statement.lstrip().upper().startswith(_COMANDOS_EXPLICAVEIS)
+            and random.random() < self.taxa_explain
+        ):
+            try:
+                self._pendentes.put_nowait((registro, statement, parameters))
+                registro["explain"] = "pendente"
+                self._iniciar_thread()
+            except queue.Full:
+                pass
+
+    def _iniciar_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._processar_explains, name="slow-query-explain", daemon=True)
+            self._thread.start()
+
+    def _processar_explains(self) -> None:
+        while True:
+            registro, statement, parameters = self._pendentes.get()
+            try:
+                registro["explain"] = self._explain(statement, parameters)
+            except Exception as e:
+                registro["explain"] = f"erro: {str(e)}"
+
+    def _obter_conexao(self):
+        """
+        Conexão própria do EXPLAIN, aberta na primeira amostra e reaproveitada:
+        um plano demorado não ocupa uma conexão do pool limitado das requisições.
+        """
+        if self._conexao is None or self._conexao.closed:
+            from database import conectar_direto
+
+            self._conexao = conectar_direto()
+        return self._conexao
+
+    def _explain(self, statement: str, parameters, analisar: Optional[bool] = None) -> list:
+        """
+        Obtém o plano em uma transação descartada: EXPLAIN (ANALYZE, BUFFERS)
+        em uma transação READ ONLY para leituras e EXPLAIN simples para o resto.
+        """
+        if analisar is None:
+            analisar = pode_analisar(statement)
+        opcoes = "ANALYZE, BUFFERS, FORMAT JSON" if analisar else "FORMAT JSON"
+        conexao = self._obter_conexao()
+        try:
+            with conexao.cursor() as cursor:
+                # A conexão está em autocommit: a transação é aberta e desfeita aqui.
+                # Funções que escrevem (nextval, por exemplo) falham em vez de executar
+                cursor.execute("BEGIN READ ONLY" if analisar else "BEGIN")
+                try:
+                    cursor.execute(f"SET LOCAL statement_timeout = '{SLOW_QUERY_EXPLAIN_TIMEOUT_MS}ms'")
+                    cursor.execute(f"EXPLAIN ({opcoes}) {statement}", parameters or None)
+                    return cursor.fetchone()[0]
+                finally:
+                    cursor.execute("ROLLBACK")
+        except Exception:
+            if conexao.closed:
+                self._conexao = None
+            if not analisar:
+                raise
+            return self._explain(statement, parameters, analisar=False)
+
+    def listar(self) -> List[dict]:
+        """
+        Retorna os registros do buffer, do mais recente para o mais antigo.
+        """
+        with self._lock:
+            return list(reversed(self._registros))
+
+    def limpar(self) -> None:
+        """
+        Esvazia o buffer.
+        """
+        with self._lock:
+            self._registros.clear()
+
+
+def _retirar_plano_auto_explain(conn) -> Optional[list]:
+    """
+    Retira dos avisos da conexão o plano enviado pelo auto_explain para o
+    comando que acabou de executar, no formato do EXPLAIN (FORMAT JSON).
+    """
+    try:
+        avisos = getattr(conn.connection.dbapi_connection, "notices", None)
+        if avisos is None:
+            avisos = conn.info.get(_AVISOS)
+    except Exception:
+        return None
+    if not avisos:
+        return None
+
+    plano = None
+    for aviso in [a for a in avisos if "plan:" in a]:
+        avisos.remove(aviso)
+        try:
+            plano = [json.loads(aviso.split("plan:", 1)[1])]
+        except ValueError:
+            pass
+    return plano
+
+
+def _serializar(parameters):
+    """
+    Converte os parâmetros do driver em valores serializáveis em JSON.
+    """
+    if isinstance(parameters, dict):
+        return {k: _valor(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_valor(v) for v in parameters]
+    return _valor(parameters)
+
+
+def _valor(v):
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    if isinstance(v, (list, tuple)):
+        return [_valor(i) for i in v]
+    return str(v)
+
+
+recorder = SlowQueryRecorder(
+    limite_ms=SLOW_QUERY_THRESHOLD_MS,
+    taxa_explain=SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+    tamanho=SLOW_QUERY_BUFFER_SIZE
+)
@@ -15,6 +15,16 @@ if [ $? -ne 0 ]; then
     python migrations/setup_database.py
 fi
 
+# Preenche protocolos.sequencial das linhas antigas antes de a aplicação subir
+echo "Preenchendo número sequencial dos protocolos..."
+python migrations/backfill_protocolo_sequencial.py || exit 1
+
 # Inicia a aplicação
+# Em produção usa o Gunicorn com vários workers (ver gunicorn_conf.py);
+# o exec repassa o SIGTERM do container para o encerramento gracioso.
 echo "Iniciando aplicação..."
-uvicorn main:app --host 0.0.0.0 --port 8000
+if [ "$ENVIRONMENT" = "production" ]; then
+    exec gunicorn main:app -c gunicorn_conf.py
+else
+    exec uvicorn main:app --host 0.0.0.0 --port 8000
+fi
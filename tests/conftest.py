@@ -0,0 +1,59 @@
+"""
+Configuração dos testes.
+
+Os testes que usam o banco rodam em um banco próprio (POSTGRES_TEST_DATABASE,
+padrão: <POSTGRES_DATABASE>_teste), criado e migrado uma vez por sessão, e
+são ignorados quando o PostgreSQL não está acessível.
+"""
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "migrations"))
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv(os.path.join(RAIZ, ".env"))
+
+# Precisa ser definido antes de importar database/main
+os.environ["POSTGRES_DATABASE"] = os.getenv(
+    "POSTGRES_TEST_DATABASE", f"{os.getenv('POSTGRES_DATABASE', 'gestao_consultores')}_teste"
+)
+os.environ.setdefault("AUTHENTICATION_API_KEY", "chave-de-teste")
+
+
+def _postgres_acessivel() -> bool:
+    import psycopg2
+
+    try:
+        psycopg2.connect(
+            host=os.getenv("POSTGRES_HOST", "localhost"),
+            port=os.getenv("POSTGRES_PORT", "5432"),
+            user=os.getenv("POSTGRES_USERNAME"),
+            password=os.getenv("POSTGRES_PASSWORD"),
+            dbname="postgres",
+            connect_timeout=3
+        ).close()
+        return True
+    except Exception:
+        return False
+
+
+@pytest.fixture(scope="session")
+def banco():
+    """
+    Cria e migra o banco de testes; ignora o teste sem PostgreSQL.
+    """
+    if not _postgres_acessivel():
+        pytest.skip("PostgreSQL indisponível")
+
+    import setup_database
+
+    setup_database.create_database()
+    setup_database.run_migration()
+
+    from database import engine
+    return engine
@@ -0,0 +1,61 @@
+"""
+População da análise de justiça do rodízio.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import text
+
+import analise
+
+IDIOMA = "zq"
+
+
+@pytest.fixture
+def consultores(banco):
+    agora = datetime.now(timezone.utc)
+    definicoes = {
+        "com_protocolos": dict(ativo=True, deleted_at=None, protocolos=3),
+        "na_sequencia_sem_protocolos": dict(ativo=True, deleted_at=None, protocolos=0),
+        "inativo": dict(ativo=False, deleted_at=None, protocolos=0),
+        "removido_antes": dict(ativo=True, deleted_at=agora - timedelta(days=60), protocolos=0),
+        "removido_durante": dict(ativo=True, deleted_at=agora - timedelta(days=2), protocolos=2),
+    }
+    ids = {}
+    with banco.begin() as conn:
+        for nome, d in definicoes.items():
+            ids[nome] = conn.execute(text("""
+                INSERT INTO consultores (nome, idiomas, status_ativo, status_ativo_sequencial, deleted_at)
+                VALUES (:nome, ARRAY[:idioma], true, :ativo, :deleted_at)
+                RETURNING id
+            """), {"nome": nome, "idioma": IDIOMA, "ativo": d["ativo"], "deleted_at": d["deleted_at"]}).scalar()
+            for i in range(d["protocolos"]):
+                conn.execute(text("""
+                    INSERT INTO protocolos (sequencial, consultor_id, created_at)
+                    VALUES (:sequencial, :consultor_id, :created_at)
+                """), {
+                    "sequencial": 900_000_000 + ids[nome] * 10 + i,
+                    "consultor_id": ids[nome],
+                    "created_at": agora - timedelta(days=5, hours=i)
+                })
+    yield ids
+    with banco.begin() as conn:
+        conn.execute(text("DELETE FROM consultores WHERE id = ANY(:ids)"), {"ids": list(ids.values())})
+
+
+def test_populacao_exclui_removidos_antes_e_inativos_sem_atividade(banco, consultores):
+    ate = date.today() + timedelta(days=1)
+    resultado = analise.analisar(banco, ate - timedelta(days=30), ate, "UTC")
+
+    tabela = resultado.consultores
+    por_id = dict(zip(tabela["consultor_id"].tolist(), tabela["na_populacao"].tolist()))
+    assert consultores["removido_antes"] not in por_id
+    assert por_id[consultores["com_protocolos"]] is True
+    assert por_id[consultores["na_sequencia_sem_protocolos"]] is True
+    assert por_id[consultores["removido_durante"]] is True
+    assert por_id[consultores["inativo"]] is False
+
+    linha = list(resultado.idiomas["idioma"]).index(IDIOMA)
+    assert resultado.idiomas["consultores"][linha] == 3
+    assert resultado.idiomas["protocolos"][linha] == 5
+    assert resultado.idiomas["media"][linha] == pytest.approx(5 / 3)
@@ -0,0 +1,157 @@
+"""
+Índice de disponibilidade: recarga sem desfazer alterações mais novas,
+atualização após o commit sem propagar erros e aplicação das notificações
+do banco.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+import availability
+from availability import EstadoConsultor, IndiceDisponibilidade
+
+
+def _consultor(consultor_id, online=True, atendimento=None):
+    return EstadoConsultor(
+        id=consultor_id,
+        nome=f"c{consultor_id}",
+        idiomas=("pt",),
+        status_ativo=True,
+        status_ativo_sequencial=True,
+        status_online=online,
+        ultimo_atendimento=atendimento
+    )
+
+
+def _elegiveis(indice):
+    return indice.snapshot("pt")[0]["elegiveis"]
+
+
+def test_recarga_preserva_atualizacao_local_mais_nova():
+    indice = IndiceDisponibilidade()
+    indice.carregar([_consultor(1), _consultor(2)])
+
+    lido = indice.versao()
+    # Consultor 1 fica offline enquanto a query da recarga está rodando
+    indice.atualizar(_consultor(1, online=False))
+    indice.carregar([_consultor(1), _consultor(2)], lido_na_versao=lido)
+
+    assert _elegiveis(indice) == 1
+    assert indice.snapshot("pt")[0]["proximo"].id == 2
+
+
+def test_recarga_nao_ressuscita_consultor_removido():
+    indice = IndiceDisponibilidade()
+    indice.carregar([_consultor(1), _consultor(2)])
+
+    lido = indice.versao()
+    indice.remover(2)
+    indice.carregar([_consultor(1), _consultor(2)], lido_na_versao=lido)
+
+    assert _elegiveis(indice) == 1
+
+
+def test_recarga_aplica_estado_do_banco_para_alteracoes_antigas():
+    indice = IndiceDisponibilidade()
+    indice.carregar([_consultor(1), _consultor(2)])
+    indice.atualizar(_consultor(1, online=False))
+
+    # Leitura iniciada depois da alteração local: o banco vale
+    lido = indice.versao()
+    indice.carregar([_consultor(1), _consultor(2, online=False)], lido_na_versao=lido)
+
+    assert _elegiveis(indice) == 1
+    assert indice.snapshot("pt")[0]["proximo"].id == 1
+
+
+def test_atendimento_local_durante_recarga_mantem_ordem():
+    indice = IndiceDisponibilidade()
+    antigo = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    indice.carregar([_consultor(1, atendimento=antigo), _consultor(2, atendimento=antigo)])
+
+    lido = indice.versao()
+    indice.registrar_atendimento(1, datetime(2024, 1, 2, tzinfo=timezone.utc))
+    indice.carregar([_consultor(1, atendimento=antigo), _consultor(2, atendimento=antigo)], lido_na_versao=lido)
+
+    assert indice.snapshot("pt")[0]["proximo"].id == 2
+
+
+def test_falha_apos_o_commit_e_registrada_sem_propagar(banco, monkeypatch, caplog):
+    import models
+
+    def falhar(**kwargs):
+        raise RuntimeError("cache indisponível")
+
+    monkeypatch.setattr(models.pipedrive_cache, "invalidar", falhar)
+    models._apos_escrita_consultor(1, atendido_em=datetime.now(timezone.utc))
+    assert "cache indisponível" in caplog.text
+
+
+def test_notificacoes_do_banco_atualizam_o_indice(banco):
+    with banco.begin() as conn:
+        consultor_id = conn.execute(text("""
+            INSERT INTO consultores (nome, idiomas, status_online) VALUES ('Ouvinte', ARRAY['zn'], true)
+            RETURNING id
+        """)).scalar()
+
+    def aguardar(condicao):
+        async def esperar():
+            limite = time.monotonic() + 5
+            while not condicao():
+                assert time.monotonic() < limite, "notificação não aplicada"
+                await asyncio.sleep(0.02)
+        return esperar()
+
+    def elegiveis():
+        return availability.indice.snapshot("zn")[0]["elegiveis"]
+
+    async def rodar():
+        parar = asyncio.Event()
+        tarefa = asyncio.create_task(availability._sincronizar(parar))
+        try:
+            await aguardar(lambda: availability.indice.ouvindo)
+            assert elegiveis() == 1
+
+            # Escrita feita por outro processo: só chega pelo NOTIFY
+            await asyncio.to_thread(_executar, banco, "UPDATE consultores SET status_online = false WHERE id = :id", consultor_id)
+            await aguardar(lambda: elegiveis() == 0)
+
+            await asyncio.to_thread(_executar, banco, "UPDATE consultores SET status_online = true WHERE id = :id", consultor_id)
+            await aguardar(lambda: elegiveis() == 1)
+
+            await asyncio.to_thread(_executar, banco, "UPDATE consultores SET deleted_at = NOW() WHERE id = :id", consultor_id)
+            await aguardar(lambda: elegiveis() == 0)
+        finally:
+            parar.set()
+            await tarefa
+        assert not availability.indice.ouvindo
+
+    try:
+        asyncio.run(rodar())
+    finally:
+        _executar(banco, "DELETE FROM consultores WHERE id = :id", consultor_id)
+
+
+def _executar(banco, sql, consultor_id):
+    with banco.begin() as conn:
+        conn.execute(text(sql), {"id": consultor_id})
+
+
+def test_aplicar_notificacao_converte_o_atendimento():
+    antes = availability.indice
+    availability.indice = IndiceDisponibilidade()
+    try:
+        availability.indice.carregar([])
+        availability.aplicar_notificacao(
+            '{"id": 7, "nome": "c7", "idiomas": ["pt"], "status_ativo": true, '
+            '"status_ativo_sequencial": true, "status_online": true, '
+            '"ultimo_atendimento": "2024-01-02T03:04:05.123456+00:00", "removido": false}'
+        )
+        proximo = availability.indice.snapshot("pt")[0]["proximo"]
+        assert proximo.ultimo_atendimento == datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)
+        availability.aplicar_notificacao('{"id": 7, "removido": true}')
+        assert availability.indice.snapshot("pt")[0]["elegiveis"] == 0
+    finally:
+        availability.indice = antes
@@ -0,0 +1,69 @@
+"""
+Backfill de protocolos.sequencial em um esquema legado (com `numero`).
+"""
+import pytest
+from sqlalchemy import create_engine, event, text
+
+import backfill_protocolo_sequencial as backfill
+
+
+@pytest.fixture
+def legado(banco):
+    """
+    Engine cujo search_path aponta para um esquema com a tabela antiga.
+    """
+    with banco.begin() as conn:
+        conn.execute(text("DROP SCHEMA IF EXISTS backfill_legado CASCADE"))
+        conn.execute(text("CREATE SCHEMA backfill_legado"))
+        conn.execute(text("""
+            CREATE TABLE backfill_legado.protocolos (
+                id SERIAL PRIMARY KEY,
+                numero VARCHAR(20),
+                sequencial BIGINT
+            )
+        """))
+        conn.execute(text("""
+            INSERT INTO backfill_legado.protocolos (numero)
+            SELECT '#' || LPAD(n::text, 5, '0') FROM generate_series(1, 25) n
+        """))
+
+    engine = create_engine(banco.url, connect_args={"options": "-csearch_path=backfill_legado"})
+    yield engine
+    engine.dispose()
+    with banco.begin() as conn:
+        conn.execute(text("DROP SCHEMA backfill_legado CASCADE"))
+
+
+def test_preenche_em_lotes_e_marca_a_conclusao(legado):
+    backfill.preencher(legado, lote=10, pausa=0)
+
+    with legado.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM protocolos WHERE sequencial IS NULL")).scalar() == 0
+        assert conn.execute(text("SELECT sequencial FROM protocolos WHERE numero = '#00017'")).scalar() == 17
+        assert backfill.preenchimento_concluido(conn)
+
+
+def test_lotes_avancam_pela_chave(legado):
+    ultimos_ids = []
+
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("WITH lote"):
+            ultimos_ids.append(parameters["ultimo_id"])
+
+    event.listen(legado, "before_cursor_execute", capturar)
+    backfill.preencher(legado, lote=10, pausa=0)
+
+    with legado.connect() as conn:
+        ids = conn.execute(text("SELECT id FROM protocolos ORDER BY id")).scalars().all()
+    # Cada lote começa depois do último id do lote anterior
+    assert ultimos_ids == [0, ids[9], ids[19], ids[24]]
+
+
+def test_execucao_seguinte_nao_le_a_tabela(legado):
+    backfill.preencher(legado, lote=10, pausa=0)
+
+    comandos = []
+    event.listen(legado, "before_cursor_execute", lambda *args: comandos.append(args[2]))
+    backfill.preencher(legado, lote=10, pausa=0)
+
+    assert not [c for c in comandos if "FROM protocolos" in c or "UPDATE protocolos" in c]
@@ -0,0 +1,58 @@
+"""
+Cache do Pipedrive: invalidação por consultor sem descartar as demais cargas.
+"""
+from cache import PipedriveCache
+
+
+def _consultor(id_consultor: int) -> dict:
+    return {"id": id_consultor, "nome": f"Consultor {id_consultor}"}
+
+
+def test_invalidacao_de_outro_consultor_nao_descarta_a_carga():
+    cache = PipedriveCache(ttl=60, tamanho_maximo=100)
+    geracao = cache.geracao
+    # Uma distribuição para o consultor 3 durante a carga de 10 e 20
+    cache.invalidar(consultor_id=3)
+    cache.guardar({10: _consultor(1), 20: _consultor(2)}, geracao)
+
+    encontrados, faltantes = cache.obter([10, 20])
+    assert faltantes == []
+    assert encontrados[10]["id"] == 1
+
+
+def test_invalidacao_durante_a_carga_descarta_so_o_afetado():
+    cache = PipedriveCache(ttl=60, tamanho_maximo=100)
+    geracao = cache.geracao
+    cache.invalidar(consultor_id=1)
+    cache.invalidar(id_pipedrive=30)
+    cache.guardar({10: _consultor(1), 20: _consultor(2), 30: None}, geracao)
+
+    encontrados, faltantes = cache.obter([10, 20, 30])
+    assert sorted(faltantes) == [10, 30]
+    assert encontrados == {20: _consultor(2)}
+
+
+def test_invalidacao_anterior_a_carga_nao_a_descarta():
+    cache = PipedriveCache(ttl=60, tamanho_maximo=100)
+    cache.invalidar(consultor_id=1)
+    cache.guardar({10: _consultor(1)}, cache.geracao)
+    assert cache.obter([10])[1] == []
+
+
+def test_invalidar_remove_a_entrada_do_consultor():
+    cache = PipedriveCache(ttl=60, tamanho_maximo=100)
+    cache.guardar({10: _consultor(1), 20: _consultor(2)}, cache.geracao)
+    cache.invalidar(consultor_id=1)
+    encontrados, faltantes = cache.obter([10, 20])
+    assert faltantes == [10]
+    assert list(encontrados) == [20]
+
+
+def test_limpar_descarta_cargas_em_andamento():
+    cache = PipedriveCache(ttl=60, tamanho_maximo=100)
+    geracao = cache.geracao
+    cache.limpar()
+    cache.guardar({10: _consultor(1)}, geracao)
+    assert cache.obter([10])[1] == [10]
+    cache.guardar({10: _consultor(1)}, cache.geracao)
+    assert cache.obter([10])[1] == []
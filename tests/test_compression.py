@@ -0,0 +1,64 @@
+"""
+Vary: Accept-Encoding em todas as respostas negociadas pelo middleware.
+"""
+import asyncio
+import gzip
+
+from compression import CompressionMiddleware
+
+
+def _app(corpo: bytes, headers=()):
+    async def app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json"), *headers]
+        })
+        await send({"type": "http.response.body", "body": corpo})
+    return app
+
+
+def _chamar(app, accept_encoding=None, metodo="GET"):
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else []
+    mensagens = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        mensagens.append(message)
+
+    scope = {"type": "http", "method": metodo, "headers": headers}
+    asyncio.run(CompressionMiddleware(app, minimo=100)(scope, receive, send))
+    inicio, corpo = mensagens[0], b"".join(m.get("body", b"") for m in mensagens[1:])
+    return {k.lower(): v for k, v in inicio["headers"]}, corpo
+
+
+def test_comprime_e_adiciona_vary():
+    corpo = b'{"a": "' + b"x" * 500 + b'"}'
+    headers, recebido = _chamar(_app(corpo), "gzip")
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert gzip.decompress(recebido) == corpo
+
+
+def test_resposta_pequena_tem_vary():
+    headers, recebido = _chamar(_app(b"{}"), "gzip")
+    assert b"content-encoding" not in headers
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert recebido == b"{}"
+
+
+def test_sem_accept_encoding_tem_vary():
+    corpo = b'{"a": "' + b"x" * 500 + b'"}'
+    headers, recebido = _chamar(_app(corpo))
+    assert b"content-encoding" not in headers
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert recebido == corpo
+
+
+def test_vary_existente_e_preservado_sem_duplicar():
+    headers, _ = _chamar(_app(b"{}", [(b"vary", b"Origin")]), "br;q=0, gzip")
+    assert headers[b"vary"] == b"Origin, Accept-Encoding"
+    headers, _ = _chamar(_app(b"{}", [(b"vary", b"accept-encoding")]))
+    assert headers[b"vary"] == b"accept-encoding"
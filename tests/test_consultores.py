@@ -0,0 +1,100 @@
+"""
+Listagem de consultores: paginação por id (keyset) e busca por nome/email.
+"""
+import pytest
+from sqlalchemy import text
+
+import models
+
+
+@pytest.fixture
+def db(banco):
+    from database import SessionLocal
+
+    sessao = SessionLocal()
+    yield sessao
+    sessao.close()
+
+
+@pytest.fixture
+def consultores(banco):
+    """
+    Cria consultores com os nomes e emails informados e retorna os ids.
+    """
+    ids = []
+
+    def criar(*pessoas):
+        with banco.begin() as conn:
+            for nome, email in pessoas:
+                ids.append(conn.execute(text("""
+                    INSERT INTO consultores (nome, email, idiomas) VALUES (:nome, :email, ARRAY['pt']) RETURNING id
+                """), {"nome": nome, "email": email}).scalar())
+        return ids[-len(pessoas):]
+
+    yield criar
+    with banco.begin() as conn:
+        conn.execute(text("DELETE FROM consultores WHERE id = ANY(:ids)"), {"ids": ids})
+
+
+def _paginas(db, limite, **filtros):
+    paginas, cursor = [], None
+    while True:
+        pagina, cursor = models.get_consultores(db, cursor=cursor, limite=limite, **filtros)
+        paginas.append(pagina)
+        if cursor is None:
+            return paginas
+
+
+def test_paginas_seguem_o_cursor_sem_repetir_nem_pular(db, consultores):
+    ids = consultores(*[(f"Keyset Pagina {i}", None) for i in range(7)])
+
+    paginas = _paginas(db, 3, busca="Keyset Pagina")
+
+    assert [len(p) for p in paginas] == [3, 3, 1]
+    assert [c.id for p in paginas for c in p] == ids
+
+
+def test_cursor_continua_apos_remocao_de_um_consultor_ja_lido(db, consultores, banco):
+    ids = consultores(*[(f"Keyset Remocao {i}", None) for i in range(5)])
+
+    primeira, cursor = models.get_consultores(db, busca="Keyset Remocao", limite=2)
+    with banco.begin() as conn:
+        conn.execute(text("UPDATE consultores SET deleted_at = NOW() WHERE id = :id"), {"id": ids[0]})
+    segunda, _ = models.get_consultores(db, busca="Keyset Remocao", cursor=cursor, limite=2)
+
+    assert [c.id for c in primeira] == ids[:2]
+    assert [c.id for c in segunda] == ids[2:4]
+
+
+def test_cursor_com_campos_sem_id(db, consultores):
+    ids = consultores(*[(f"Keyset Campos {i}", None) for i in range(3)])
+
+    pagina, cursor = models.get_consultores(db, campos="nome", busca="Keyset Campos", limite=2)
+
+    assert pagina == [{"nome": "Keyset Campos 0"}, {"nome": "Keyset Campos 1"}]
+    assert cursor == ids[1]
+    pagina, cursor = models.get_consultores(db, campos="nome", busca="Keyset Campos", cursor=cursor, limite=2)
+    assert pagina == [{"nome": "Keyset Campos 2"}]
+    assert cursor is None
+
+
+def test_busca_por_trecho_do_nome_sem_diferenciar_maiusculas(db, consultores):
+    ana, _ = consultores(("Ana Buscável Souza", None), ("Bruno Outro", None))
+
+    encontrados, _ = models.get_consultores(db, busca="buscÁvel")
+
+    assert [c.id for c in encontrados] == [ana]
+
+
+def test_busca_por_email(db, consultores):
+    _, carla = consultores(("Consultor Busca Email", None), ("Carla", "carla.busca@exemplo.com"))
+
+    encontrados, _ = models.get_consultores(db, busca="carla.busca@")
+
+    assert [c.id for c in encontrados] == [carla]
+
+
+def test_busca_trata_curingas_como_texto(db, consultores):
+    literal, _ = consultores(("Busca 50%_off", None), ("Busca 50 e off", None))
+
+    assert [c.id for c in models.get_consultores(db, busca="50%_")[0]] == [literal]
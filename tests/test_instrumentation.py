@@ -0,0 +1,73 @@
+"""
+Orçamento de queries por endpoint e header Server-Timing.
+"""
+import re
+
+import pytest
+from fastapi import Depends
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+import instrumentation
+from instrumentation import QueryBudgetExceeded, query_budget
+
+
+@pytest.fixture(scope="module")
+def cliente(banco):
+    import main
+
+    @main.app.get("/teste/orcamento/dentro")
+    @query_budget(2)
+    def dentro_do_orcamento(db=Depends(main.get_db_read)):
+        db.execute(text("SELECT 1"))
+        db.execute(text("SELECT 2"))
+        return {"ok": True}
+
+    @main.app.get("/teste/orcamento/fora")
+    @query_budget(1)
+    def fora_do_orcamento(db=Depends(main.get_db_read)):
+        db.execute(text("SELECT 1"))
+        db.execute(text("SELECT 2"))
+        return {"ok": True}
+
+    # Sem o context manager, os workers de startup não são iniciados
+    return TestClient(main.app)
+
+
+def _excecao_original(exc: BaseException) -> BaseException:
+    # Versões novas do anyio embrulham o erro do middleware em um ExceptionGroup
+    while isinstance(exc, BaseExceptionGroup) and len(exc.exceptions) == 1:
+        exc = exc.exceptions[0]
+    return exc
+
+
+@pytest.fixture
+def modo_estrito(monkeypatch):
+    monkeypatch.setattr(instrumentation, "QUERY_BUDGET_ENFORCE", True)
+
+
+def test_endpoint_acima_do_orcamento_levanta_erro(cliente, modo_estrito):
+    with pytest.raises(BaseException) as erro:
+        cliente.get("/teste/orcamento/fora")
+    excecao = _excecao_original(erro.value)
+    assert isinstance(excecao, QueryBudgetExceeded)
+    assert "executou 2 queries (orçamento: 1)" in str(excecao)
+
+
+def test_endpoint_dentro_do_orcamento_passa(cliente, modo_estrito):
+    response = cliente.get("/teste/orcamento/dentro")
+    assert response.status_code == 200
+    assert response.json() == {"ok": True}
+
+
+def test_sem_modo_estrito_violacao_nao_interrompe(cliente):
+    assert instrumentation.QUERY_BUDGET_ENFORCE is False
+    assert cliente.get("/teste/orcamento/fora").status_code == 200
+
+
+def test_server_timing(cliente):
+    response = cliente.get("/teste/orcamento/dentro")
+    assert re.fullmatch(
+        r'db;dur=\d+\.\d{2};desc="2 queries", app;dur=\d+\.\d{2}',
+        response.headers["Server-Timing"]
+    )
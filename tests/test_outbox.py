@@ -0,0 +1,246 @@
+"""
+Worker da outbox contra um servidor HTTP de teste: entrega, novas
+tentativas com backoff, reserva expirada de um worker que morreu e descarte
+(dead letter) de eventos recusados ou sem tentativas restantes.
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import text
+
+import outbox
+
+
+class CRMStub:
+    """
+    Servidor HTTP que registra as requisições e responde com os status da fila
+    (200 quando a fila acaba) ou, com `responder`, com o status calculado a
+    partir do corpo.
+    """
+
+    def __init__(self, status=(), responder=None):
+        self.status = list(status)
+        self.requisicoes = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requisicoes.append({"instante": time.monotonic(), "headers": dict(self.headers), "corpo": corpo})
+                if responder:
+                    codigo = responder(corpo)
+                else:
+                    codigo = stub.status.pop(0) if stub.status else 200
+                self.send_response(codigo)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._servidor.server_port}/eventos"
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+
+    def fechar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+@pytest.fixture
+def crm():
+    stubs = []
+
+    def criar(status=(), responder=None):
+        stub = CRMStub(status, responder)
+        stubs.append(stub)
+        return stub
+
+    yield criar
+    for stub in stubs:
+        stub.fechar()
+
+
+@pytest.fixture
+def eventos(banco, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_POLL_INTERVAL_S", 0.05)
+    monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_BASE_S", 0.5)
+    monkeypatch.setattr(outbox, "OUTBOX_LEASE_S", 60)
+    with banco.begin() as conn:
+        conn.execute(text("DELETE FROM outbox_eventos"))
+
+    def inserir(quantidade: int):
+        with banco.begin() as conn:
+            return [
+                conn.execute(text(
+                    "INSERT INTO outbox_eventos (tipo, payload) VALUES ('consultor.atribuido', CAST(:p AS JSONB)) RETURNING id"
+                ), {"p": json.dumps({"n": i})}).scalar()
+                for i in range(quantidade)
+            ]
+
+    yield inserir
+    with banco.begin() as conn:
+        conn.execute(text("DELETE FROM outbox_eventos"))
+
+
+def _estado(banco):
+    with banco.begin() as conn:
+        return conn.execute(text(
+            "SELECT id, entregue_em, descartado_em, tentativas, ultimo_erro FROM outbox_eventos ORDER BY id"
+        )).all()
+
+
+def _todos_entregues(banco) -> bool:
+    return all(linha.entregue_em is not None for linha in _estado(banco))
+
+
+def _executar_worker(url: str, ate, timeout: float = 10) -> None:
+    async def rodar():
+        worker = outbox.OutboxWorker(url)
+        worker.iniciar()
+        try:
+            limite = time.monotonic() + timeout
+            while not await asyncio.to_thread(ate):
+                assert time.monotonic() < limite, "tempo esgotado aguardando o worker"
+                await asyncio.sleep(0.05)
+        finally:
+            await worker.parar()
+
+    asyncio.run(rodar())
+
+
+def test_chave_idempotencia_independe_da_ordem():
+    assert outbox.chave_idempotencia([3, 1, 2]) == outbox.chave_idempotencia([1, 2, 3])
+    assert outbox.chave_idempotencia([1, 3]) != outbox.chave_idempotencia([1, 2, 3])
+
+
+def test_entrega(banco, eventos, crm, monkeypatch):
+    monkeypatch.setattr(outbox, "CRM_WEBHOOK_TOKEN", "token-crm")
+    ids = eventos(3)
+    stub = crm()
+
+    _executar_worker(stub.url, lambda: _todos_entregues(banco))
+
+    assert len(stub.requisicoes) == 1
+    requisicao = stub.requisicoes[0]
+    assert requisicao["headers"]["Authorization"] == "Bearer token-crm"
+    assert requisicao["headers"]["Idempotency-Key"] == outbox.chave_idempotencia(ids)
+    enviados = requisicao["corpo"]["eventos"]
+    assert [e["id"] for e in enviados] == ids
+    assert [e["idempotency_key"] for e in enviados] == [f"outbox-{i}" for i in ids]
+    assert [e["dados"]["n"] for e in enviados] == [0, 1, 2]
+    assert all(linha.tentativas == 1 and linha.ultimo_erro is None for linha in _estado(banco))
+
+
+def test_falha_e_nova_tentativa_com_backoff(banco, eventos, crm):
+    ids = eventos(2)
+    stub = crm(status=[500])
+
+    _executar_worker(stub.url, lambda: _todos_entregues(banco))
+
+    assert len(stub.requisicoes) == 2
+    primeira, segunda = stub.requisicoes
+    # backoff_base * 2^0 após a primeira falha
+    assert segunda["instante"] - primeira["instante"] >= 0.45
+    assert primeira["headers"]["Idempotency-Key"] == segunda["headers"]["Idempotency-Key"]
+    assert [e["idempotency_key"] for e in segunda["corpo"]["eventos"]] == [f"outbox-{i}" for i in ids]
+    linhas = _estado(banco)
+    assert all(linha.tentativas == 2 and linha.ultimo_erro is None for linha in linhas)
+
+
+def test_falha_registra_erro_e_adia(banco, eventos, crm):
+    eventos(1)
+    stub = crm(status=[503, 503, 503])
+
+    _executar_worker(stub.url, lambda: len(stub.requisicoes) >= 1 and _estado(banco)[0].tentativas >= 1)
+
+    linha = _estado(banco)[0]
+    assert linha.entregue_em is None
+    assert "503" in linha.ultimo_erro
+
+
+def test_reserva_expirada_volta_para_a_fila(banco, eventos, crm, monkeypatch):
+    ids = eventos(2)
+    # Um worker reserva o lote e morre antes de entregar
+    monkeypatch.setattr(outbox, "OUTBOX_LEASE_S", 1)
+    reservados = outbox._executar(outbox._SQL_RESERVAR, {"lease": 1, "limite": 100})
+    reservado_em = time.monotonic()
+    assert sorted(e.id for e in reservados) == ids
+
+    stub = crm()
+    _executar_worker(stub.url, lambda: _todos_entregues(banco))
+
+    assert len(stub.requisicoes) == 1
+    assert stub.requisicoes[0]["instante"] - reservado_em >= 0.9
+    assert [e["id"] for e in stub.requisicoes[0]["corpo"]["eventos"]] == ids
+
+
+def test_evento_recusado_nao_segura_o_lote(banco, eventos, crm):
+    ids = eventos(3)
+    recusado = ids[1]
+    stub = crm(responder=lambda corpo: 422 if recusado in [e["id"] for e in corpo["eventos"]] else 200)
+
+    _executar_worker(stub.url, lambda: all(
+        linha.entregue_em is not None or linha.descartado_em is not None for linha in _estado(banco)
+    ))
+
+    # O lote inteiro é recusado e os eventos são reenviados um a um
+    assert [[e["id"] for e in r["corpo"]["eventos"]] for r in stub.requisicoes] == [ids, [ids[0]], [ids[1]], [ids[2]]]
+    linhas = {linha.id: linha for linha in _estado(banco)}
+    assert linhas[ids[0]].entregue_em is not None and linhas[ids[2]].entregue_em is not None
+    assert linhas[recusado].entregue_em is None
+    assert linhas[recusado].descartado_em is not None
+    assert "422" in linhas[recusado].ultimo_erro
+
+
+def test_limite_de_tentativas_descarta_o_evento(banco, eventos, crm, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_BASE_S", 0.05)
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_TENTATIVAS", 2)
+    eventos(1)
+    stub = crm(status=[503] * 10)
+
+    def descartado_e_ocioso():
+        if _estado(banco)[0].descartado_em is None:
+            return False
+        # Fora da fila: nenhuma nova tentativa depois do descarte
+        time.sleep(0.3)
+        return True
+
+    _executar_worker(stub.url, descartado_e_ocioso)
+
+    linha = _estado(banco)[0]
+    assert linha.tentativas == 2
+    assert linha.entregue_em is None
+    assert len(stub.requisicoes) == 2
+
+
+def test_credencial_recusada_nao_descarta(banco, eventos, crm):
+    eventos(2)
+    stub = crm(status=[401])
+
+    _executar_worker(stub.url, lambda: _todos_entregues(banco))
+
+    # 401 não é culpa dos eventos: o lote segue junto, com backoff
+    assert [len(r["corpo"]["eventos"]) for r in stub.requisicoes] == [2, 2]
+    assert all(linha.descartado_em is None and linha.tentativas == 2 for linha in _estado(banco))
+
+
+def test_backoff_com_muitas_tentativas_nao_estoura(banco, eventos):
+    ids = eventos(1)
+    with banco.begin() as conn:
+        conn.execute(text("UPDATE outbox_eventos SET tentativas = 5000 WHERE id = :id"), {"id": ids[0]})
+
+    outbox._executar(outbox._SQL_ADIAR, {
+        "ids": ids, "erro": "503", "backoff_base": 2, "backoff_max": 300,
+        "recusado": False, "max_tentativas": 0
+    })
+
+    with banco.begin() as conn:
+        espera = conn.execute(text(
+            "SELECT EXTRACT(EPOCH FROM proxima_tentativa_em - NOW()) FROM outbox_eventos WHERE id = :id"
+        ), {"id": ids[0]}).scalar()
+    assert 295 <= espera <= 300
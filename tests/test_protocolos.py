@@ -0,0 +1,79 @@
+"""
+Criação direta de protocolos pelo motor de protocolos.
+"""
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+import schemas
+
+
+@pytest.fixture
+def consultor_id(banco):
+    with banco.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO controle_protocolo (id, ultimo_numero) VALUES (1, 0) ON CONFLICT (id) DO NOTHING"
+        ))
+        consultor_id = conn.execute(text(
+            "INSERT INTO consultores (nome, idiomas) VALUES ('Teste Protocolo', ARRAY['pt']) RETURNING id"
+        )).scalar()
+    yield consultor_id
+    with banco.begin() as conn:
+        conn.execute(text("DELETE FROM consultores WHERE id = :id"), {"id": consultor_id})
+
+
+@pytest.fixture
+def db(banco):
+    from database import SessionLocal
+
+    sessao = SessionLocal()
+    yield sessao
+    sessao.close()
+
+
+def test_criar_protocolo_grava_descricao_e_prioridade(db, consultor_id):
+    import models
+
+    protocolo = models.criar_protocolo(db, schemas.ProtocoloCreate(
+        consultor_id=consultor_id, descricao="Cliente sem acesso", prioridade="urgente"
+    ))
+
+    assert protocolo.descricao == "Cliente sem acesso"
+    assert protocolo.prioridade == "urgente"
+    assert protocolo.status == "aberto"
+    salvo = db.execute(
+        text("SELECT descricao, prioridade FROM protocolos WHERE id = :id"), {"id": protocolo.id}
+    ).one()
+    assert tuple(salvo) == ("Cliente sem acesso", "urgente")
+
+
+def test_criar_protocolo_usa_os_padroes(db, consultor_id):
+    import models
+
+    protocolo = models.criar_protocolo(db, schemas.ProtocoloCreate(consultor_id=consultor_id))
+
+    assert protocolo.descricao is None
+    assert protocolo.prioridade == "normal"
+
+
+def test_criar_protocolo_consultor_inexistente(db):
+    import models
+
+    with pytest.raises(HTTPException) as erro:
+        models.criar_protocolo(db, schemas.ProtocoloCreate(consultor_id=-1))
+    assert erro.value.status_code == 404
+
+
+def test_gerar_protocolo_nao_atribui_consultor(db, consultor_id, banco):
+    import models
+
+    anterior = models.gerar_novo_protocolo(db)
+    protocolo = models.gerar_novo_protocolo(db)
+
+    assert protocolo.consultor_id is None
+    assert protocolo.sequencial == anterior.sequencial + 1
+    with banco.begin() as conn:
+        assert conn.execute(
+            text("SELECT consultor_id FROM protocolos WHERE id = :id"), {"id": protocolo.id}
+        ).scalar() is None
+    assert schemas.ProtocoloResponse.from_orm(protocolo).consultor_id is None
@@ -0,0 +1,99 @@
+"""
+Identificação dos baldes por cliente (inclusive atrás de proxy) e descarte por ordem de uso no backend em memória.
+"""
+import asyncio
+import ipaddress
+
+import rate_limit
+from rate_limit import MemoryBackend, RateLimitMiddleware
+
+
+def _scope(chave=None, ip="10.0.0.1", encaminhado=None):
+    headers = [(b"api-key", chave.encode())] if chave is not None else []
+    if encaminhado is not None:
+        headers.append((b"x-forwarded-for", encaminhado.encode()))
+    return {"type": "http", "method": "GET", "path": "/consultores", "headers": headers, "client": (ip, 5000)}
+
+
+PROXIES = [ipaddress.ip_network("10.0.0.0/24")]
+
+
+def test_chave_valida_tem_balde_por_cliente():
+    middleware = RateLimitMiddleware(None, api_key="segredo", backend=MemoryBackend(), proxies=[])
+    assert middleware._identificar(_scope("segredo", "203.0.113.1")) == "cliente:203.0.113.1"
+    assert middleware._identificar(_scope("segredo", "203.0.113.2")) == "cliente:203.0.113.2"
+
+
+def test_chave_invalida_usa_balde_separado_do_endereco():
+    middleware = RateLimitMiddleware(None, api_key="segredo", backend=MemoryBackend(), proxies=[])
+    assert middleware._identificar(_scope("inventada-1")) == "anonimo:10.0.0.1"
+    assert middleware._identificar(_scope("inventada-2")) == "anonimo:10.0.0.1"
+    assert middleware._identificar(_scope()) == "anonimo:10.0.0.1"
+
+
+def test_x_forwarded_for_so_de_proxy_confiavel():
+    # Conexão direta: o header é ignorado
+    assert rate_limit.endereco_cliente(_scope(ip="203.0.113.9", encaminhado="198.51.100.1"), PROXIES) == "203.0.113.9"
+    # Pelo proxy: o primeiro endereço não confiável da direita para a esquerda
+    assert rate_limit.endereco_cliente(_scope(encaminhado="198.51.100.1"), PROXIES) == "198.51.100.1"
+    assert rate_limit.endereco_cliente(
+        _scope(encaminhado="1.2.3.4, 198.51.100.1, 10.0.0.7"), PROXIES
+    ) == "198.51.100.1"
+    # Sem X-Forwarded-For fica o endereço do proxy
+    assert rate_limit.endereco_cliente(_scope(), PROXIES) == "10.0.0.1"
+
+
+def test_integradores_atras_do_proxy_tem_baldes_distintos():
+    middleware = RateLimitMiddleware(None, api_key="segredo", backend=MemoryBackend(), proxies=PROXIES)
+    assert middleware._identificar(_scope("segredo", encaminhado="198.51.100.1")) == "cliente:198.51.100.1"
+    assert middleware._identificar(_scope("segredo", encaminhado="198.51.100.2")) == "cliente:198.51.100.2"
+
+
+def test_chaves_inventadas_nao_contornam_o_limite():
+    chamadas = []
+
+    async def app(scope, receive, send):
+        chamadas.append(scope)
+
+    async def enviar(message):
+        pass
+
+    async def rodar():
+        middleware = RateLimitMiddleware(app, api_key="segredo", backend=MemoryBackend(), proxies=[])
+        for i in range(10):
+            await middleware(_scope(f"inventada-{i}"), None, enviar)
+
+    taxa, rajada = rate_limit.LIMITES["leitura"]
+    rate_limit.LIMITES["leitura"] = (1.0, 3.0)
+    try:
+        asyncio.run(rodar())
+    finally:
+        rate_limit.LIMITES["leitura"] = (taxa, rajada)
+    assert len(chamadas) == 3
+
+
+def test_descarta_o_balde_usado_ha_mais_tempo():
+    backend = MemoryBackend(max_chaves=2)
+
+    async def rodar():
+        await backend.consumir("a", "leitura", 1.0, 2.0)
+        await backend.consumir("b", "leitura", 1.0, 2.0)
+        # "a" volta a ser usado e "b" passa a ser o mais antigo
+        await backend.consumir("a", "leitura", 1.0, 2.0)
+        await backend.consumir("c", "leitura", 1.0, 2.0)
+
+    asyncio.run(rodar())
+    assert list(backend._baldes) == [("a", "leitura"), ("c", "leitura")]
+    # O balde de "a" foi preservado com os tokens já consumidos
+    assert backend._baldes[("a", "leitura")][0] < 1
+
+
+def test_redis_sem_o_pacote_falha_com_erro_de_configuracao(monkeypatch):
+    import sys
+
+    import pytest
+
+    monkeypatch.setitem(sys.modules, "redis", None)
+    monkeypatch.setitem(sys.modules, "redis.asyncio", None)
+    with pytest.raises(RuntimeError, match="pacote redis"):
+        rate_limit.RedisBackend("redis://localhost:6379/0")
@@ -0,0 +1,136 @@
+"""
+Remoção de consultores: o soft delete tira o consultor da distribuição e das
+listagens na hora, e o purge arquiva os protocolos e apaga a linha só depois
+da carência.
+"""
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+import availability
+import models
+import schemas
+
+# Idioma exclusivo destes testes, para que a distribuição só veja os consultores daqui
+IDIOMA = "xr"
+
+
+@pytest.fixture
+def db(banco):
+    from database import SessionLocal
+
+    sessao = SessionLocal()
+    yield sessao
+    sessao.close()
+
+
+@pytest.fixture
+def consultor(banco):
+    ids = []
+
+    def criar():
+        with banco.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO controle_protocolo (id, ultimo_numero) VALUES (1, 0) ON CONFLICT (id) DO NOTHING"
+            ))
+            ids.append(conn.execute(text("""
+                INSERT INTO consultores (nome, idiomas, status_ativo, status_ativo_sequencial, status_online)
+                VALUES ('Teste Remoção', ARRAY[:idioma], true, true, true)
+                RETURNING id
+            """), {"idioma": IDIOMA}).scalar())
+        return ids[-1]
+
+    yield criar
+    with banco.begin() as conn:
+        conn.execute(text("DELETE FROM protocolos_arquivo WHERE consultor_id = ANY(:ids)"), {"ids": ids})
+        conn.execute(text("DELETE FROM consultores WHERE id = ANY(:ids)"), {"ids": ids})
+
+
+def _remover_ha(banco, consultor_id, horas):
+    with banco.begin() as conn:
+        conn.execute(text(
+            "UPDATE consultores SET deleted_at = NOW() - make_interval(hours => :horas) WHERE id = :id"
+        ), {"id": consultor_id, "horas": horas})
+
+
+def _purgar(db, carencia_horas=24):
+    # Um lote por consultor removido; outros testes podem ter deixado consultores na fila
+    for _ in range(100):
+        if not models.purgar_lote_protocolos(db, lote=500, carencia_horas=carencia_horas):
+            break
+    return models.purgar_consultores(db, lote=500, carencia_horas=carencia_horas)
+
+
+def _contar(banco, tabela, consultor_id):
+    with banco.begin() as conn:
+        return conn.execute(
+            text(f"SELECT COUNT(*) FROM {tabela} WHERE consultor_id = :id"), {"id": consultor_id}
+        ).scalar()
+
+
+def _existe(banco, consultor_id):
+    with banco.begin() as conn:
+        return conn.execute(text("SELECT 1 FROM consultores WHERE id = :id"), {"id": consultor_id}).first() is not None
+
+
+def test_removido_sai_da_distribuicao(db, consultor):
+    consultor_id = consultor()
+    assert models.get_consultor_da_vez(db, IDIOMA).consultor_id == consultor_id
+
+    models.deletar_consultor(db, consultor_id)
+
+    with pytest.raises(HTTPException) as erro:
+        models.get_consultor_da_vez(db, IDIOMA)
+    assert erro.value.status_code == 404
+
+
+def test_removido_sai_das_listagens_e_do_indice(db, consultor, banco):
+    consultor_id = consultor()
+    with banco.begin() as conn:
+        linha = conn.execute(text("SELECT * FROM consultores WHERE id = :id"), {"id": consultor_id}).mappings().first()
+    availability.indice.atualizar(availability.EstadoConsultor.da_linha(linha))
+
+    models.deletar_consultor(db, consultor_id)
+
+    assert models.get_consultor(db, consultor_id) is None
+    assert consultor_id not in [c.id for c in models.get_consultores(db, idioma=IDIOMA)[0]]
+    assert availability.indice.snapshot(IDIOMA)[0]["elegiveis"] == 0
+    with pytest.raises(HTTPException) as erro:
+        models.deletar_consultor(db, consultor_id)
+    assert erro.value.status_code == 404
+
+
+def test_purge_espera_a_carencia(db, consultor, banco):
+    consultor_id = consultor()
+    models.criar_protocolo(db, schemas.ProtocoloCreate(consultor_id=consultor_id))
+    _remover_ha(banco, consultor_id, horas=1)
+
+    _purgar(db, carencia_horas=24)
+
+    assert _existe(banco, consultor_id)
+    assert _contar(banco, "protocolos", consultor_id) == 1
+
+
+def test_purge_nao_apaga_consultor_com_protocolos(db, consultor, banco):
+    consultor_id = consultor()
+    models.criar_protocolo(db, schemas.ProtocoloCreate(consultor_id=consultor_id))
+    _remover_ha(banco, consultor_id, horas=48)
+
+    assert consultor_id not in [
+        row.id for row in db.execute(models._SQL_PURGAR_CONSULTORES, {"lote": 500, "carencia_horas": 24})
+    ]
+    db.rollback()
+    assert _existe(banco, consultor_id)
+
+
+def test_purge_arquiva_os_protocolos_e_depois_apaga_o_consultor(db, consultor, banco):
+    consultor_id = consultor()
+    for _ in range(3):
+        models.criar_protocolo(db, schemas.ProtocoloCreate(consultor_id=consultor_id))
+    _remover_ha(banco, consultor_id, horas=48)
+
+    _purgar(db, carencia_horas=24)
+
+    assert _contar(banco, "protocolos", consultor_id) == 0
+    assert _contar(banco, "protocolos_arquivo", consultor_id) == 3
+    assert not _existe(banco, consultor_id)
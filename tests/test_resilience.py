@@ -0,0 +1,172 @@
+"""
+Disjuntor do banco: uma única requisição de teste no meio-aberto.
+"""
+import threading
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+import resilience
+from resilience import CircuitBreaker
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    r = Relogio()
+    monkeypatch.setattr(resilience.time, "monotonic", r)
+    return r
+
+
+@pytest.fixture
+def disjuntor(relogio):
+    d = CircuitBreaker(limite_falhas=2, janela=10, tempo_reset=30)
+    d.registrar_falha()
+    d.registrar_falha()
+    assert d.estado == CircuitBreaker.ABERTO
+    return d
+
+
+def _rejeitado(disjuntor) -> bool:
+    try:
+        disjuntor.verificar()
+        return False
+    except HTTPException as e:
+        assert e.status_code == 503
+        assert "Retry-After" in e.headers
+        return True
+
+
+def test_aberto_rejeita_ate_o_reset(disjuntor, relogio):
+    relogio.agora += 29
+    assert _rejeitado(disjuntor)
+
+
+def test_meio_aberto_admite_uma_unica_sonda(disjuntor, relogio):
+    relogio.agora += 30
+    assert not _rejeitado(disjuntor)
+    assert disjuntor.estado == CircuitBreaker.MEIO_ABERTO
+    assert _rejeitado(disjuntor)
+    assert _rejeitado(disjuntor)
+
+
+def test_sonda_concorrente(disjuntor, relogio):
+    relogio.agora += 30
+    admitidas = []
+    barreira = threading.Barrier(16)
+
+    def requisicao():
+        barreira.wait()
+        admitidas.append(not _rejeitado(disjuntor))
+
+    threads = [threading.Thread(target=requisicao) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert admitidas.count(True) == 1
+
+
+def test_sucesso_da_sonda_fecha(disjuntor, relogio):
+    relogio.agora += 30
+    disjuntor.verificar()
+    disjuntor.registrar_sucesso()
+    assert disjuntor.estado == CircuitBreaker.FECHADO
+    assert not _rejeitado(disjuntor)
+    assert not _rejeitado(disjuntor)
+
+
+def test_falha_da_sonda_reabre(disjuntor, relogio):
+    relogio.agora += 30
+    disjuntor.verificar()
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == CircuitBreaker.ABERTO
+    relogio.agora += 29
+    assert _rejeitado(disjuntor)
+    relogio.agora += 1
+    assert not _rejeitado(disjuntor)
+
+
+def test_sonda_sem_resultado_libera_outra(disjuntor, relogio):
+    relogio.agora += 30
+    disjuntor.verificar()
+    relogio.agora += 29
+    assert _rejeitado(disjuntor)
+    relogio.agora += 1
+    assert not _rejeitado(disjuntor)
+    assert _rejeitado(disjuntor)
+
+
+@pytest.fixture
+def disjuntor_global(relogio, monkeypatch):
+    d = CircuitBreaker(limite_falhas=2, janela=10, tempo_reset=30)
+    monkeypatch.setattr(resilience, "db_breaker", d)
+    d.registrar_falha()
+    d.registrar_falha()
+    relogio.agora += 30
+    # Esta verificação é a sonda da distribuição
+    d.verificar()
+    assert d.estado == CircuitBreaker.MEIO_ABERTO
+    return d
+
+
+def test_outros_comandos_nao_fecham_o_meio_aberto(banco, disjuntor_global):
+    from database import get_db_for
+
+    # Preâmbulo de timeouts da sessão de distribuição
+    sessoes = get_db_for("dispatch")()
+    db = next(sessoes)
+    try:
+        db.execute(text("SELECT 1"))
+        db.rollback()
+    finally:
+        sessoes.close()
+    # Comando de um worker em segundo plano
+    with banco.begin() as conn:
+        conn.execute(text("SELECT count(*) FROM outbox_eventos"))
+
+    assert disjuntor_global.estado == CircuitBreaker.MEIO_ABERTO
+    assert _rejeitado(disjuntor_global)
+
+
+def test_comando_da_distribuicao_fecha_o_meio_aberto(banco, disjuntor_global):
+    import models
+    from database import get_db_for
+
+    sessoes = get_db_for("dispatch")()
+    db = next(sessoes)
+    try:
+        with pytest.raises(HTTPException) as erro:
+            models.get_consultor_da_vez(db, "idioma-sem-consultores")
+        assert erro.value.status_code == 404
+    finally:
+        sessoes.close()
+
+    assert disjuntor_global.estado == CircuitBreaker.FECHADO
+
+
+def test_timeout_da_distribuicao_reabre(banco, disjuntor_global, monkeypatch):
+    import models
+    from database import get_db_for
+
+    sessoes = get_db_for("dispatch")()
+    db = next(sessoes)
+    monkeypatch.setattr(models, "_SQL_CONSULTOR_DA_VEZ", text(
+        "SET LOCAL statement_timeout = '10ms'; SELECT pg_sleep(1)"
+    ))
+    try:
+        with pytest.raises(HTTPException) as erro:
+            models.get_consultor_da_vez(db, "pt")
+        assert erro.value.status_code == 503
+    finally:
+        sessoes.close()
+
+    assert disjuntor_global.estado == CircuitBreaker.ABERTO
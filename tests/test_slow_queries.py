@@ -0,0 +1,149 @@
+"""
+EXPLAIN das queries lentas: ANALYZE só em leituras, conexão fora do pool,
+comandos interrompidos e plano real da distribuição pelo auto_explain.
+"""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import slow_queries
+from slow_queries import SlowQueryRecorder, pode_analisar
+
+
+@pytest.mark.parametrize("statement, esperado", [
+    ("SELECT id FROM consultores WHERE id = %(id)s", True),
+    ("  select count(*) from protocolos", True),
+    ("SELECT id FROM consultores WHERE id = 1 FOR UPDATE SKIP LOCKED", False),
+    ("SELECT id FROM consultores FOR NO KEY UPDATE", False),
+    ("SELECT id FROM consultores FOR SHARE", False),
+    ("WITH x AS (SELECT 1) SELECT * FROM x", False),
+    ("WITH x AS (UPDATE consultores SET nome = nome RETURNING id) SELECT * FROM x", False),
+    ("UPDATE consultores SET nome = 'x'", False),
+    ("INSERT INTO protocolos (sequencial) VALUES (1)", False),
+    ("DELETE FROM protocolos", False),
+])
+def test_pode_analisar(statement, esperado):
+    assert pode_analisar(statement) is esperado
+
+
+@pytest.fixture
+def recorder(banco):
+    # O recorder global, instalado pelo main, disputaria os avisos da conexão
+    engine_global = slow_queries.recorder._engine
+    slow_queries.recorder.remover()
+
+    r = SlowQueryRecorder(limite_ms=0, taxa_explain=0, tamanho=10)
+    r.instalar(banco)
+    yield r
+    r.remover()
+    if r._conexao is not None:
+        r._conexao.close()
+    if engine_global is not None:
+        slow_queries.recorder.instalar(engine_global)
+
+
+def _tem_tempos_reais(plano) -> bool:
+    return "Actual Total Time" in plano[0]["Plan"]
+
+
+def test_select_recebe_analyze(recorder):
+    plano = recorder._explain("SELECT COUNT(*) FROM consultores", {})
+    assert _tem_tempos_reais(plano)
+
+
+def test_escrita_nao_e_executada(recorder, banco):
+    with banco.begin() as conn:
+        conn.execute(text("INSERT INTO controle_protocolo (id, ultimo_numero) VALUES (1, 0) ON CONFLICT (id) DO NOTHING"))
+        antes = conn.execute(text("SELECT ultimo_numero FROM controle_protocolo WHERE id = 1")).scalar()
+
+    plano = recorder._explain(
+        "UPDATE controle_protocolo SET ultimo_numero = ultimo_numero + 1 WHERE id = 1 RETURNING ultimo_numero",
+        {}
+    )
+    assert not _tem_tempos_reais(plano)
+
+    with banco.begin() as conn:
+        depois = conn.execute(text("SELECT ultimo_numero FROM controle_protocolo WHERE id = 1")).scalar()
+    assert depois == antes
+
+
+def test_select_com_efeito_colateral_cai_para_explain_simples(recorder, banco):
+    with banco.begin() as conn:
+        conn.execute(text("CREATE SEQUENCE IF NOT EXISTS teste_slow_query_seq"))
+        antes = conn.execute(text("SELECT last_value FROM teste_slow_query_seq")).scalar()
+
+    # nextval escreve, então falha na transação READ ONLY e o plano vem sem ANALYZE
+    plano = recorder._explain("SELECT nextval('teste_slow_query_seq')", {})
+    assert not _tem_tempos_reais(plano)
+
+    with banco.begin() as conn:
+        assert conn.execute(text("SELECT last_value FROM teste_slow_query_seq")).scalar() == antes
+
+
+def test_explain_nao_usa_o_pool(recorder, banco, monkeypatch):
+    def pool_esgotado(*args, **kwargs):
+        raise AssertionError("EXPLAIN não deve usar o pool")
+
+    monkeypatch.setattr(banco, "connect", pool_esgotado)
+    plano = recorder._explain("SELECT COUNT(*) FROM consultores", {})
+    assert _tem_tempos_reais(plano)
+
+
+def test_comando_cancelado_pelo_timeout_e_registrado(recorder, banco):
+    with banco.connect() as conn:
+        conn.execute(text("SET LOCAL statement_timeout = '50ms'"))
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT pg_sleep(1)"))
+
+    registro = next(r for r in recorder.listar() if r["statement"] == "SELECT pg_sleep(1)")
+    assert registro["duracao_ms"] >= 50
+    assert "statement timeout" in registro["erro"]
+
+
+def test_remover_desfaz_os_eventos(banco):
+    r = SlowQueryRecorder(limite_ms=0, taxa_explain=0, tamanho=10)
+    r.instalar(banco)
+    r.remover()
+    with banco.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert r.listar() == []
+
+
+def test_distribuicao_guarda_o_plano_do_auto_explain(recorder, banco, monkeypatch):
+    from database import get_db_for
+
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_AUTO_EXPLAIN", True)
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_THRESHOLD_MS", 0)
+
+    db = next(get_db_for("dispatch")())
+    try:
+        # Configurado com SET LOCAL mesmo antes de o módulo ser carregado
+        assert db.execute(text("SHOW auto_explain.log_analyze")).scalar() == "on"
+        try:
+            # Em produção o módulo vem de session_preload_libraries
+            db.execute(text("LOAD 'auto_explain'"))
+        except OperationalError:
+            pytest.skip("auto_explain indisponível no servidor")
+        db.execute(text("WITH x AS (SELECT id FROM consultores) SELECT COUNT(*) FROM x"))
+    finally:
+        db.rollback()
+        db.close()
+
+    registro = next(r for r in recorder.listar() if r["statement"].startswith("WITH x"))
+    assert _tem_tempos_reais(registro["explain"])
+
+
+def test_plano_recebido_como_notice_substitui_o_explain(recorder, banco, monkeypatch):
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_AUTO_EXPLAIN", True)
+    recorder.taxa_explain = 1
+
+    # Mesmo formato da mensagem do auto_explain com log_format = json
+    plano = '{"Query Text": "SELECT 1", "Plan": {"Node Type": "Result", "Actual Total Time": 0.01}}'
+    with banco.connect() as conn:
+        conn.execute(text(
+            f"DO $$ BEGIN RAISE NOTICE 'duration: 0.020 ms  plan:%', chr(10) || '{plano}'; END $$"
+        ))
+        assert not [a for a in conn.connection.dbapi_connection.notices if "plan:" in a]
+
+    registro = next(r for r in recorder.listar() if r["statement"].startswith("DO $$"))
+    assert _tem_tempos_reais(registro["explain"])
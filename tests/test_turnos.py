@@ -0,0 +1,165 @@
+"""
+Transições de turno aplicadas pelo escalonador (_SQL_APLICAR_TURNOS).
+
+O relógio do banco é fixado por uma função now() em um esquema que vem antes
+de pg_catalog no search_path, para posicionar a janela processada em
+qualquer dia da semana.
+"""
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+
+FUSO = "America/Sao_Paulo"
+
+
+@pytest.fixture
+def relogio(banco):
+    """
+    Retorna aplicar(desde, agora): processa a janela (desde, agora] com o
+    relógio do banco parado em `agora`.
+    """
+    with banco.begin() as conn:
+        conn.execute(text("CREATE SCHEMA IF NOT EXISTS relogio_teste"))
+        conn.execute(text("""
+            CREATE OR REPLACE FUNCTION relogio_teste.now() RETURNS TIMESTAMP WITH TIME ZONE
+            LANGUAGE sql STABLE AS $$
+                SELECT COALESCE(CAST(current_setting('teste.agora', true) AS TIMESTAMP WITH TIME ZONE), pg_catalog.now())
+            $$
+        """))
+
+    engine = create_engine(banco.url, connect_args={"options": "-csearch_path=relogio_teste,pg_catalog,public"})
+    sessao = Session(engine)
+    models.inicializar_controle_turnos(sessao)
+
+    def aplicar(desde: str, agora: str) -> int:
+        sessao.execute(text("SELECT set_config('teste.agora', :agora, false)"), {"agora": agora})
+        sessao.execute(text("UPDATE controle_turnos SET processado_ate = :desde WHERE id = 1"), {"desde": desde})
+        sessao.commit()
+        return models.aplicar_transicoes_turnos(sessao, FUSO)
+
+    yield aplicar
+    sessao.close()
+    engine.dispose()
+    with banco.begin() as conn:
+        conn.execute(text("UPDATE controle_turnos SET processado_ate = NOW() WHERE id = 1"))
+        conn.execute(text("DROP SCHEMA relogio_teste CASCADE"))
+
+
+@pytest.fixture
+def consultor(banco):
+    """
+    Cria consultores com a escala informada ([(dia_semana, inicio, fim)]).
+    """
+    ids = []
+
+    def criar(turnos, online=False, override_ate=None):
+        with banco.begin() as conn:
+            consultor_id = conn.execute(text("""
+                INSERT INTO consultores (nome, idiomas, status_online, status_override_ate)
+                VALUES ('Teste Turno', ARRAY['pt'], :online, :override_ate)
+                RETURNING id
+            """), {"online": online, "override_ate": override_ate}).scalar()
+            for dia, inicio, fim in turnos:
+                conn.execute(text("""
+                    INSERT INTO turnos_consultor (consultor_id, dia_semana, inicio, fim)
+                    VALUES (:id, :dia, CAST(:inicio AS TIME), CAST(:fim AS TIME))
+                """), {"id": consultor_id, "dia": dia, "inicio": inicio, "fim": fim})
+        ids.append(consultor_id)
+        return consultor_id
+
+    yield criar
+    with banco.begin() as conn:
+        conn.execute(text("DELETE FROM consultores WHERE id = ANY(:ids)"), {"ids": ids})
+
+
+def _status(banco, consultor_id):
+    with banco.begin() as conn:
+        return conn.execute(text(
+            "SELECT status_online, status_override_ate FROM consultores WHERE id = :id"
+        ), {"id": consultor_id}).first()
+
+
+# Quarta-feira, 5 de junho de 2024 (dia_semana 3), no fuso -03:00
+
+def test_turno_no_mesmo_dia(banco, relogio, consultor):
+    consultor_id = consultor([(3, "09:00", "18:00")])
+
+    relogio("2024-06-05T08:59:50-03:00", "2024-06-05T09:00:10-03:00")
+    assert _status(banco, consultor_id).status_online is True
+
+    relogio("2024-06-05T17:59:50-03:00", "2024-06-05T18:00:10-03:00")
+    assert _status(banco, consultor_id).status_online is False
+
+
+def test_turno_que_atravessa_a_meia_noite(banco, relogio, consultor):
+    consultor_id = consultor([(3, "22:00", "02:00")])
+
+    relogio("2024-06-05T21:59:50-03:00", "2024-06-06T01:00:00-03:00")
+    assert _status(banco, consultor_id).status_online is True
+
+    relogio("2024-06-06T01:59:50-03:00", "2024-06-06T02:00:10-03:00")
+    assert _status(banco, consultor_id).status_online is False
+
+
+def test_virada_de_domingo_para_segunda(banco, relogio, consultor):
+    # Domingo 22:00 até segunda 02:00, e um turno que começa segunda 00:00
+    noturno = consultor([(7, "22:00", "02:00")], online=True)
+    madrugada = consultor([(1, "00:00", "08:00")])
+
+    relogio("2024-06-09T23:59:50-03:00", "2024-06-10T00:00:10-03:00")
+    assert _status(banco, noturno).status_online is True
+    assert _status(banco, madrugada).status_online is True
+
+    relogio("2024-06-10T01:59:50-03:00", "2024-06-10T02:00:10-03:00")
+    assert _status(banco, noturno).status_online is False
+    assert _status(banco, madrugada).status_online is True
+
+
+def test_override_ignora_a_fronteira_e_vence_para_a_escala(banco, relogio, consultor):
+    consultor_id = consultor([(3, "09:00", "18:00")], override_ate="2024-06-05T10:00:00-03:00")
+
+    # O início do turno acontece durante o override
+    relogio("2024-06-05T08:59:50-03:00", "2024-06-05T09:00:10-03:00")
+    status = _status(banco, consultor_id)
+    assert status.status_online is False
+    assert status.status_override_ate is not None
+
+    # Ao vencer, o consultor volta ao estado da escala
+    relogio("2024-06-05T09:59:50-03:00", "2024-06-05T10:00:10-03:00")
+    status = _status(banco, consultor_id)
+    assert status.status_online is True
+    assert status.status_override_ate is None
+
+
+def test_override_vencido_sem_escala_volta_ao_status_anterior(banco, relogio, consultor):
+    consultor_id = consultor([], online=True, override_ate="2024-06-05T10:00:00-03:00")
+
+    relogio("2024-06-05T09:59:50-03:00", "2024-06-05T10:00:10-03:00")
+    status = _status(banco, consultor_id)
+    assert status.status_online is False
+    assert status.status_override_ate is None
+
+
+def test_sem_fronteiras_na_janela_nao_altera_nada(banco, relogio, consultor):
+    consultor_id = consultor([(3, "09:00", "18:00")], online=True)
+
+    assert relogio("2024-06-05T12:00:00-03:00", "2024-06-05T12:00:15-03:00") == 0
+    assert _status(banco, consultor_id).status_online is True
+
+
+def test_status_no_put_do_consultor_descarta_o_override(banco, consultor):
+    from database import SessionLocal
+
+    consultor_id = consultor([], override_ate="2099-01-01T00:00:00+00:00")
+    db = SessionLocal()
+    try:
+        models.atualizar_consultor(db, consultor_id, schemas.ConsultorUpdate(status_online=True))
+    finally:
+        db.close()
+
+    status = _status(banco, consultor_id)
+    assert status.status_online is True
+    assert status.status_override_ate is None
@@ -0,0 +1,78 @@
+"""
+Relatório de justiça do rodízio a partir do histórico de protocolos.
+
+Usa analise.py: lê os protocolos do período em lotes com cursor no servidor
+e mostra, por idioma, a dispersão dos protocolos por consultor (média,
+variância, Gini), a relação com as horas de escala e os intervalos entre
+atribuições. Com --saida, grava as tabelas em Parquet (se o pyarrow estiver
+instalado) ou CSV.
+
+Uso:
+    python tools/analisar_distribuicao.py --dias 90
+    python tools/analisar_distribuicao.py --desde 2024-01-01 --ate 2024-04-01 --saida relatorio/
+    python tools/analisar_distribuicao.py --dias 365 --saida relatorio/ --formato csv --lote 100000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analise  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Análise da justiça do rodízio")
+    parser.add_argument("--desde", type=date.fromisoformat, help="Primeiro dia (padrão: --dias antes de --ate)")
+    parser.add_argument("--ate", type=date.fromisoformat, help="Dia seguinte ao último (padrão: hoje)")
+    parser.add_argument("--dias", type=int, default=90)
+    parser.add_argument("--lote", type=int, default=analise.ANALISE_LOTE, help="Linhas por lote do cursor")
+    parser.add_argument("--saida", help="Diretório para gravar consultores, idiomas e intervalos")
+    parser.add_argument("--formato", choices=("auto", "parquet", "csv"), default="auto")
+    args = parser.parse_args()
+
+    fuso = os.getenv("TURNOS_TIMEZONE", "America/Sao_Paulo")
+    ate = args.ate or datetime.now(ZoneInfo(fuso)).date()
+    desde = args.desde or ate - timedelta(days=args.dias)
+
+    from database import engine
+
+    inicio = time.perf_counter()
+    resultado = analise.analisar(engine, desde, ate, fuso, args.lote)
+    duracao = time.perf_counter() - inicio
+
+    print(f"{resultado.protocolos} protocolos de {desde} a {ate} (exclusive) em {duracao:.2f}s")
+    populacao = resultado.consultores["na_populacao"]
+    print(
+        f"{int(populacao.sum())} consultores no rodízio do período; {int((~populacao).sum())} sem "
+        f"protocolos, escala nem participação na sequência ficaram fora das estatísticas\n"
+    )
+    idiomas = resultado.idiomas
+    print(
+        f"{'idioma':<10} {'cons.':>6} {'protocolos':>11} {'média':>9} {'variância':>11} "
+        f"{'gini':>6} {'c/ escala':>10} {'gini/h':>7} {'interv. p50':>12} {'p95':>9} {'p99':>9}"
+    )
+    for i in range(idiomas["idioma"].size):
+        print(
+            f"{idiomas['idioma'][i]:<10} {idiomas['consultores'][i]:>6.0f} {idiomas['protocolos'][i]:>11.0f} "
+            f"{idiomas['media'][i]:>9.1f} {idiomas['variancia'][i]:>11.1f} {idiomas['gini'][i]:>6.3f} "
+            f"{idiomas['consultores_com_escala'][i]:>10.0f} {idiomas['gini_por_hora'][i]:>7.3f} "
+            f"{idiomas['intervalo_p50_h'][i]:>10.2f} h {idiomas['intervalo_p95_h'][i]:>7.2f} h "
+            f"{idiomas['intervalo_p99_h'][i]:>7.2f} h"
+        )
+    r = resultado.resumo_intervalos
+    print(
+        f"\nIntervalos entre atribuições: {r['quantidade']} | "
+        f"p50 {r['p50_h']:.2f} h | p95 {r['p95_h']:.2f} h | p99 {r['p99_h']:.2f} h"
+    )
+
+    if args.saida:
+        for arquivo in analise.exportar(resultado, args.saida, args.formato):
+            print(f"Gravado {arquivo}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark de latência da distribuição por driver do PostgreSQL.
+
+Executa o comando de get_consultor_da_vez (seleção do consultor, geração do
+protocolo e evento da outbox) em uma sessão de distribuição, com os timeouts
+da rota, e desfaz a transação ao final de cada iteração, sem alterar dados.
+
+Cada driver é medido em um processo separado com DB_DRIVER definido, para
+usar exatamente a configuração de database.py (com o psycopg 3, prepared
+statements e pipeline).
+
+Uso:
+    python tools/bench_dispatch.py [--iteracoes 2000] [--drivers psycopg2,psycopg]
+
+Usa o banco configurado no .env e apaga o consultor criado ao final.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IDIOMA_BENCHMARK = "zz-bench"
+
+
+def medir(iteracoes: int, aquecimento: int) -> None:
+    """
+    Mede a distribuição com o driver de DB_DRIVER e imprime o resumo.
+    """
+    import database
+    import models
+
+    get_db_dispatch = database.get_db_for("dispatch")
+
+    def distribuir() -> float:
+        sessoes = get_db_dispatch()
+        db = next(sessoes)
+        try:
+            inicio = time.perf_counter()
+            row = db.execute(models._SQL_CONSULTOR_DA_VEZ, {"idioma": IDIOMA_BENCHMARK}).fetchone()
+            db.rollback()
+            tempo = (time.perf_counter() - inicio) * 1000
+        finally:
+            sessoes.close()
+        if row is None:
+            raise RuntimeError(f"Nenhum consultor elegível para o idioma {IDIOMA_BENCHMARK}")
+        return tempo
+
+    # Aquece o pool e, no psycopg 3, atinge o limite de preparação dos comandos
+    for _ in range(aquecimento):
+        distribuir()
+
+    tempos = sorted(distribuir() for _ in range(iteracoes))
+    detalhes = ""
+    if database.DB_DRIVER == "psycopg":
+        detalhes = f" (prepare_threshold={database.DB_PREPARE_THRESHOLD}, pipeline={database.DB_PIPELINE})"
+    print(
+        f"{database.DB_DRIVER + detalhes:<50} "
+        f"média {statistics.mean(tempos):7.3f} ms | "
+        f"p50 {tempos[len(tempos) // 2]:7.3f} ms | "
+        f"p95 {tempos[int(len(tempos) * 0.95)]:7.3f} ms | "
+        f"p99 {tempos[int(len(tempos) * 0.99)]:7.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da distribuição por driver")
+    parser.add_argument("--iteracoes", type=int, default=2000)
+    parser.add_argument("--aquecimento", type=int, default=50)
+    parser.add_argument("--drivers", default="psycopg2,psycopg", help="Drivers separados por vírgula")
+    parser.add_argument("--medir", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        medir(args.iteracoes, args.aquecimento)
+        return
+
+    import models
+    import schemas
+    from database import SessionLocal
+    from sqlalchemy import text
+
+    db = SessionLocal()
+    consultor = models.criar_consultor(db, schemas.ConsultorCreate(
+        nome="Benchmark Distribuição",
+        idiomas=[IDIOMA_BENCHMARK],
+        status_online=True
+    ))
+    db.close()
+
+    try:
+        for driver in args.drivers.split(","):
+            subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__), "--medir",
+                    "--iteracoes", str(args.iteracoes),
+                    "--aquecimento", str(args.aquecimento)
+                ],
+                env={**os.environ, "DB_DRIVER": driver.strip()},
+                check=True
+            )
+    finally:
+        # deletar_consultor só marca a remoção (o purge apaga depois da carência);
+        # o consultor do benchmark é apagado na hora, com os protocolos e turnos
+        db = SessionLocal()
+        db.execute(text("DELETE FROM consultores WHERE id = :id"), {"id": consultor.id})
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark de latência das escritas de consultor.
+
+Compara o padrão antigo (SELECT, alteração no objeto, commit e refresh)
+com as funções de models.py, que usam um único UPDATE ... RETURNING.
+
+Uso:
+    python tools/bench_writes.py [--iteracoes 500]
+
+Usa o banco configurado no .env e apaga o consultor criado ao final.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instrumentation
+import models
+import schemas
+from database import SessionLocal, engine
+from sqlalchemy import text
+
+
+def _legado_atualizar_consultor(db, consultor_id, consultor):
+    db_consultor = models.get_consultor(db, consultor_id)
+    for key, value in consultor.dict(exclude_unset=True).items():
+        setattr(db_consultor, key, value)
+    db.commit()
+    db.refresh(db_consultor)
+    return db_consultor
+
+
+def _legado_atualizar_status_conexao(db, consultor_id, online):
+    db_consultor = models.get_consultor(db, consultor_id)
+    db_consultor.status_online = online
+    db.commit()
+    db.refresh(db_consultor)
+    return db_consultor
+
+
+def medir(nome, funcao, iteracoes):
+    """
+    Executa a função `iteracoes` vezes, cada uma em uma sessão nova.
+    """
+    tempos = []
+    queries = 0
+    for i in range(iteracoes):
+        estatisticas = instrumentation.iniciar_requisicao()
+        db = SessionLocal()
+        try:
+            inicio = time.perf_counter()
+            funcao(db, i)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            db.close()
+        queries += estatisticas.queries
+
+    tempos.sort()
+    print(
+        f"{nome:<40} "
+        f"média {statistics.mean(tempos):7.2f} ms | "
+        f"p50 {tempos[len(tempos) // 2]:7.2f} ms | "
+        f"p95 {tempos[int(len(tempos) * 0.95)]:7.2f} ms | "
+        f"queries/op {queries / iteracoes:.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das escritas de consultor")
+    parser.add_argument("--iteracoes", type=int, default=500)
+    args = parser.parse_args()
+
+    instrumentation.instalar(engine)
+
+    db = SessionLocal()
+    consultor = models.criar_consultor(db, schemas.ConsultorCreate(
+        nome="Benchmark Escritas",
+        idiomas=["zz"],
+        status_ativo_sequencial=False
+    ))
+    db.close()
+    consultor_id = consultor.id
+
+    try:
+        # Aquece o pool de conexões
+        medir("aquecimento", lambda db, i: models.get_consultor(db, consultor_id), 20)
+        print()
+
+        medir(
+            "atualizar_consultor (legado)",
+            lambda db, i: _legado_atualizar_consultor(db, consultor_id, schemas.ConsultorUpdate(nome=f"Benchmark {i}")),
+            args.iteracoes
+        )
+        medir(
+            "atualizar_consultor (RETURNING)",
+            lambda db, i: models.atualizar_consultor(db, consultor_id, schemas.ConsultorUpdate(nome=f"Benchmark {i}")),
+            args.iteracoes
+        )
+        medir(
+            "atualizar_status_conexao (legado)",
+            lambda db, i: _legado_atualizar_status_conexao(db, consultor_id, i % 2 == 0),
+            args.iteracoes
+        )
+        medir(
+            "atualizar_status_conexao (RETURNING)",
+            lambda db, i: models.atualizar_status_conexao(db, consultor_id, i % 2 == 0),
+            args.iteracoes
+        )
+    finally:
+        # deletar_consultor só marca a remoção (o purge apaga depois da carência);
+        # o consultor do benchmark é apagado na hora, com os protocolos e turnos
+        db = SessionLocal()
+        db.execute(text("DELETE FROM consultores WHERE id = :id"), {"id": consultor_id})
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
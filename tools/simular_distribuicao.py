@@ -0,0 +1,430 @@
+"""
+Simulador de eventos discretos da distribuição de leads.
+
+Reproduz, em memória, a regra de get_consultor_da_vez (as mesmas funções
+`elegivel` e `chave_fila` de availability.py): o lead de um idioma vai para o
+consultor elegível com atendimento mais antigo, com o menor id no empate.
+Serve para prever espera e carga por consultor antes de mudar regras de
+rodízio ou a equipe.
+
+Modelo:
+- Chegadas: processo de Poisson com uma taxa por hora da semana, gerado de
+  uma vez com NumPy. As taxas vêm do histórico de protocolos (--dias) ou de
+  uma taxa fixa (--taxa); a mistura de idiomas vem dos eventos de atribuição
+  da outbox ou de --idiomas. Esses eventos só existem com CRM_WEBHOOK_URL
+  configurada e os entregues são apagados após OUTBOX_RETENTION_DAYS (7), então
+  a mistura cobre no máximo esse período, mesmo com um --dias maior. Sem
+  nenhum evento, o simulador avisa e divide os leads igualmente entre os
+  idiomas da equipe; prefira informar --idiomas.
+- Consultores: os cadastrados no banco, com status_online seguindo a escala
+  de turnos (quem não tem turnos mantém o status atual), ou uma equipe
+  sintética (--equipe), sempre online.
+- Atendimento: cada consultor atende seus leads em ordem de chegada, com
+  duração exponencial de média --atendimento-min. A distribuição não olha a
+  fila do consultor, então a espera é o tempo até ele ficar livre. Leads já
+  atribuídos são atendidos mesmo depois do fim do turno.
+
+Leads sem consultor elegível contam como "sem consultor" (404 na API).
+
+Uso:
+    python tools/simular_distribuicao.py --dias 28 --semanas 4
+    python tools/simular_distribuicao.py --dias 28 --escala 1.3 --atendimento-min 20
+    python tools/simular_distribuicao.py --equipe "pt:30,pt+en:8,es+pt:4" \\
+        --taxa 300 --horas 5000 --idiomas "pt=0.8,en=0.15,es=0.05"
+"""
+import argparse
+import heapq
+import os
+import sys
+import time
+from dataclasses import dataclass, replace
+from datetime import date, datetime, time as hora, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import availability  # noqa: E402
+import estatisticas  # noqa: E402
+from availability import EstadoConsultor, chave_fila, elegivel  # noqa: E402
+
+HORAS_SEMANA = 168
+# Compacta o heap de um idioma quando as entradas desatualizadas passam deste múltiplo
+FATOR_COMPACTACAO = 2
+
+
+@dataclass
+class Turno:
+    consultor_id: int
+    dia_semana: int  # 1 = segunda ... 7 = domingo
+    inicio: hora
+    fim: hora
+
+
+@dataclass
+class Resultado:
+    idiomas: List[str]
+    consultores: List[EstadoConsultor]
+    codigos: np.ndarray         # idioma de cada lead (índice em `idiomas`)
+    atribuido: np.ndarray       # índice do consultor de cada lead, -1 sem consultor
+    espera_s: np.ndarray        # espera de cada lead atribuído (NaN sem consultor)
+    segundos_online: np.ndarray # tempo elegível de cada consultor
+    duracao_s: float
+
+
+def gerar_chegadas(rng: np.random.Generator, taxas_hora: np.ndarray, hora_inicial: int,
+                   horas: int, escala: float = 1.0) -> np.ndarray:
+    """
+    Instantes de chegada (segundos desde o início) de um Poisson com taxa
+    constante em cada hora. `taxas_hora` tem 168 posições, a partir de segunda
+    00h, e `hora_inicial` é a posição da primeira hora simulada.
+    """
+    indices = (hora_inicial + np.arange(horas)) % HORAS_SEMANA
+    quantidades = rng.poisson(taxas_hora[indices] * escala)
+    inicio_hora = np.repeat(np.arange(horas, dtype=np.float64) * 3600.0, quantidades)
+    chegadas = inicio_hora + rng.random(inicio_hora.size) * 3600.0
+    chegadas.sort()
+    return chegadas
+
+
+def transicoes_turnos(turnos: Sequence[Turno], inicio: datetime, duracao_s: float
+                      ) -> Tuple[Dict[int, int], List[Tuple[float, int, int]]]:
+    """
+    Converte a escala semanal em entradas (+1) e saídas (-1) de turno em
+    segundos desde `inicio`. Retorna quantos turnos de cada consultor cobrem o
+    instante inicial e os eventos posteriores, como (instante, delta, consultor_id).
+    """
+    segunda = inicio.date() - timedelta(days=inicio.isoweekday() - 1)
+    semanas = int(duracao_s // (7 * 86400)) + 2
+    cobertura: Dict[int, int] = {}
+    eventos = []
+    for turno in turnos:
+        for semana in range(-1, semanas):
+            dia: date = segunda + timedelta(days=7 * semana + turno.dia_semana - 1)
+            dia_fim = dia + timedelta(days=1) if turno.fim <= turno.inicio else dia
+            entrada = (datetime.combine(dia, turno.inicio, inicio.tzinfo) - inicio).total_seconds()
+            saida = (datetime.combine(dia_fim, turno.fim, inicio.tzinfo) - inicio).total_seconds()
+            if saida <= 0 or entrada >= duracao_s:
+                continue
+            if entrada <= 0:
+                cobertura[turno.consultor_id] = cobertura.get(turno.consultor_id, 0) + 1
+            else:
+                eventos.append((entrada, 1, turno.consultor_id))
+            if saida < duracao_s:
+                eventos.append((saida, -1, turno.consultor_id))
+    return cobertura, eventos
+
+
+def simular(consultores: Sequence[EstadoConsultor], idiomas: List[str], inicio: datetime,
+            chegadas: np.ndarray, codigos: np.ndarray, atendimento_s: np.ndarray,
+            turnos: Sequence[Turno] = (), duracao_s: Optional[float] = None) -> Resultado:
+    """
+    Executa a simulação. Os eventos de turno ficam em um heap e as chegadas,
+    já ordenadas, são consumidas em sequência; cada idioma tem um heap com a
+    ordem da fila, com descarte preguiçoso de entradas desatualizadas, como
+    no índice de disponibilidade.
+    """
+    consultores = sorted(consultores, key=lambda c: c.id)
+    n = len(consultores)
+    posicao = {c.id: i for i, c in enumerate(consultores)}
+    codigo_idioma = {idioma: k for k, idioma in enumerate(idiomas)}
+    if duracao_s is None:
+        duracao_s = float(chegadas[-1]) if chegadas.size else 0.0
+
+    # Estado mutável em listas: acesso mais rápido que arrays no laço
+    estados = list(consultores)
+    ultimo = [(chave_fila(c)[0] - inicio).total_seconds() for c in consultores]
+    livre = [0.0] * n
+    idiomas_de = [[codigo_idioma[i] for i in c.idiomas if i in codigo_idioma] for c in consultores]
+    falantes = [sum(1 for l in idiomas_de if k in l) for k in range(len(idiomas))]
+    ativo = [elegivel(c) for c in consultores]
+    segundos_online = [0.0] * n
+    online_desde = [0.0] * n
+
+    com_turnos = {t.consultor_id for t in turnos if t.consultor_id in posicao}
+    cobertura, eventos = transicoes_turnos([t for t in turnos if t.consultor_id in posicao], inicio, duracao_s)
+    contagem = [0] * n
+    for consultor_id in com_turnos:
+        i = posicao[consultor_id]
+        contagem[i] = cobertura.get(consultor_id, 0)
+        estados[i] = replace(estados[i], status_online=contagem[i] > 0)
+        ativo[i] = elegivel(estados[i])
+    eventos = [(t, delta, posicao[c]) for t, delta, c in eventos]
+    heapq.heapify(eventos)
+
+    filas: List[List[Tuple[float, int]]] = [[] for _ in idiomas]
+    for i in range(n):
+        if ativo[i]:
+            for k in idiomas_de[i]:
+                filas[k].append((ultimo[i], i))
+    for fila in filas:
+        heapq.heapify(fila)
+
+    heappush, heappop, heapreplace = heapq.heappush, heapq.heappop, heapq.heapreplace
+    tempos = chegadas.tolist()
+    codigos = np.asarray(codigos).tolist()
+    atendimento = atendimento_s.tolist()
+    atribuido = [-1] * len(tempos)
+    espera = [float("nan")] * len(tempos)
+
+    def aplicar_transicoes(ate: float) -> None:
+        while eventos and eventos[0][0] <= ate:
+            instante, delta, i = heappop(eventos)
+            contagem[i] += delta
+            online = contagem[i] > 0
+            if online == estados[i].status_online:
+                continue
+            estados[i] = replace(estados[i], status_online=online)
+            era_ativo, ativo[i] = ativo[i], elegivel(estados[i])
+            if ativo[i] and not era_ativo:
+                online_desde[i] = instante
+                for k in idiomas_de[i]:
+                    heappush(filas[k], (ultimo[i], i))
+            elif era_ativo and not ativo[i]:
+                segundos_online[i] += instante - online_desde[i]
+
+    for j, t in enumerate(tempos):
+        if eventos and eventos[0][0] <= t:
+            aplicar_transicoes(t)
+        k = codigos[j]
+        fila = filas[k]
+        while fila:
+            chave, i = fila[0]
+            if ativo[i] and ultimo[i] == chave:
+                break
+            heappop(fila)
+        else:
+            continue
+
+        # Atribui e move o consultor para o fim da fila em todos os seus idiomas
+        ultimo[i] = t
+        heapreplace(fila, (t, i))
+        for outro in idiomas_de[i]:
+            if outro != k:
+                outra_fila = filas[outro]
+                heappush(outra_fila, (t, i))
+                if len(outra_fila) > FATOR_COMPACTACAO * falantes[outro] + 64:
+                    outra_fila[:] = [(ultimo[x], x) for x in range(n) if ativo[x] and outro in idiomas_de[x]]
+                    heapq.heapify(outra_fila)
+        comeco = livre[i] if livre[i] > t else t
+        livre[i] = comeco + atendimento[j]
+        espera[j] = comeco - t
+        atribuido[j] = i
+
+    aplicar_transicoes(duracao_s)
+    for i in range(n):
+        if ativo[i]:
+            segundos_online[i] += duracao_s - online_desde[i]
+
+    return Resultado(
+        idiomas=idiomas,
+        consultores=consultores,
+        codigos=np.asarray(codigos),
+        atribuido=np.asarray(atribuido, dtype=np.int64),
+        espera_s=np.asarray(espera, dtype=np.float64),
+        segundos_online=np.asarray(segundos_online, dtype=np.float64),
+        duracao_s=duracao_s
+    )
+
+
+def relatorio(resultado: Resultado) -> List[dict]:
+    """
+    Espera e justiça da distribuição por idioma e no total.
+
+    A justiça considera os consultores que falam o idioma e ficaram elegíveis
+    em algum momento: Gini dos leads recebidos e dos leads por hora online.
+    """
+    n = len(resultado.consultores)
+    horas_online = resultado.segundos_online / 3600.0
+    linhas = []
+    grupos = [(idioma, resultado.codigos == k) for k, idioma in enumerate(resultado.idiomas)]
+    grupos.append(("total", np.ones(resultado.codigos.size, dtype=bool)))
+    for idioma, mascara in grupos:
+        atribuidos = resultado.atribuido[mascara]
+        ok = atribuidos >= 0
+        espera_min = resultado.espera_s[mascara][ok] / 60.0
+        falam = np.array([
+            idioma == "total" or idioma in c.idiomas for c in resultado.consultores
+        ], dtype=bool) & (horas_online > 0)
+        por_consultor = np.bincount(atribuidos[ok], minlength=n)[falam]
+        por_hora = por_consultor / horas_online[falam]
+        espera = estatisticas.resumo(espera_min)
+        linhas.append({
+            "idioma": idioma,
+            "leads": int(mascara.sum()),
+            "sem_consultor": int((~ok).sum()),
+            "consultores": int(falam.sum()),
+            "espera_media_min": espera["media"],
+            "espera_p50_min": espera["p50"],
+            "espera_p95_min": espera["p95"],
+            "espera_p99_min": espera["p99"],
+            "leads_por_consultor_min": int(por_consultor.min()) if por_consultor.size else 0,
+            "leads_por_consultor_max": int(por_consultor.max()) if por_consultor.size else 0,
+            "gini_leads": estatisticas.gini(por_consultor),
+            "gini_leads_por_hora": estatisticas.gini(por_hora)
+        })
+    return linhas
+
+
+def imprimir(linhas: List[dict]) -> None:
+    print(
+        f"{'idioma':<10} {'leads':>10} {'sem cons.':>10} {'cons.':>6} "
+        f"{'espera méd':>11} {'p50':>8} {'p95':>8} {'p99':>8} "
+        f"{'leads/cons.':>15} {'gini':>6} {'gini/h':>7}"
+    )
+    for l in linhas:
+        print(
+            f"{l['idioma']:<10} {l['leads']:>10} {l['sem_consultor']:>10} {l['consultores']:>6} "
+            f"{l['espera_media_min']:>9.1f}min {l['espera_p50_min']:>8.1f} "
+            f"{l['espera_p95_min']:>8.1f} {l['espera_p99_min']:>8.1f} "
+            f"{str(l['leads_por_consultor_min']) + '-' + str(l['leads_por_consultor_max']):>15} "
+            f"{l['gini_leads']:>6.3f} {l['gini_leads_por_hora']:>7.3f}"
+        )
+
+
+def _pares(valor: str, separador: str) -> List[Tuple[str, str]]:
+    pares = []
+    for item in valor.split(","):
+        if item.strip():
+            chave, _, resto = item.strip().partition(separador)
+            pares.append((chave.strip(), resto.strip()))
+    return pares
+
+
+def equipe_sintetica(especificacao: str) -> List[EstadoConsultor]:
+    """
+    Monta a equipe a partir de grupos "idiomas:quantidade", como "pt:30,pt+en:8".
+    """
+    consultores = []
+    for idiomas, quantidade in _pares(especificacao, ":"):
+        for _ in range(int(quantidade)):
+            consultores.append(EstadoConsultor(
+                id=len(consultores) + 1,
+                nome=f"Simulado {len(consultores) + 1}",
+                idiomas=tuple(idiomas.split("+")),
+                status_ativo=True,
+                status_ativo_sequencial=True,
+                status_online=True,
+                ultimo_atendimento=None
+            ))
+    return consultores
+
+
+def carregar_banco(dias: int, fuso: str):
+    """
+    Lê do banco os consultores, a escala de turnos, as chegadas por hora da
+    semana (média das últimas `dias`) e a mistura de idiomas das atribuições.
+    """
+    from sqlalchemy import text
+
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        consultores = [EstadoConsultor.da_linha(row) for row in db.execute(availability._SQL_CARREGAR).mappings()]
+        turnos = [Turno(*row) for row in db.execute(text("""
+            SELECT t.consultor_id, t.dia_semana, t.inicio, t.fim
+            FROM turnos_consultor t
+            JOIN consultores c ON c.id = t.consultor_id AND c.deleted_at IS NULL
+        """))]
+        contagens = db.execute(text("""
+            SELECT
+                (EXTRACT(ISODOW FROM created_at AT TIME ZONE :fuso) - 1) * 24
+                    + EXTRACT(HOUR FROM created_at AT TIME ZONE :fuso) AS hora_semana,
+                COUNT(*) AS quantidade
+            FROM protocolos
+            WHERE created_at >= NOW() - make_interval(days => :dias)
+            GROUP BY 1
+        """), {"fuso": fuso, "dias": dias}).all()
+        mistura = db.execute(text("""
+            SELECT payload->>'idioma' AS idioma, COUNT(*) AS quantidade
+            FROM outbox_eventos
+            WHERE tipo = 'consultor.atribuido'
+            AND criado_em >= NOW() - make_interval(days => :dias)
+            GROUP BY 1
+        """), {"dias": dias}).all()
+    finally:
+        db.close()
+
+    taxas = np.zeros(HORAS_SEMANA)
+    for hora_semana, quantidade in contagens:
+        taxas[int(hora_semana)] = quantidade / (dias / 7.0)
+    return consultores, turnos, taxas, {idioma: float(q) for idioma, q in mistura if idioma}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulação da distribuição de leads")
+    parser.add_argument("--dias", type=int, default=28, help="Janela do histórico de chegadas no banco")
+    parser.add_argument("--taxa", type=float, help="Leads por hora constantes (em vez do histórico)")
+    parser.add_argument("--idiomas", help='Mistura de idiomas, como "pt=0.8,en=0.2" (em vez da outbox)')
+    parser.add_argument("--equipe", help='Equipe sintética, como "pt:30,pt+en:8" (em vez do banco)')
+    parser.add_argument("--semanas", type=float, default=4, help="Período simulado")
+    parser.add_argument("--horas", type=int, help="Período simulado em horas (substitui --semanas)")
+    parser.add_argument("--escala", type=float, default=1.0, help="Multiplicador das taxas de chegada")
+    parser.add_argument("--atendimento-min", type=float, default=15.0, help="Duração média do atendimento")
+    parser.add_argument(
+        "--inicio", help="Início da simulação (ISO; sem fuso, no fuso dos turnos); padrão: próxima segunda 00h"
+    )
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    fuso = ZoneInfo(os.getenv("TURNOS_TIMEZONE", "America/Sao_Paulo"))
+    if args.inicio:
+        inicio = datetime.fromisoformat(args.inicio)
+        # Sem fuso, a data está no fuso dos turnos; com fuso, é convertida para ele
+        inicio = inicio.replace(tzinfo=fuso) if inicio.tzinfo is None else inicio.astimezone(fuso)
+    else:
+        hoje = datetime.now(fuso).date()
+        inicio = datetime.combine(hoje + timedelta(days=8 - hoje.isoweekday()), datetime.min.time(), fuso)
+    inicio = inicio.replace(minute=0, second=0, microsecond=0)
+    horas = args.horas or int(args.semanas * HORAS_SEMANA)
+
+    consultores, turnos, taxas, mistura = [], [], None, {}
+    if args.equipe is None or args.taxa is None:
+        consultores, turnos, taxas, mistura = carregar_banco(args.dias, str(fuso))
+    if args.equipe:
+        consultores, turnos = equipe_sintetica(args.equipe), []
+    if args.taxa is not None:
+        taxas = np.full(HORAS_SEMANA, args.taxa)
+    if args.idiomas:
+        mistura = {idioma: float(peso) for idioma, peso in _pares(args.idiomas, "=")}
+    if not mistura:
+        # Sem histórico de atribuições: divide igualmente entre os idiomas da equipe
+        mistura = {idioma: 1.0 for c in consultores for idioma in c.idiomas}
+        if mistura:
+            print(
+                "AVISO: nenhum evento consultor.atribuido na outbox (requer CRM_WEBHOOK_URL; os entregues "
+                "são apagados após OUTBOX_RETENTION_DAYS). Dividindo os leads igualmente entre "
+                f"{', '.join(sorted(mistura))}; use --idiomas para informar a mistura.",
+                file=sys.stderr
+            )
+    if not consultores or not mistura:
+        parser.error("nenhum consultor ou idioma para simular")
+
+    idiomas = sorted(mistura)
+    pesos = np.array([mistura[i] for i in idiomas])
+    rng = np.random.default_rng(args.seed)
+
+    gerar = time.perf_counter()
+    hora_inicial = (inicio.isoweekday() - 1) * 24 + inicio.hour
+    chegadas = gerar_chegadas(rng, taxas, hora_inicial, horas, args.escala)
+    codigos = rng.choice(len(idiomas), size=chegadas.size, p=pesos / pesos.sum())
+    atendimento_s = rng.exponential(args.atendimento_min * 60.0, size=chegadas.size)
+
+    simular_inicio = time.perf_counter()
+    resultado = simular(consultores, idiomas, inicio, chegadas, codigos, atendimento_s,
+                        turnos, duracao_s=horas * 3600.0)
+    fim = time.perf_counter()
+
+    print(
+        f"{chegadas.size} leads em {horas} h a partir de {inicio.isoformat()}, "
+        f"{len(consultores)} consultores ({len(turnos)} turnos) | "
+        f"geração {simular_inicio - gerar:.2f}s, simulação {fim - simular_inicio:.2f}s\n"
+    )
+    imprimir(relatorio(resultado))
+
+
+if __name__ == "__main__":
+    main()